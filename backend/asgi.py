@@ -0,0 +1,445 @@
+# asgi.py - Асинхронная версия (ASGI): hypercorn asgi:app
+#
+# Маршруты, которые в основном ждут AI-провайдеров (/api/transcribe, /api/review, /api/review/stream,
+# /api/translate), обслуживаются нативно асинхронно (Quart): AsyncGroq, generate_content_async Gemini,
+# edge_tts без вложенных asyncio.run, ffmpeg через asyncio-подпроцесс, пользователь и статистика — через
+# async SQLAlchemy (aiosqlite/asyncpg). Ожидание провайдера не занимает поток, так что один процесс держит
+# сотни одновременных вызовов (ограничены только лимитами services/gateway.py).
+#
+# Шаги проверки, перевода и озвучки (кандидаты Gemini, фолбэк, фрагменты, план голосов) общие с app.py —
+# services/pipeline.py; здесь только транспорт (_aperform: await вместо блокирующих вызовов). Хуки запроса
+# используют те же функции ratelimit и read_routing, что и Flask-приложение.
+#
+# Остальные маршруты (записи, auth, экспорт, Telegram, /metrics) — то же Flask-приложение из app.py,
+# выполняемое в пуле потоков (ASYNC_WSGI_THREADS); JSON-контракты и коды ответов одинаковы в обоих режимах.
+# Режим выбирается при запуске: SERVER_MODE=async в Dockerfile (по умолчанию sync — gunicorn app:app).
+import asyncio
+import contextvars
+import os
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from hypercorn.middleware import AsyncioWSGIMiddleware
+from quart import Quart, Response, g, request, jsonify
+from quart.wrappers.response import DataBody
+from sqlalchemy import select
+
+import app as sync_app
+from db import User, get_async_sessionmaker
+from services import audio_store, compression, gateway, json_provider, logs, metrics, pipeline, prompts, providers, ratelimit, read_routing, stats, stt, tts_speculation, vocabulary
+
+ASYNC_ROUTES = frozenset(['/api/transcribe', '/api/review', '/api/review/stream', '/api/translate'])
+ASYNC_WSGI_THREADS = int(os.getenv('ASYNC_WSGI_THREADS', '32'))
+
+log_transcribe = logs.get_logger('transcribe')
+log_review = logs.get_logger('review')
+
+# Расход токенов Gemini текущего запроса; задачи asyncio наследуют контекст, поэтому чанки пишут в тот же ledger
+_usage: contextvars.ContextVar = contextvars.ContextVar('gemini_usage', default=None)
+
+aio = Quart(__name__)
+aio.config['MAX_CONTENT_LENGTH'] = sync_app.app.config['MAX_CONTENT_LENGTH']
+aio.json = json_provider.FastJSONProvider(aio)
+
+
+# --- Providers ---
+
+async def _provider_call(provider: str, target: str, fn, *args, **kwargs):
+    with metrics.stage(provider, target):
+        return await gateway.acall(provider, fn, *args, **kwargs)
+
+
+async def _gemini_generate(model, prompt: str, on_partial=None):
+    """Как app._gemini_generate, но через generate_content_async (поток — async for)."""
+    model_name = getattr(model, 'model_name', '') or ''
+
+    async def _stream():
+        resp = await model.generate_content_async(prompt, stream=True)
+        async for chunk in resp:
+            try:
+                delta = chunk.text
+            except Exception:
+                delta = ''
+            if delta:
+                on_partial(delta)
+        return resp
+
+    if on_partial is None:
+        resp = await _provider_call('gemini', model_name, model.generate_content_async, prompt)
+    else:
+        resp = await _provider_call('gemini', model_name, _stream)
+    ledger = _usage.get()
+    if ledger is not None:
+        ledger.add(*prompts.usage_from_response(resp, prompt))
+    return resp
+
+
+async def _aperform(op):
+    """Транспорт шагов services/pipeline.py в async-режиме: Gemini и edge_tts ожидаются в цикле,
+    gTTS (requests) и local_tts (CPU) — в пуле потоков."""
+    if isinstance(op, pipeline.Generate):
+        return await _gemini_generate(op.model, op.prompt, on_partial=op.on_partial)
+    if op.provider == 'local_tts':
+        return await _provider_call('local_tts', op.target, asyncio.to_thread,
+                                    providers.get_local_tts().synthesize, op.text, op.target)
+    if op.provider == 'edge_tts':
+        return await _provider_call('edge_tts', op.target, sync_app._edge_tts_bytes, providers.get_edge_tts(),
+                                    op.text, op.target)
+    return await _provider_call('gtts', op.target, asyncio.to_thread, sync_app._gtts_bytes, providers.get_gtts(),
+                                op.text, op.target)
+
+
+@metrics.instrument('review_total')
+async def review_text(text: str, language: str, ui_language: str = 'ru', on_partial=None):
+    return await pipeline.arun(pipeline.review_text_steps(text, language, ui_language, on_partial=on_partial), _aperform)
+
+
+@metrics.instrument('translate_total')
+async def translate_text(text: str, from_language: str, to_language: str, fmt: str = 'text'):
+    return await pipeline.arun(pipeline.translate_text_steps(text, from_language, to_language, fmt), _aperform)
+
+
+@metrics.instrument('tts_total')
+async def synthesize_tts(text: str, language: str):
+    """app.synthesize_tts: тот же план голосов (app._tts_plan) и те же шаги, вызовы ожидаются в цикле."""
+    return await pipeline.arun(
+        pipeline.tts_steps(text, sync_app._tts_plan(language), lambda: sync_app._tts_exhausted(language)), _aperform)
+
+
+# --- Database (async SQLAlchemy) ---
+
+async def _current_user_id(token):
+    uid = sync_app._token_user_id(token)
+    if uid is None:
+        return None
+    async with get_async_sessionmaker()() as session:
+        return await session.scalar(select(User.id).where(User.id == uid))
+
+
+async def _write(fn):
+    """fn(session) — синхронные хелперы services/* поверх AsyncSession (run_sync), затем commit."""
+    async with get_async_sessionmaker()() as session:
+        try:
+            await session.run_sync(fn)
+            await session.commit()
+        except Exception:
+            await session.rollback()
+            raise
+
+
+async def _record_review_stats(token, language: str, changed: bool, original: str = '', corrected: str = ''):
+    def _record(db):
+        stats.review_recorded(db, user_id, language, changed)
+        if changed:
+            vocabulary.review_recorded(db, user_id, language, original, corrected)
+
+    try:
+        user_id = await _current_user_id(token)
+        if user_id is not None:
+            await _write(_record)
+            read_routing.remember_write(user_id)
+    except Exception as e:
+        log_review.warning('stats update error', error=str(e))
+
+
+async def _record_gemini_usage(ledger, token, path: str):
+    if ledger is None or not ledger.calls:
+        return
+    try:
+        user_id = await _current_user_id(token)
+        await _write(lambda db: prompts.record(db, user_id, path, ledger))
+    except Exception as e:
+        logs.get_logger('usage').warning('token usage flush error', error=str(e))
+
+
+# --- Request hooks: request id, deadline, CORS, metrics ---
+
+@aio.before_request
+async def _start_request():
+    g.metrics_started = time.perf_counter()
+    logs.set_request_id(logs.new_request_id(request.headers.get('X-Request-ID')))
+    gateway.set_deadline(gateway.request_timeout(request.headers.get('X-Request-Timeout')))
+    _usage.set(prompts.UsageLedger())
+    # Те же проверки, что и хуки Flask-приложения (ratelimit.init_app, read_routing.init_app)
+    g.token_user_id = sync_app._token_user_id(sync_app._request_token(request))
+    g.rate_limit = ratelimit.check_request(request, g.token_user_id)
+    return ratelimit.rejection(Response, g.rate_limit)
+
+
+@aio.after_request
+async def _finish_request(resp):
+    resp.headers['X-Request-ID'] = logs.get_request_id()
+    ratelimit.add_headers(resp, g.get('rate_limit'))
+    read_routing.after_response(request.method, resp, g.get('token_user_id'))
+    origin = request.headers.get('Origin')
+    # Preflight (OPTIONS) обслуживает Flask-CORS в app.py; здесь — заголовки фактического ответа
+    if origin and origin in sync_app.allowed_origins():
+        resp.headers['Access-Control-Allow-Origin'] = origin
+        resp.headers['Access-Control-Allow-Credentials'] = 'true'
+        resp.headers['Access-Control-Expose-Headers'] = ', '.join(sync_app.CORS_EXPOSE_HEADERS)
+        resp.vary.add('Origin')
+    if resp.mimetype != 'text/event-stream':
+        # SSE вызывает Gemini уже после after_request и пишет расход сам в конце генератора
+        await _record_gemini_usage(_usage.get(), sync_app._request_token(request), request.path)
+    if isinstance(resp.response, DataBody) and compression.should_compress(resp):
+        body = compression.apply(resp, await resp.get_data(), request.headers.get('Accept-Encoding', ''))
+        if body is not None:
+            resp.set_data(body)
+    endpoint = request.url_rule.rule if request.url_rule is not None else 'unmatched'
+    metrics.observe_http(request.method, endpoint, resp.status_code, time.perf_counter() - g.metrics_started)
+    metrics.observe_payload('request', endpoint, request.content_length)
+    return resp
+
+
+def _provider_unavailable(e):
+    resp = jsonify(sync_app._provider_unavailable_body(e))
+    resp.status_code = 503
+    resp.headers['Retry-After'] = str(e.retry_after)
+    return resp
+
+
+# --- Routes ---
+
+async def _ffmpeg_to_wav(src_path: str):
+    """webm/opus -> wav 16k mono через stdout ffmpeg; None, если конвертация не удалась."""
+    cmd = ['ffmpeg', '-y', '-i', src_path, '-ac', '1', '-ar', '16000', '-f', 'wav', 'pipe:1']
+    log_transcribe.debug('converting webm to wav', cmd=' '.join(cmd))
+    try:
+        with metrics.stage('ffmpeg'):
+            proc = await asyncio.create_subprocess_exec(*cmd, stdout=asyncio.subprocess.PIPE,
+                                                        stderr=asyncio.subprocess.PIPE)
+            out, err = await proc.communicate()
+    except Exception as conv_err:
+        log_transcribe.warning('ffmpeg exception', error=str(conv_err))
+        return None
+    if proc.returncode != 0:
+        log_transcribe.warning('ffmpeg error', returncode=proc.returncode,
+                               stderr=err.decode('utf-8', 'replace')[-2000:])
+        return None
+    return out
+
+
+@aio.route('/api/transcribe', methods=['POST'])
+async def transcribe_audio():
+    try:
+        started = time.perf_counter()
+        files = await request.files
+        form = await request.form
+        if 'audio' not in files:
+            log_transcribe.info('no audio file in request')
+            return jsonify({'error': 'No audio file provided'}), 400
+        audio_file = files['audio']
+        language = form.get('language', 'auto')
+        with metrics.stage('upload_read'):
+            raw = audio_file.read()
+        if audio_file.filename == '':
+            log_transcribe.info('empty filename')
+            return jsonify({'error': 'No file selected'}), 400
+
+        ext = os.path.splitext(audio_file.filename)[1] or '.webm'
+        store_future = audio_store.submit(sync_app._token_user_id(sync_app._request_token(request)), raw, ext)
+        upload = ('audio' + ext, raw)
+        if (ext.lower() == '.webm') or (audio_file.content_type and 'webm' in audio_file.content_type):
+            with tempfile.NamedTemporaryFile(suffix=ext) as tmp:
+                tmp.write(raw)
+                tmp.flush()
+                wav = await _ffmpeg_to_wav(tmp.name)
+            if wav is not None:
+                upload = ('audio.wav', wav)
+
+        transcription = await stt.atranscribe(upload, language if language != 'auto' else None)
+        log_transcribe.info('transcribed', sample='transcribe.success', language=language, bytes=len(raw),
+                            backend=transcription.backend, chars=len(transcription.text), ms=round((time.perf_counter() - started) * 1000, 1))
+        result = {
+            'text': transcription.text,
+            'language': language
+        }
+        if audio_store.AUDIO_STORE:
+            result['audio_id'] = await asyncio.get_running_loop().run_in_executor(None, audio_store.wait, store_future)
+        return jsonify(result)
+    except gateway.ProviderUnavailable as e:
+        log_transcribe.warning('provider unavailable', provider=e.provider, reason=e.reason)
+        return _provider_unavailable(e)
+    except Exception as e:
+        log_transcribe.exception('transcription failed', error=str(e))
+        return jsonify({'error': str(e)}), 500
+
+
+async def _review_stage(text: str, language: str, ui_language: str, diff_format: str, on_partial=None):
+    result = await review_text(text, language, ui_language, on_partial=on_partial)
+    return result, sync_app._review_fields(result, text, language, diff_format)
+
+
+async def _tts_stage(speculation, fields: dict):
+    if speculation is not None:
+        hit, audio = await speculation.take_async(fields['corrected_text'], fields['language'])
+        if hit:
+            return audio
+    return await synthesize_tts(fields['corrected_text'], fields['language'])
+
+
+async def _explanations_stage(explanations, language: str, ui_language: str) -> str:
+    explanations_html = '<br>'.join(explanations) if explanations else ''
+    try:
+        if sync_app._explanations_need_translation(explanations_html, language, ui_language):
+            tr = await translate_text(explanations_html, from_language=language, to_language=ui_language, fmt='html')
+            explanations_html = tr.get('translated_text') or explanations_html
+    except Exception as _ex_tr_err:
+        log_review.warning('explanations translate fallback error', error=str(_ex_tr_err))
+    return explanations_html
+
+
+async def _review_params():
+    parsed, error = sync_app._review_params(await request.get_json(silent=True) or {}, request.args)
+    if error:
+        return None, (jsonify(error[0]), error[1])
+    return parsed, None
+
+
+@aio.route('/api/review', methods=['POST'])
+async def review_entry():
+    try:
+        parsed, error = await _review_params()
+        if error:
+            return error
+        text, language, ui_language, diff_format = parsed
+        speculation = tts_speculation.start_async(synthesize_tts, text, language, voice=sync_app._tts_voice)
+        try:
+            result, response = await _review_stage(text, language, ui_language, diff_format)
+            # Перевод пояснений и озвучка независимы — ждём их одновременно
+            response['explanations_html'], response['tts_audio_data_url'] = await asyncio.gather(
+                _explanations_stage(response['explanations'], response['language'], ui_language),
+                _tts_stage(speculation, response),
+            )
+        finally:
+            if speculation is not None:
+                speculation.cancel()
+        response['ui_translation'] = result.get('ui_translation') or ''
+        if not result.get('fallback'):
+            await _record_review_stats(sync_app._request_token(request), response['language'], response['is_changed'],
+                                       text, response['corrected_text'])
+        return jsonify(response)
+    except gateway.ProviderUnavailable as e:
+        log_review.warning('provider unavailable', provider=e.provider, reason=e.reason)
+        return _provider_unavailable(e)
+    except Exception as e:
+        log_review.exception('review failed', error=str(e))
+        return jsonify({'error': str(e)}), 500
+
+
+@aio.route('/api/review/stream', methods=['POST'])
+async def review_entry_stream():
+    """SSE как в app.review_entry_stream: partial* → review → translation → tts → done (или error)."""
+    parsed, error = await _review_params()
+    if error:
+        return error
+    text, language, ui_language, diff_format = parsed
+    payload = await request.get_json(silent=True) or {}
+    partial = str(payload.get('partial', request.args.get('partial', ''))).lower() in ('1', 'true', 'yes')
+    token, path, ledger = sync_app._request_token(request), request.path, _usage.get()
+    events = asyncio.Queue()
+
+    async def pipeline():
+        speculation = None
+        try:
+            on_partial = (lambda delta: events.put_nowait(('partial', {'text': delta}))) if partial else None
+            speculation = tts_speculation.start_async(synthesize_tts, text, language, voice=sync_app._tts_voice)
+            result, fields = await _review_stage(text, language, ui_language, diff_format, on_partial=on_partial)
+            events.put_nowait(('review', fields))
+            lang = fields['language']
+            tts_task = asyncio.ensure_future(_tts_stage(speculation, fields))
+            events.put_nowait(('translation', {
+                'ui_translation': result.get('ui_translation') or '',
+                'explanations_html': await _explanations_stage(fields['explanations'], lang, ui_language),
+            }))
+            events.put_nowait(('tts', {'tts_audio_data_url': await tts_task}))
+            if not result.get('fallback'):
+                await _record_review_stats(token, lang, fields['is_changed'], text, fields['corrected_text'])
+        except gateway.ProviderUnavailable as e:
+            log_review.warning('provider unavailable', provider=e.provider, reason=e.reason, stream=True)
+            events.put_nowait(('error', sync_app._provider_unavailable_body(e)))
+        except Exception as e:
+            log_review.exception('review stream failed', error=str(e))
+            events.put_nowait(('error', {'error': str(e)}))
+        finally:
+            # Ошибка или отключение клиента (task.cancel()): спекулятивный синтез больше не нужен
+            if speculation is not None:
+                speculation.cancel()
+            events.put_nowait((None, None))
+
+    async def generate():
+        # Задача наследует контекст запроса: request id, дедлайн провайдеров и ledger токенов
+        task = asyncio.ensure_future(pipeline())
+        try:
+            while True:
+                event, data = await events.get()
+                if event is None:
+                    break
+                yield sync_app._sse(event, data).encode('utf-8')
+            yield sync_app._sse('done', {}).encode('utf-8')
+        finally:
+            if not task.done():
+                task.cancel()
+            await _record_gemini_usage(ledger, token, path)
+
+    resp = Response(generate(), mimetype='text/event-stream')
+    resp.timeout = None
+    resp.headers['Cache-Control'] = 'no-cache'
+    resp.headers['X-Accel-Buffering'] = 'no'
+    return resp
+
+
+@aio.route('/api/translate', methods=['POST'])
+async def api_translate():
+    try:
+        parsed, error = sync_app._translate_params(await request.get_json(silent=True) or {})
+        if error:
+            return jsonify(error[0]), error[1]
+        result = await translate_text(*parsed)
+        return jsonify({'translated_text': result.get('translated_text', '')})
+    except gateway.ProviderUnavailable as e:
+        return _provider_unavailable(e)
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+
+@aio.before_serving
+async def _configure_executor():
+    # Пул для Flask-маршрутов (WSGI) и gTTS; по умолчанию у asyncio min(32, CPU + 4) потоков
+    asyncio.get_running_loop().set_default_executor(
+        ThreadPoolExecutor(max_workers=ASYNC_WSGI_THREADS, thread_name_prefix='wsgi'))
+
+
+def _with_first_chunk(wsgi_app):
+    # WSGI-обёртка hypercorn отправляет заголовки вместе с первым фрагментом тела; у пустых ответов
+    # (304 по ETag, OPTIONS) фрагментов нет, поэтому отдаём пустой фрагмент первым
+    def wrapped(environ, start_response):
+        body = wsgi_app(environ, start_response)
+
+        def _iter():
+            try:
+                yield b''
+                yield from body
+            finally:
+                if hasattr(body, 'close'):
+                    body.close()
+        return _iter()
+    return wrapped
+
+
+class _Dispatcher:
+    """ASGI: ASYNC_ROUTES (кроме OPTIONS) — в Quart, остальные HTTP-запросы — во Flask через пул потоков."""
+
+    def __init__(self, async_app, wsgi_app, max_body_size: int):
+        self.async_app = async_app
+        self.wsgi = AsyncioWSGIMiddleware(_with_first_chunk(wsgi_app), max_body_size=max_body_size)
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'http' and not (scope['path'] in ASYNC_ROUTES and scope['method'] != 'OPTIONS'):
+            await self.wsgi(scope, receive, send)
+        else:
+            await self.async_app(scope, receive, send)
+
+
+app = _Dispatcher(aio, sync_app.app, sync_app.app.config['MAX_CONTENT_LENGTH'])
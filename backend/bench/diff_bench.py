@@ -0,0 +1,168 @@
+"""
+Micro-benchmark for review diff highlighting.
+
+Compares the previous difflib-based ``_highlight_diff`` (kept here verbatim as
+the baseline) with ``services/diff.py`` on synthetic diary texts of 100 to 10k
+tokens with learner-style corrections (word substitutions, inserted/dropped
+articles, punctuation fixes).
+
+    cd backend && python bench/diff_bench.py [--sizes 100,1000,5000,10000] [--repeat 5]
+
+Prints JSON: median milliseconds per call and the number of corrected tokens
+each implementation marks (fewer is a tighter alignment).
+"""
+import argparse
+import difflib
+import json
+import os
+import random
+import re
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from services import diff  # noqa: E402
+
+_VOCAB = (
+    "I you he she we they it the a an to of in on at for with and but or because so then "
+    "was were is are be been have has had do did go went goed gone see saw seen take took "
+    "today yesterday tomorrow morning evening weekend trip friend family house city train "
+    "beach museum coffee work school language lesson teacher word sentence mistake always "
+    "never often sometimes really very quite little big new old good bad beautiful tired happy"
+).split()
+_SWAPS = {'goed': 'went', 'was': 'were', 'were': 'was', 'a': 'an', 'an': 'a', 'in': 'on', 'on': 'at',
+          'is': 'are', 'are': 'is', 'has': 'have', 'have': 'has', 'do': 'did', 'see': 'saw'}
+_ARTICLES = ['the', 'a', 'an']
+
+
+def _zipf_choice(rng):
+    # Function words dominate real text; rank-weighted choice approximates that
+    idx = min(int(rng.paretovariate(1.2)) - 1, len(_VOCAB) - 1)
+    return _VOCAB[idx]
+
+
+def make_pair(n_tokens: int, seed: int = 0):
+    rng = random.Random(seed)
+    original = []
+    while len(original) < n_tokens:
+        sentence = [_zipf_choice(rng) for _ in range(rng.randint(5, 18))]
+        sentence[0] = sentence[0].capitalize()
+        original.extend(sentence)
+        original.append(rng.choice(['.', '.', '.', '!', '?', ',']))
+    corrected = []
+    for tok in original:
+        r = rng.random()
+        if r < 0.03:
+            corrected.append(_SWAPS.get(tok.lower(), rng.choice(_VOCAB)))
+        elif r < 0.04:
+            corrected.extend([rng.choice(_ARTICLES), tok])
+        elif r < 0.05 and tok.lower() in _ARTICLES:
+            continue
+        elif r < 0.06 and tok in ',.!?':
+            corrected.append(rng.choice(',.;'))
+        else:
+            corrected.append(tok)
+    return diff.rebuild_with_spaces(original), diff.rebuild_with_spaces(corrected)
+
+
+# --- Baseline: previous implementation from app.py ---
+
+def _legacy_tokenize(text):
+    return re.findall(r"\w+|[^\w\s]", text, re.UNICODE)
+
+
+def _legacy_rebuild_with_spaces(tokens):
+    res = []
+    for i, t in enumerate(tokens):
+        res.append(t)
+        if i < len(tokens) - 1:
+            curr_is_word = bool(re.match(r"\w", t, re.UNICODE))
+            next_is_word = bool(re.match(r"\w", tokens[i + 1], re.UNICODE))
+            if curr_is_word and next_is_word:
+                res.append(' ')
+            elif t in ['"', "'"] and next_is_word:
+                res.append(' ')
+            elif curr_is_word and tokens[i + 1] in ['"', "'"]:
+                res.append(' ')
+    return ''.join(res)
+
+
+def legacy_highlight_diff(original, corrected):
+    orig_tokens = _legacy_tokenize(original)
+    corr_tokens = _legacy_tokenize(corrected)
+    sm = difflib.SequenceMatcher(a=orig_tokens, b=corr_tokens)
+    parts = []
+    prev_last_token = None
+
+    def _needs_space(prev_tok, next_tok):
+        if not prev_tok or not next_tok:
+            return False
+        prev_is_word = bool(re.match(r"\w", prev_tok, re.UNICODE))
+        next_is_word = bool(re.match(r"\w", next_tok, re.UNICODE))
+        if prev_is_word and next_is_word:
+            return True
+        if prev_tok in ['"', "'"] and next_is_word:
+            return True
+        if prev_is_word and next_tok in ['"', "'"]:
+            return True
+        return False
+
+    for tag, i1, i2, j1, j2 in sm.get_opcodes():
+        segment = corr_tokens[j1:j2]
+        first_tok = segment[0] if segment else None
+        if _needs_space(prev_last_token, first_tok):
+            parts.append(' ')
+        if tag == 'equal':
+            parts.append(_legacy_rebuild_with_spaces(segment))
+        elif tag in ('replace', 'insert'):
+            if segment:
+                parts.append('<mark>' + _legacy_rebuild_with_spaces(segment) + '</mark>')
+        if segment:
+            prev_last_token = segment[-1]
+    return ''.join(parts)
+
+
+_MARK_RE = re.compile(r"<mark>(.*?)</mark>", re.S)
+
+
+def marked_tokens(html: str) -> int:
+    return sum(len(diff.tokenize(m)) for m in _MARK_RE.findall(html))
+
+
+def _time(fn, original, corrected, repeat):
+    samples = []
+    out = None
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        out = fn(original, corrected)
+        samples.append(time.perf_counter() - t0)
+    return statistics.median(samples) * 1000, out
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--sizes', default='100,1000,5000,10000')
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args(argv)
+
+    results = []
+    for size in [int(s) for s in args.sizes.split(',') if s]:
+        original, corrected = make_pair(size, seed=size)
+        legacy_ms, legacy_html = _time(legacy_highlight_diff, original, corrected, args.repeat)
+        new_ms, new_html = _time(diff.highlight_diff, original, corrected, args.repeat)
+        results.append({
+            'tokens': len(diff.tokenize(original)),
+            'legacy_ms': round(legacy_ms, 2),
+            'diff_ms': round(new_ms, 2),
+            'speedup': round(legacy_ms / new_ms, 2) if new_ms else None,
+            'legacy_marked_tokens': marked_tokens(legacy_html),
+            'diff_marked_tokens': marked_tokens(new_html),
+        })
+    print(json.dumps(results, indent=2))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,121 @@
+"""
+Import-time budget for backend/app.py.
+
+Runs ``python -X importtime -c "import app"`` in a fresh interpreter, reports the
+cumulative import time of ``app`` and its heaviest dependencies, checks that the
+provider SDKs are not imported at startup, and measures how long a fresh process
+needs to answer ``GET /api/health``.
+
+    cd backend && python bench/importtime.py [--budget-ms 800] [--runs 5]
+
+Prints a JSON report; exits with 1 if the budget is exceeded or a lazily loaded
+module was imported eagerly.
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Modules that must only be imported on first use (services/providers.py)
+LAZY_MODULES = ['groq', 'google.generativeai', 'gtts', 'edge_tts', 'jwt', 'requests', 'faster_whisper', 'numpy', 'fastembed', 'hnswlib', 'redis']
+
+_HEALTH_SNIPPET = (
+    "import time, sys; t0 = time.perf_counter()\n"
+    "import app\n"
+    "t1 = time.perf_counter()\n"
+    "resp = app.app.test_client().get('/api/health')\n"
+    "t2 = time.perf_counter()\n"
+    "eager = [m for m in %r if m in sys.modules]\n"
+    "print('%%.6f %%.6f %%d %%s' %% (t1 - t0, t2 - t0, resp.status_code, ','.join(eager)))\n"
+) % (LAZY_MODULES,)
+
+
+def _env():
+    env = dict(os.environ)
+    env.setdefault('DATABASE_URL', 'sqlite://')
+    env['PYTHONDONTWRITEBYTECODE'] = '1'
+    return env
+
+
+def parse_importtime(stderr: str):
+    """Return {module: (self_us, cumulative_us)} from -X importtime output."""
+    result = {}
+    for line in stderr.splitlines():
+        if not line.startswith('import time:') or 'self [us]' in line:
+            continue
+        try:
+            _, rest = line.split(':', 1)
+            self_us, cum_us, name = [p.strip() for p in rest.split('|', 2)]
+            result[name.strip()] = (int(self_us), int(cum_us))
+        except ValueError:
+            continue
+    return result
+
+
+def measure_importtime():
+    proc = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', 'import app'],
+        cwd=BACKEND_DIR, env=_env(), capture_output=True, text=True,
+    )
+    if proc.returncode != 0:
+        raise RuntimeError(proc.stderr[-2000:])
+    return parse_importtime(proc.stderr)
+
+
+def measure_health(runs: int):
+    import_s, ready_s, eager = [], [], set()
+    for _ in range(runs):
+        proc = subprocess.run(
+            [sys.executable, '-c', _HEALTH_SNIPPET],
+            cwd=BACKEND_DIR, env=_env(), capture_output=True, text=True,
+        )
+        if proc.returncode != 0:
+            raise RuntimeError(proc.stderr[-2000:])
+        fields = proc.stdout.strip().splitlines()[-1].split(' ')
+        t_import, t_ready, status = fields[:3]
+        eager_mods = fields[3] if len(fields) > 3 else ''
+        if int(status) != 200:
+            raise RuntimeError(f'/api/health returned {status}')
+        import_s.append(float(t_import))
+        ready_s.append(float(t_ready))
+        eager.update(m for m in eager_mods.split(',') if m)
+    return import_s, ready_s, sorted(eager)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--budget-ms', type=float, default=float(os.getenv('IMPORT_BUDGET_MS', '800')),
+                        help='Max median time from interpreter start to a served /api/health')
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('--top', type=int, default=15)
+    args = parser.parse_args(argv)
+
+    modules = measure_importtime()
+    app_cum = modules.get('app', (0, 0))[1]
+    top = sorted(
+        ((name, cum) for name, (_, cum) in modules.items() if '.' not in name and name != 'app'),
+        key=lambda x: x[1], reverse=True,
+    )[:args.top]
+    import_s, ready_s, eager = measure_health(args.runs)
+    ready_ms = statistics.median(ready_s) * 1000
+
+    report = {
+        'app_import_cumulative_ms': round(app_cum / 1000, 1),
+        'top_level_imports_ms': {name: round(cum / 1000, 1) for name, cum in top},
+        'import_median_ms': round(statistics.median(import_s) * 1000, 1),
+        'health_ready_median_ms': round(ready_ms, 1),
+        'budget_ms': args.budget_ms,
+        'eagerly_imported_lazy_modules': eager,
+    }
+    ok = ready_ms <= args.budget_ms and not eager
+    report['ok'] = ok
+    print(json.dumps(report, indent=2, ensure_ascii=False))
+    return 0 if ok else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
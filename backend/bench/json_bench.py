@@ -0,0 +1,113 @@
+"""
+GET /api/entries?per_page=100: JSON encoder and response compression.
+
+Seeds a temporary SQLite database with one user and ``--entries`` diary
+entries (mixed Cyrillic/Latin text, as in production) and requests the first
+page through the Flask test client. Variants:
+
+- ``stdlib`` / ``orjson`` — ``app.json`` backend (services/json_provider.py);
+- ``identity`` / ``gzip`` / ``br`` — Accept-Encoding (services/compression.py;
+  br only with the ``brotli`` module installed).
+
+    cd backend && python bench/json_bench.py [--entries 100] [--requests 300]
+
+Prints JSON: bytes on the wire and CPU milliseconds per request (whole request,
+including the DB query), plus CPU of the JSON encoding alone.
+"""
+import argparse
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+_WORDS = ('сегодня', 'я', 'ходил', 'в', 'магазин', 'и', 'купил', 'хлеб', 'today', 'I', 'went', 'to', 'the',
+          'market', 'and', 'bought', 'some', 'bread', 'hoje', 'eu', 'fui', 'ao', 'mercado')
+
+
+def _text(rng: random.Random) -> str:
+    return ' '.join(rng.choice(_WORDS) for _ in range(rng.randint(30, 90))).capitalize() + '.'
+
+
+def seed(entries: int) -> str:
+    from db import SessionLocal, User, Entry
+    rng = random.Random(42)
+    db = SessionLocal()
+    try:
+        user = User(telegram_id=1, username='bench')
+        db.add(user)
+        db.flush()
+        start = datetime(2026, 1, 1, 8, 30)
+        for i in range(entries):
+            ts = start + timedelta(hours=i * 7, seconds=rng.randint(0, 3599), microseconds=rng.randint(0, 999999))
+            db.add(Entry(text=_text(rng), language=rng.choice(['ru', 'en', 'pt']), timestamp=ts, updated_at=ts,
+                         audio_duration=round(rng.uniform(3, 90), 1), user_id=user.id, change_seq=i + 1))
+        user.change_seq = entries
+        db.commit()
+        return str(user.id)
+    finally:
+        db.close()
+
+
+def measure(client, headers: dict, requests: int) -> dict:
+    size = 0
+    started = time.process_time()
+    for _ in range(requests):
+        resp = client.get('/api/entries?per_page=100', headers=headers)
+        assert resp.status_code == 200, resp.status_code
+        size = len(resp.data)
+    return {'bytes': size, 'cpu_ms': round((time.process_time() - started) * 1000 / requests, 3)}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--entries', type=int, default=100)
+    parser.add_argument('--requests', type=int, default=300)
+    args = parser.parse_args()
+
+    tmp = tempfile.mkdtemp(prefix='json-bench-')
+    os.environ['DATABASE_URL'] = f'sqlite:///{tmp}/bench.db'
+    os.environ.setdefault('JWT_SECRET', 'json-bench-secret-not-for-production-use')
+    from contextlib import redirect_stdout
+    from db import engine
+    from services import compression, json_provider, migrations
+    with redirect_stdout(sys.stderr):
+        migrations.migrate(engine)
+        import app as sync_app
+    user_id = seed(args.entries)
+    auth = {'Authorization': 'Bearer ' + sync_app.create_access_token({'sub': user_id})}
+    app = sync_app.app
+    client = app.test_client()
+    payload = client.get('/api/entries?per_page=100', headers=auth).get_json()
+
+    backends = ['stdlib'] + (['orjson'] if json_provider.orjson is not None else [])
+    encodings = ['identity', 'gzip'] + (['br'] if compression.brotli is not None else [])
+    result = {'entries': len(payload['entries']), 'requests': args.requests, 'variants': {}, 'encode_only': {}}
+    for name in backends:
+        app.json = json_provider.FastJSONProvider(app, use_orjson=name == 'orjson')
+        with app.app_context():
+            rows = [sync_app.Entry(**{**e, 'timestamp': datetime.fromisoformat(e['timestamp']),
+                                      'updated_at': datetime.fromisoformat(e['updated_at'])}).to_dict()
+                    for e in payload['entries']]
+            started = time.process_time()
+            for _ in range(args.requests):
+                app.json.response({'entries': rows, 'total': len(rows)})
+            result['encode_only'][name] = round((time.process_time() - started) * 1000 / args.requests, 3)
+        for encoding in encodings:
+            headers = dict(auth) if encoding == 'identity' else {**auth, 'Accept-Encoding': encoding}
+            measure(client, headers, 10)  # прогрев
+            result['variants'][f'{name}+{encoding}'] = measure(client, headers, args.requests)
+
+    base = result['variants']['stdlib+identity']
+    for item in result['variants'].values():
+        item['bytes_saved_pct'] = round(100.0 * (1 - item['bytes'] / base['bytes']), 1)
+        item['cpu_vs_baseline_pct'] = round(100.0 * (item['cpu_ms'] / base['cpu_ms'] - 1), 1)
+    print(json.dumps(result, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,371 @@
+"""
+Offline load test: the real Flask app on SQLite with fake AI providers.
+
+Starts the backend in a subprocess (werkzeug threaded server, gunicorn with
+``--server gunicorn`` or the async mode ``asgi:app`` with ``--server hypercorn``)
+on a fresh SQLite database with seeded users and
+entries. Groq, Gemini, edge_tts and gTTS are replaced by
+``services/fake_providers.py`` with long-tailed latency distributions and
+error rates (``--latency gemini=lognormal:1200:0.5 --errors groq=0.02``).
+Request mixes are replayed open-loop at ``--rps`` requests per second:
+
+    diary   transcribe -> review -> save entry -> list entries
+    browse  list entries -> search -> stats
+    review  review
+
+    cd backend && python bench/loadtest.py [--rps 20] [--duration 30] [--mix diary=2,browse=5,review=3]
+                                          [--out report.json] [--compare previous.json]
+
+Prints (and with ``--out`` saves) JSON: throughput and p50/p95/p99 per endpoint,
+status codes, errors and scheduling lag. With ``--compare`` the p95/p99 of each
+endpoint are compared to a previous report; the exit code is 1 if any grew by
+more than ``--regress-pct``.
+"""
+import argparse
+import contextlib
+import json
+import os
+import random
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+
+BACKEND = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BACKEND)
+
+DEFAULT_LATENCY = {
+    'groq': 'lognormal:900:0.4',
+    'gemini': 'lognormal:1200:0.5',
+    'edge_tts': 'lognormal:400:0.3',
+    'gtts': 'lognormal:500:0.3',
+}
+DEFAULT_ERRORS = {'groq': '0.01', 'gemini': '0.01', 'edge_tts': '0.01', 'gtts': '0.01'}
+JWT_SECRET = 'loadtest-secret-not-for-production-use'
+
+_WORDS = ("today I went to the market with my friend and we bought fresh bread cheese apples "
+          "yesterday was raining so I stayed home reading a book about history and languages").split()
+
+
+def _sentence(rng, n=None):
+    words = [rng.choice(_WORDS) for _ in range(n or rng.randint(6, 20))]
+    return ' '.join(words).capitalize() + '.'
+
+
+def _pairs(raw: str) -> dict:
+    out = {}
+    for item in (raw or '').split(','):
+        key, sep, value = item.partition('=')
+        if sep:
+            out[key.strip()] = value.strip()
+    return out
+
+
+# --- Environment: database, users, server ---
+
+def prepare_database(db_path: str, users: int, entries_per_user: int, seed: int) -> list:
+    """Схема + пользователи с записями; возвращает JWT-токены пользователей."""
+    os.environ['DATABASE_URL'] = f'sqlite:///{db_path}'
+    import jwt
+    from db import engine, SessionLocal, User, Entry
+    from services import migrations, stats
+
+    with contextlib.redirect_stdout(sys.stderr):  # stdout — только JSON-отчёт
+        migrations.migrate(engine)
+    rng = random.Random(seed)
+    db = SessionLocal()
+    tokens = []
+    try:
+        now = datetime.utcnow()
+        for i in range(users):
+            user = User(telegram_id=900000 + i, username=f'bench{i}')
+            db.add(user)
+            db.flush()
+            for k in range(entries_per_user):
+                entry = Entry(text=_sentence(rng), language=rng.choice(['en', 'es', 'pt']), user_id=user.id,
+                              audio_duration=rng.uniform(3, 60), timestamp=now - timedelta(hours=k * 7),
+                              change_seq=k + 1)
+                db.add(entry)
+                db.flush()
+                stats.entry_added(db, entry)
+            user.change_seq = entries_per_user
+            tokens.append(jwt.encode({'sub': str(user.id), 'iat': now, 'exp': now + timedelta(days=1)},
+                                     JWT_SECRET, algorithm='HS256'))
+        db.commit()
+    finally:
+        db.close()
+    engine.dispose()
+    return tokens
+
+
+def _free_port() -> int:
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def start_server(args, env: dict, port: int, log_path: str):
+    if args.server == 'gunicorn':
+        cmd = [sys.executable, '-m', 'gunicorn', '--bind', f'127.0.0.1:{port}', '--workers', str(args.workers),
+               '--threads', str(args.threads), '--log-level', 'warning', 'app:app']
+    elif args.server == 'hypercorn':
+        cmd = [sys.executable, '-m', 'hypercorn', '--bind', f'127.0.0.1:{port}', '--workers', str(args.workers),
+               '--log-level', 'warning', 'asgi:app']
+    else:
+        cmd = [sys.executable, os.path.abspath(__file__), '--serve', str(port)]
+    log = open(log_path, 'w')
+    proc = subprocess.Popen(cmd, cwd=BACKEND, env=env, stdout=log, stderr=subprocess.STDOUT)
+    import requests
+    deadline = time.time() + 30
+    while time.time() < deadline:
+        if proc.poll() is not None:
+            raise RuntimeError(f'server exited with code {proc.returncode}, see {log_path}')
+        try:
+            if requests.get(f'http://127.0.0.1:{port}/api/health', timeout=1).ok:
+                return proc
+        except requests.RequestException:
+            time.sleep(0.2)
+    proc.terminate()
+    raise RuntimeError(f'server did not become ready, see {log_path}')
+
+
+def serve(port: int):
+    from werkzeug.serving import run_simple
+    from app import app
+    run_simple('127.0.0.1', port, app, threaded=True, use_reloader=False)
+
+
+# --- Scenarios ---
+
+class Recorder:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.samples = defaultdict(list)   # endpoint -> [latency_ms]
+        self.statuses = defaultdict(lambda: defaultdict(int))
+        self.errors = defaultdict(int)
+        self.lag_ms = []
+
+    def add(self, endpoint: str, status, latency_ms: float):
+        with self.lock:
+            self.samples[endpoint].append(latency_ms)
+            self.statuses[endpoint][str(status)] += 1
+            if not isinstance(status, int) or status >= 400:
+                self.errors[endpoint] += 1
+
+
+def _call(rec: Recorder, session, endpoint: str, method: str, url: str, **kwargs):
+    started = time.perf_counter()
+    try:
+        resp = session.request(method, url, timeout=60, **kwargs)
+        status = resp.status_code
+    except Exception as e:
+        resp, status = None, type(e).__name__
+    rec.add(endpoint, status, (time.perf_counter() - started) * 1000)
+    return resp
+
+
+def flow_diary(ctx):
+    base, s, rec, rng = ctx['base'], ctx['session'], ctx['rec'], ctx['rng']
+    audio = os.urandom(rng.randint(20_000, 120_000))
+    resp = _call(rec, s, 'POST /api/transcribe', 'POST', base + '/api/transcribe',
+                 files={'audio': ('clip.wav', audio, 'audio/wav')}, data={'language': 'en'})
+    text = _sentence(rng)
+    if resp is not None and resp.ok:
+        text = resp.json().get('text') or text
+    _call(rec, s, 'POST /api/review', 'POST', base + '/api/review',
+          json={'text': text, 'language': 'en', 'ui_language': 'ru'})
+    _call(rec, s, 'POST /api/entries', 'POST', base + '/api/entries',
+          json={'text': text, 'language': 'en', 'audio_duration': len(audio) / 16000})
+    _call(rec, s, 'GET /api/entries', 'GET', base + '/api/entries', params={'page': 1, 'per_page': 20})
+
+
+def flow_browse(ctx):
+    base, s, rec, rng = ctx['base'], ctx['session'], ctx['rec'], ctx['rng']
+    _call(rec, s, 'GET /api/entries', 'GET', base + '/api/entries', params={'page': rng.randint(1, 3), 'per_page': 20})
+    _call(rec, s, 'GET /api/search', 'GET', base + '/api/search', params={'q': rng.choice(_WORDS)})
+    _call(rec, s, 'GET /api/stats', 'GET', base + '/api/stats')
+
+
+def flow_review(ctx):
+    _call(ctx['rec'], ctx['session'], 'POST /api/review', 'POST', ctx['base'] + '/api/review',
+          json={'text': _sentence(ctx['rng']), 'language': 'en', 'ui_language': 'ru'})
+
+
+FLOWS = {'diary': (flow_diary, 4), 'browse': (flow_browse, 3), 'review': (flow_review, 1)}
+
+
+def run_load(base: str, tokens: list, args) -> Recorder:
+    import requests
+    mix = {name: float(w) for name, w in _pairs(args.mix).items() if name in FLOWS and float(w) > 0}
+    if not mix:
+        raise SystemExit(f'--mix must name some of: {", ".join(FLOWS)}')
+    names = list(mix)
+    weights = [mix[n] for n in names]
+    mean_len = sum(FLOWS[n][1] * mix[n] for n in names) / sum(weights)
+    flow_rate = args.rps / mean_len
+    rec = Recorder()
+    local = threading.local()
+    rng = random.Random(args.seed)
+
+    def _run(name, token, scheduled, seed):
+        rec.lag_ms.append((time.perf_counter() - scheduled) * 1000)
+        if not hasattr(local, 'session'):
+            local.session = requests.Session()
+        local.session.headers['Authorization'] = 'Bearer ' + token
+        FLOWS[name][0]({'base': base, 'session': local.session, 'rec': rec, 'rng': random.Random(seed)})
+
+    with ThreadPoolExecutor(max_workers=args.concurrency) as pool:
+        start = time.perf_counter()
+        next_at = start
+        while next_at - start < args.duration:
+            now = time.perf_counter()
+            if next_at > now:
+                time.sleep(next_at - now)
+            name = rng.choices(names, weights)[0]
+            pool.submit(_run, name, rng.choice(tokens), next_at, rng.random())
+            next_at += rng.expovariate(flow_rate)  # Poisson arrivals
+    return rec
+
+
+# --- Report ---
+
+def _pct(sorted_values, p: float) -> float:
+    if not sorted_values:
+        return 0.0
+    k = max(0, min(len(sorted_values) - 1, int(round(p / 100.0 * len(sorted_values) + 0.5)) - 1))
+    return round(sorted_values[k], 1)
+
+
+def _summary(values, elapsed: float) -> dict:
+    v = sorted(values)
+    return {'count': len(v), 'rps': round(len(v) / elapsed, 2) if elapsed else 0.0,
+            'p50_ms': _pct(v, 50), 'p95_ms': _pct(v, 95), 'p99_ms': _pct(v, 99), 'max_ms': round(v[-1], 1) if v else 0.0}
+
+
+def build_report(rec: Recorder, elapsed: float, args) -> dict:
+    endpoints = {}
+    for endpoint, values in sorted(rec.samples.items()):
+        item = _summary(values, elapsed)
+        item['errors'] = rec.errors.get(endpoint, 0)
+        item['status'] = dict(rec.statuses[endpoint])
+        endpoints[endpoint] = item
+    overall = _summary([x for v in rec.samples.values() for x in v], elapsed)
+    overall['errors'] = sum(rec.errors.values())
+    try:
+        commit = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=BACKEND, capture_output=True,
+                                text=True).stdout.strip() or None
+    except OSError:
+        commit = None
+    return {
+        'commit': commit,
+        'created': datetime.utcnow().isoformat(timespec='seconds') + 'Z',
+        'config': {'rps': args.rps, 'duration_s': args.duration, 'mix': args.mix, 'server': args.server,
+                   'workers': args.workers, 'env': args.env, 'users': args.users, 'latency': args.latency_effective,
+                   'errors': args.errors_effective},
+        'elapsed_s': round(elapsed, 2),
+        'overall': overall,
+        'endpoints': endpoints,
+        'schedule_lag_ms': {'p50': _pct(sorted(rec.lag_ms), 50), 'p99': _pct(sorted(rec.lag_ms), 99)},
+    }
+
+
+def compare(report: dict, previous: dict, regress_pct: float) -> dict:
+    result, regressions = {}, []
+    for endpoint, cur in report['endpoints'].items():
+        old = previous.get('endpoints', {}).get(endpoint)
+        if not old:
+            continue
+        item = {}
+        for key in ('p95_ms', 'p99_ms'):
+            delta = (cur[key] - old[key]) / old[key] * 100 if old[key] else 0.0
+            item[key] = {'before': old[key], 'after': cur[key], 'delta_pct': round(delta, 1)}
+            if delta > regress_pct:
+                regressions.append(f'{endpoint} {key}')
+        result[endpoint] = item
+    return {'against': previous.get('commit'), 'endpoints': result, 'regressions': regressions}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--serve', type=int, help=argparse.SUPPRESS)
+    parser.add_argument('--rps', type=float, default=20.0, help='target requests per second')
+    parser.add_argument('--duration', type=float, default=30.0, help='seconds of load')
+    parser.add_argument('--mix', default='diary=2,browse=5,review=3', help='flow weights')
+    parser.add_argument('--server', choices=['werkzeug', 'gunicorn', 'hypercorn'], default='werkzeug')
+    parser.add_argument('--workers', type=int, default=4, help='gunicorn/hypercorn workers')
+    parser.add_argument('--threads', type=int, default=1, help='gunicorn threads per worker')
+    parser.add_argument('--concurrency', type=int, default=64, help='client threads')
+    parser.add_argument('--users', type=int, default=20)
+    parser.add_argument('--entries', type=int, default=50, help='seeded entries per user')
+    parser.add_argument('--latency', default='', help='provider=spec overrides, e.g. gemini=lognormal:1500:0.6')
+    parser.add_argument('--errors', default='', help='provider=rate overrides, e.g. groq=0.05')
+    parser.add_argument('--env', action='append', default=[], metavar='KEY=VALUE',
+                        help='extra server environment, e.g. PROVIDER_GEMINI_MAX_LIMIT=64')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--out', help='write the JSON report here')
+    parser.add_argument('--compare', help='previous JSON report to compare p95/p99 against')
+    parser.add_argument('--regress-pct', type=float, default=10.0)
+    parser.add_argument('--keep', action='store_true', help='keep the temp dir (DB, server log)')
+    args = parser.parse_args(argv)
+
+    if args.serve:
+        serve(args.serve)
+        return 0
+
+    args.latency_effective = dict(DEFAULT_LATENCY, **_pairs(args.latency))
+    args.errors_effective = dict(DEFAULT_ERRORS, **_pairs(args.errors))
+    workdir = tempfile.mkdtemp(prefix='diary-loadtest-')
+    db_path = os.path.join(workdir, 'bench.db')
+    # Лимиты запросов (services/ratelimit.py) выключены: нагрузка идёт от нескольких пользователей с одного IP;
+    # проверить их под нагрузкой — --env RATE_LIMIT=true
+    env = dict(os.environ, DATABASE_URL=f'sqlite:///{db_path}', JWT_SECRET=JWT_SECRET, FAKE_PROVIDERS='all',
+               LOG_LEVEL=os.getenv('LOG_LEVEL', 'WARNING'), RATE_LIMIT='false')
+    env.pop('PROMETHEUS_MULTIPROC_DIR', None)
+    for item in args.env:
+        key, _, value = item.partition('=')
+        env[key.strip()] = value
+    for provider, spec in args.latency_effective.items():
+        env[f'FAKE_{provider.upper()}_LATENCY_MS'] = spec
+    for provider, rate in args.errors_effective.items():
+        env[f'FAKE_{provider.upper()}_ERROR_RATE'] = rate
+
+    tokens = prepare_database(db_path, args.users, args.entries, args.seed)
+    port = _free_port()
+    proc = start_server(args, env, port, os.path.join(workdir, 'server.log'))
+    try:
+        started = time.perf_counter()
+        rec = run_load(f'http://127.0.0.1:{port}', tokens, args)
+        elapsed = time.perf_counter() - started
+    finally:
+        proc.terminate()
+        try:
+            proc.wait(timeout=10)
+        except subprocess.TimeoutExpired:
+            proc.kill()
+
+    report = build_report(rec, elapsed, args)
+    status = 0
+    if args.compare:
+        with open(args.compare) as f:
+            report['compare'] = compare(report, json.load(f), args.regress_pct)
+        status = 1 if report['compare']['regressions'] else 0
+    text = json.dumps(report, indent=2)
+    print(text)
+    if args.out:
+        with open(args.out, 'w') as f:
+            f.write(text + '\n')
+    if args.keep:
+        print(f'[BENCH] Work dir kept: {workdir}', file=sys.stderr)
+    else:
+        shutil.rmtree(workdir, ignore_errors=True)
+    return status
+
+
+if __name__ == '__main__':
+    sys.exit(main())
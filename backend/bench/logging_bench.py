@@ -0,0 +1,112 @@
+"""
+Logging overhead per /api/transcribe request, before and after services/logs.py.
+
+``before`` replays the print() calls the handler used to make on every request
+(form dict, file metadata, ffmpeg command, temp files, success line) into a
+line-buffered sink, like gunicorn ``--capture-output``. ``after`` makes the
+current structured calls: DEBUG lines are filtered by level, the success line
+is sampled (``--sample``, default 1%) and emitted records are formatted and
+written by the background queue thread. Only time spent on the request thread
+is measured.
+
+    cd backend && python bench/logging_bench.py [--requests 20000] [--sink file|devnull]
+
+Prints JSON: microseconds of logging per request and records written.
+"""
+import argparse
+import json
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+_FORM = {'language': 'en-US', 'duration': '12.4', 'client': 'webapp', 'ui_language': 'ru'}
+_FILES = ['audio']
+_CMD = ['ffmpeg', '-y', '-i', '/tmp/tmpa1b2c3.webm', '-ac', '1', '-ar', '16000', '/tmp/tmpd4e5f6.wav']
+
+
+def before(out):
+    print(f"[TRANSCRIBE] Request received - Files: {_FILES}", file=out)
+    print(f"[TRANSCRIBE] Form data: {_FORM}", file=out)
+    print("[TRANSCRIBE] Audio file: recording.webm, size: 183422 bytes, content_type: audio/webm", file=out)
+    print("[TRANSCRIBE] GROQ_API_KEY present: True", file=out)
+    print("[TRANSCRIBE] Starting Groq transcription with language: en-US", file=out)
+    print("[TRANSCRIBE] Temp file created: /tmp/tmpa1b2c3.webm", file=out)
+    print(f"[TRANSCRIBE] Converting webm→wav: {' '.join(_CMD)}", file=out)
+    print("[TRANSCRIBE] Conversion OK: /tmp/tmpd4e5f6.wav", file=out)
+    print("[TRANSCRIBE] Temp file removed: /tmp/tmpa1b2c3.webm", file=out)
+    print("[TRANSCRIBE] Temp file removed: /tmp/tmpd4e5f6.wav", file=out)
+    print("[TRANSCRIBE] Success! Text length: 214 chars", file=out)
+
+
+def after(log, started):
+    log.debug('request received', files=_FILES, form_keys=list(_FORM))
+    log.debug('audio file', filename='recording.webm', bytes=183422, content_type='audio/webm')
+    log.debug('starting Groq transcription', language='en-US', groq_key_present=True)
+    log.debug('converting webm to wav', cmd=' '.join(_CMD))
+    log.info('transcribed', sample='transcribe.success', language='en-US', bytes=183422,
+             chars=214, ms=round((time.perf_counter() - started) * 1000, 1))
+
+
+def _sink(kind: str):
+    if kind == 'devnull':
+        return open(os.devnull, 'w', buffering=1), None
+    fd, path = tempfile.mkstemp(prefix='logbench-', suffix='.log')
+    os.close(fd)
+    return open(path, 'w', buffering=1), path
+
+
+def _count_lines(path):
+    if not path:
+        return None
+    with open(path, 'rb') as f:
+        return sum(1 for _ in f)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--requests', type=int, default=20000)
+    parser.add_argument('--sink', choices=['file', 'devnull'], default='file')
+    parser.add_argument('--sample', type=float, default=0.01, help='share of successful transcribes logged')
+    args = parser.parse_args(argv)
+
+    out, before_path = _sink(args.sink)
+    t0 = time.perf_counter()
+    for _ in range(args.requests):
+        before(out)
+    before_us = (time.perf_counter() - t0) / args.requests * 1e6
+    out.close()
+
+    stream, after_path = _sink(args.sink)
+    os.environ['LOG_SAMPLE'] = f'transcribe.success={args.sample}'
+    from services import logs
+    logs.setup(stream=stream)
+    log = logs.get_logger('transcribe')
+    t0 = time.perf_counter()
+    for _ in range(args.requests):
+        after(log, t0)
+    after_us = (time.perf_counter() - t0) / args.requests * 1e6
+    logs.shutdown()
+    stream.close()
+
+    report = {
+        'requests': args.requests,
+        'sink': args.sink,
+        'before_us_per_request': round(before_us, 2),
+        'after_us_per_request': round(after_us, 2),
+        'speedup': round(before_us / after_us, 1) if after_us else None,
+        'before_lines': _count_lines(before_path),
+        'after_lines': _count_lines(after_path),
+        'dropped': logs.dropped(),
+    }
+    for path in (before_path, after_path):
+        if path:
+            os.remove(path)
+    print(json.dumps(report, indent=2))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
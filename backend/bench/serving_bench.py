@@ -0,0 +1,75 @@
+"""
+Sync vs async serving mode under provider-bound load.
+
+Runs ``bench/loadtest.py`` twice with the same request mix, rate and fake
+provider latencies: once against the sync deployment (``gunicorn app:app``,
+sync workers) and once against the async mode (``hypercorn asgi:app``).
+Provider limits are raised for both runs (``--provider-limit``) so the
+comparison measures the serving model, not the gateway.
+
+    cd backend && python bench/serving_bench.py [--rps 40] [--duration 30] [--mix review=3,diary=1]
+                                               [--sync-workers 4] [--async-workers 1] [--provider-limit 256]
+
+Prints JSON: for each mode throughput, p50/p95/p99 and errors overall and for
+the provider-bound endpoints (/api/review, /api/transcribe, /api/translate).
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+PROVIDER_ENDPOINTS = ('POST /api/review', 'POST /api/transcribe', 'POST /api/translate')
+
+
+def run_mode(args, server: str, workers: int) -> dict:
+    with tempfile.NamedTemporaryFile(suffix='.json', delete=False) as tmp:
+        out = tmp.name
+    cmd = [sys.executable, os.path.join(HERE, 'loadtest.py'), '--server', server, '--workers', str(workers),
+           '--rps', str(args.rps), '--duration', str(args.duration), '--mix', args.mix,
+           '--concurrency', str(args.concurrency), '--out', out]
+    if args.latency:
+        cmd += ['--latency', args.latency]
+    for provider in ('GROQ', 'GEMINI', 'EDGE_TTS', 'GTTS'):
+        cmd += ['--env', f'PROVIDER_{provider}_MAX_LIMIT={args.provider_limit}',
+                '--env', f'PROVIDER_{provider}_LIMIT={args.provider_limit}']
+    try:
+        subprocess.run(cmd, cwd=os.path.dirname(HERE), check=True, stdout=subprocess.DEVNULL)
+        with open(out) as f:
+            report = json.load(f)
+    finally:
+        os.remove(out)
+    keep = ('count', 'rps', 'p50_ms', 'p95_ms', 'p99_ms', 'errors')
+    return {
+        'server': server,
+        'workers': workers,
+        'overall': {k: report['overall'][k] for k in keep},
+        'endpoints': {name: {k: item[k] for k in keep}
+                      for name, item in report['endpoints'].items() if name in PROVIDER_ENDPOINTS},
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--rps', type=float, default=40.0)
+    parser.add_argument('--duration', type=float, default=30.0)
+    parser.add_argument('--mix', default='review=3,diary=1')
+    parser.add_argument('--latency', default='', help='passed to loadtest.py, e.g. gemini=lognormal:1500:0.5')
+    parser.add_argument('--concurrency', type=int, default=512, help='client threads')
+    parser.add_argument('--sync-workers', type=int, default=4, help='gunicorn sync workers (as in the Dockerfile)')
+    parser.add_argument('--async-workers', type=int, default=1, help='hypercorn workers')
+    parser.add_argument('--provider-limit', type=int, default=256)
+    args = parser.parse_args()
+
+    result = {
+        'config': vars(args),
+        'sync': run_mode(args, 'gunicorn', args.sync_workers),
+        'async': run_mode(args, 'hypercorn', args.async_workers),
+    }
+    print(json.dumps(result, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,20 @@
+# gunicorn.conf.py - подхватывается gunicorn автоматически из рабочей директории (/app)
+#
+# Prometheus в multiprocess-режиме: каждый воркер пишет метрики в файлы в PROMETHEUS_MULTIPROC_DIR,
+# /metrics агрегирует их (services/metrics.py). Каталог очищается при старте мастера,
+# файлы завершившихся воркеров помечаются мёртвыми.
+import os
+import shutil
+
+
+def on_starting(server):
+    path = os.getenv('PROMETHEUS_MULTIPROC_DIR')
+    if path:
+        shutil.rmtree(path, ignore_errors=True)
+        os.makedirs(path, exist_ok=True)
+
+
+def child_exit(server, worker):
+    if os.getenv('PROMETHEUS_MULTIPROC_DIR'):
+        from services import metrics
+        metrics.mark_process_dead(worker.pid)
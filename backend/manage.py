@@ -0,0 +1,176 @@
+# manage.py - служебные команды backend (запускаются отдельно от gunicorn)
+#
+#   python manage.py migrate [--target N]   применить миграции схемы БД
+#   python manage.py schema-version         показать текущую версию схемы
+#   python manage.py purge-tombstones [--older-than-days 30]
+#                                           удалить надгробия удалённых записей
+#   python manage.py rebuild-stats [--user-id N]
+#                                           пересчитать агрегаты статистики из entry
+#   python manage.py token-usage [--days 30] расход токенов Gemini по эндпоинтам и пользователям (JSON)
+#   python manage.py profile-header         значение X-Profile для профилирования одного запроса (PROFILE_SECRET)
+#   python manage.py gc-audio [--grace-hours 24]
+#                                           удалить записи голоса, на которые не ссылается ни одна запись
+#   python manage.py rebuild-vocabulary [--user-id N]
+#                                           пересчитать словарь пользователей из entry
+#   python manage.py semantic-backfill [--user-id N]
+#                                           посчитать векторы семантического поиска для записей без них
+import argparse
+import json
+import sys
+from datetime import datetime, timedelta
+
+from sqlalchemy import delete, func, select, update
+
+from db import engine, SessionLocal, Entry, User
+from services import audio_store, migrations, profiling, prompts, semantic, stats, vocabulary
+
+
+def cmd_migrate(args):
+    before = migrations.current_version(engine)
+    applied = migrations.migrate(engine, target=args.target)
+    if applied:
+        print(f"[DB] Schema migrated: {before} -> {applied[-1]}")
+    else:
+        print(f"[DB] Schema is up to date (version {before})")
+    return 0
+
+
+def cmd_schema_version(args):
+    version = migrations.current_version(engine)
+    print(f"{version} (latest: {migrations.LATEST_VERSION})")
+    return 0 if version >= migrations.LATEST_VERSION else 1
+
+
+def cmd_purge_tombstones(args):
+    cutoff = datetime.utcnow() - timedelta(days=args.older_than_days)
+    db = SessionLocal()
+    try:
+        # Клиенты с токеном старше удаляемого надгробия должны сделать полную пересинхронизацию
+        floors = db.execute(
+            select(Entry.user_id, func.max(Entry.change_seq))
+            .where(Entry.deleted_at.is_not(None), Entry.deleted_at < cutoff)
+            .group_by(Entry.user_id)
+        ).all()
+        for user_id, max_seq in floors:
+            if user_id is not None and max_seq is not None:
+                db.execute(update(User).where(User.id == user_id, User.sync_floor < max_seq).values(sync_floor=max_seq))
+        purged = db.execute(delete(Entry).where(Entry.deleted_at.is_not(None), Entry.deleted_at < cutoff)).rowcount
+        db.commit()
+        print(f"[DB] Purged {purged} tombstones older than {args.older_than_days} days")
+        return 0
+    except Exception:
+        db.rollback()
+        raise
+    finally:
+        db.close()
+
+
+def cmd_rebuild_stats(args):
+    db = SessionLocal()
+    try:
+        rows = stats.rebuild(db, user_id=args.user_id)
+        db.commit()
+        print(f"[STATS] Rebuilt {rows} daily rollup rows")
+        return 0
+    except Exception:
+        db.rollback()
+        raise
+    finally:
+        db.close()
+
+
+def cmd_rebuild_vocabulary(args):
+    db = SessionLocal()
+    try:
+        rows = vocabulary.rebuild(db, user_id=args.user_id)
+        db.commit()
+        print(f"[VOCABULARY] Rebuilt {rows} vocabulary rows")
+        return 0
+    except Exception:
+        db.rollback()
+        raise
+    finally:
+        db.close()
+
+
+def cmd_token_usage(args):
+    db = SessionLocal()
+    try:
+        report = prompts.usage_summary(db, days=args.days)
+        report['top_users'] = prompts.top_users(db, days=args.days, limit=args.top)
+        print(json.dumps(report, indent=2, ensure_ascii=False))
+        return 0
+    finally:
+        db.close()
+
+
+def cmd_profile_header(args):
+    if not profiling.PROFILE_SECRET:
+        print("PROFILE_SECRET is not set", file=sys.stderr)
+        return 1
+    print(profiling.sign())
+    return 0
+
+
+def cmd_gc_audio(args):
+    result = audio_store.gc(grace_hours=args.grace_hours)
+    print(f"[AUDIO] Deleted {result['deleted_blobs']} unreferenced blobs and {result['deleted_strays']} stray files")
+    return 0
+
+
+def cmd_semantic_backfill(args):
+    try:
+        result = semantic.backfill(user_id=args.user_id)
+    except semantic.SemanticUnavailable as e:
+        print(f"[SEMANTIC] {e}", file=sys.stderr)
+        return 1
+    print(f"[SEMANTIC] Embedded {result['embedded']} entries for {result['users']} users")
+    return 0
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='manage.py', description='Diary backend management commands')
+    sub = parser.add_subparsers(dest='command', required=True)
+
+    p_migrate = sub.add_parser('migrate', help='Apply pending schema migrations')
+    p_migrate.add_argument('--target', type=int, default=None, help='Stop at this schema version')
+    p_migrate.set_defaults(func=cmd_migrate)
+
+    p_version = sub.add_parser('schema-version', help='Print the applied schema version')
+    p_version.set_defaults(func=cmd_schema_version)
+
+    p_purge = sub.add_parser('purge-tombstones', help='Delete soft-deleted entries older than N days')
+    p_purge.add_argument('--older-than-days', type=int, default=30)
+    p_purge.set_defaults(func=cmd_purge_tombstones)
+
+    p_stats = sub.add_parser('rebuild-stats', help='Recompute per-day stats rollups from entries')
+    p_stats.add_argument('--user-id', type=int, default=None, help='Only this user (default: everyone)')
+    p_stats.set_defaults(func=cmd_rebuild_stats)
+
+    p_vocab = sub.add_parser('rebuild-vocabulary', help='Recompute per-user vocabulary counts from entries')
+    p_vocab.add_argument('--user-id', type=int, default=None, help='Only this user (default: everyone)')
+    p_vocab.set_defaults(func=cmd_rebuild_vocabulary)
+
+    p_usage = sub.add_parser('token-usage', help='Print Gemini token usage per endpoint and top users')
+    p_usage.add_argument('--days', type=int, default=30)
+    p_usage.add_argument('--top', type=int, default=20)
+    p_usage.set_defaults(func=cmd_token_usage)
+
+    p_profile = sub.add_parser('profile-header', help='Print a signed X-Profile header value (valid 5 minutes)')
+    p_profile.set_defaults(func=cmd_profile_header)
+
+    p_gc_audio = sub.add_parser('gc-audio', help='Delete stored voice recordings no entry references')
+    p_gc_audio.add_argument('--grace-hours', type=float, default=None,
+                            help='Keep newer blobs (default: AUDIO_GC_GRACE_HOURS)')
+    p_gc_audio.set_defaults(func=cmd_gc_audio)
+
+    p_semantic = sub.add_parser('semantic-backfill', help='Embed entries missing from the semantic search index')
+    p_semantic.add_argument('--user-id', type=int, default=None, help='Only this user (default: everyone)')
+    p_semantic.set_defaults(func=cmd_semantic_backfill)
+
+    args = parser.parse_args(argv)
+    return args.func(args)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,45 @@
+import hmac
+import os
+
+from flask import Blueprint, request, jsonify, send_file
+
+from services import profiling
+
+
+def register_admin_routes(app):
+    """
+    Register operator endpoints under /api/admin/*.
+    Requires "Authorization: Bearer <ADMIN_TOKEN>"; without ADMIN_TOKEN the endpoints are disabled (404).
+    """
+    bp = Blueprint('admin', __name__, url_prefix='/api/admin')
+
+    @bp.before_request
+    def _require_admin():
+        token = os.getenv('ADMIN_TOKEN', '').strip()
+        if not token:
+            return jsonify({'error': 'Not found'}), 404
+        if not hmac.compare_digest(request.headers.get('Authorization', ''), f'Bearer {token}'):
+            return jsonify({'error': 'forbidden'}), 403
+
+    @bp.route('/profiles', methods=['GET'])
+    def list_profiles():
+        try:
+            limit = max(1, min(int(request.args.get('limit', 20)), 200))
+        except ValueError:
+            return jsonify({'error': 'limit must be an integer'}), 400
+        sort = request.args.get('sort', 'duration')
+        return jsonify({
+            'profiles': profiling.recent(limit=limit, sort=sort),
+            'sample_rate': profiling.PROFILE_SAMPLE_RATE,
+            'paths': list(profiling.PROFILE_PATHS),
+        })
+
+    @bp.route('/profiles/<name>', methods=['GET'])
+    def get_profile(name):
+        # Collapsed stacks: открывается в speedscope.app или flamegraph.pl
+        path = profiling.profile_path(name)
+        if not path:
+            return jsonify({'error': 'Profile not found'}), 404
+        return send_file(path, mimetype='text/plain', as_attachment=True, download_name=name + '.collapsed')
+
+    app.register_blueprint(bp)
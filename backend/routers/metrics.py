@@ -0,0 +1,49 @@
+import hmac
+import os
+import time
+
+from flask import Blueprint, Response, g, request, jsonify
+
+from services import metrics
+
+
+def register_metrics_routes(app):
+    """
+    Register GET /metrics (Prometheus text format) and per-request timing hooks.
+    If METRICS_TOKEN is set, /metrics requires "Authorization: Bearer <token>".
+    """
+    bp = Blueprint('metrics', __name__)
+
+    def _endpoint() -> str:
+        # Шаблон маршрута, а не путь: /api/entries/<int:entry_id>, чтобы не плодить метки
+        return request.url_rule.rule if request.url_rule is not None else 'unmatched'
+
+    @app.before_request
+    def _metrics_start():
+        g.metrics_started = time.perf_counter()
+
+    @app.after_request
+    def _metrics_observe(resp):
+        started = g.pop('metrics_started', None)
+        if started is None or request.path == '/metrics':
+            return resp
+        endpoint = _endpoint()
+        metrics.observe_http(request.method, endpoint, resp.status_code, time.perf_counter() - started)
+        metrics.observe_payload('request', endpoint, request.content_length)
+        if not resp.is_streamed:
+            metrics.observe_payload('response', endpoint, resp.content_length)
+        return resp
+
+    @bp.route('/metrics', methods=['GET'])
+    def metrics_endpoint():
+        token = os.getenv('METRICS_TOKEN', '').strip()
+        if token:
+            auth = request.headers.get('Authorization', '')
+            if not hmac.compare_digest(auth, f'Bearer {token}'):
+                return jsonify({'error': 'forbidden'}), 403
+        if not metrics.enabled():
+            return jsonify({'error': 'prometheus_client is not installed'}), 501
+        body, content_type = metrics.render()
+        return Response(body, content_type=content_type)
+
+    app.register_blueprint(bp)
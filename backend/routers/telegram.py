@@ -1,7 +1,8 @@
 import os
 from flask import Blueprint, request, jsonify
 
-from services.telegram_bot import TelegramBotService, validate_webhook_secret, SessionStore
+from services import shared_state
+from services.telegram_bot import TelegramBotService, validate_webhook_secret, session_store
 
 
 def register_telegram_routes(app):
@@ -28,12 +29,21 @@ def register_telegram_routes(app):
         secret = request.args.get('secret')
         if not validate_webhook_secret(secret):
             return jsonify({'error': 'forbidden'}), 403
+        dedup_key = None
         try:
             update = request.get_json(force=True, silent=True) or {}
+            # Telegram повторяет доставку, если ответ не пришёл вовремя: обрабатываем update_id один раз на все узлы
+            if update.get('update_id') is not None:
+                dedup_key = f"tg:update:{update['update_id']}"
+                if not shared_state.get_state().add(dedup_key, ttl=24 * 3600):
+                    return jsonify({'ok': True, 'duplicate': True})
             service = _get_service()
             service.process_update(update)
             return jsonify({'ok': True})
         except Exception as e:
+            if dedup_key:
+                # Обработка не удалась: повтор от Telegram должен пройти
+                shared_state.get_state().delete(dedup_key)
             return jsonify({'ok': False, 'error': str(e)}), 500
 
     # Simple per-user records endpoints (using session token)
@@ -43,7 +53,7 @@ def register_telegram_routes(app):
         if not token:
             return jsonify({'error': 'Session token required'}), 400
         try:
-            store = SessionStore()
+            store = session_store()
             data = store.list_notes(token)
             return jsonify(data)
         except Exception as e:
@@ -59,7 +69,7 @@ def register_telegram_routes(app):
         if not text:
             return jsonify({'error': 'Text is required'}), 400
         try:
-            store = SessionStore()
+            store = session_store()
             note = store.add_note(token, text)
             return jsonify({'note': note}), 201
         except Exception as e:
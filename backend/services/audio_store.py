@@ -0,0 +1,249 @@
+"""
+Content-addressed store for the original voice recordings (optional, ``AUDIO_STORE=true``).
+
+``/api/transcribe`` keeps the upload of an authenticated user as an Ogg/Opus
+blob (mono, ``AUDIO_OPUS_BITRATE``), alongside the Groq call, and returns its
+``audio_id``. ``POST /api/entries`` links the blob to the entry
+(``Entry.audio_sha256``), and ``GET /api/entries/<id>/audio`` plays it back.
+
+- Key: SHA-256 of the uploaded bytes. A retried upload of the same recording
+  finds the existing blob and is not encoded again. Layout:
+  ``AUDIO_STORE_DIR/ab/abcdef....opus``. Files are written to a temp file and
+  then renamed, so readers never see a partial blob.
+- Quota: ``AUDIO_QUOTA_MB`` per user, summed over the ``audio_blob`` rows the
+  user owns. Over quota, the transcription still succeeds but the recording is
+  not kept.
+- GC: a blob no live entry references, older than ``AUDIO_GC_GRACE_HOURS``
+  (time to save the entry after transcribing), is deleted together with its
+  file. Files without a row (crashed writes) are deleted too. GC runs every
+  ``AUDIO_GC_INTERVAL_SECONDS`` in a daemon thread. Workers share a lock file,
+  so one GC runs at a time. It can also be run as ``python manage.py gc-audio``.
+- Playback goes through ``send_file`` (sendfile, Range, strong ETag = sha256).
+  With ``AUDIO_ACCEL_REDIRECT=/_audio/``, nginx serves the file instead (an
+  ``internal`` location aliased to ``AUDIO_STORE_DIR``).
+"""
+import hashlib
+import os
+import re
+import subprocess
+import tempfile
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from datetime import datetime, timedelta
+from typing import Optional
+
+from sqlalchemy import delete, exists, func, select
+
+from db import AudioBlob, Entry, SessionLocal
+from services import logs
+
+AUDIO_STORE = os.getenv('AUDIO_STORE', 'false').strip().lower() in ('1', 'true', 'yes', 'on')
+AUDIO_STORE_DIR = os.getenv('AUDIO_STORE_DIR', '/app/data/audio')
+AUDIO_OPUS_BITRATE = os.getenv('AUDIO_OPUS_BITRATE', '24k')
+AUDIO_QUOTA_MB = float(os.getenv('AUDIO_QUOTA_MB', '200'))
+AUDIO_GC_GRACE_HOURS = float(os.getenv('AUDIO_GC_GRACE_HOURS', '24'))
+AUDIO_GC_INTERVAL_SECONDS = float(os.getenv('AUDIO_GC_INTERVAL_SECONDS', '3600'))
+AUDIO_ACCEL_REDIRECT = os.getenv('AUDIO_ACCEL_REDIRECT', '').strip()
+AUDIO_CACHE_MAX_AGE = int(os.getenv('AUDIO_CACHE_MAX_AGE', str(365 * 24 * 3600)))
+AUDIO_STORE_WORKERS = int(os.getenv('AUDIO_STORE_WORKERS', '2'))
+AUDIO_STORE_WAIT_SECONDS = float(os.getenv('AUDIO_STORE_WAIT_SECONDS', '30'))
+
+MIMETYPE = 'audio/ogg'
+_ID_RE = re.compile(r'^[0-9a-f]{64}$')
+
+log = logs.get_logger('audio')
+
+_pool: Optional[ThreadPoolExecutor] = None
+_pool_lock = threading.Lock()
+_gc_started = False
+_gc_lock = threading.Lock()
+
+
+def valid_id(audio_id) -> bool:
+    return isinstance(audio_id, str) and bool(_ID_RE.match(audio_id))
+
+
+def blob_id(data: bytes) -> str:
+    return hashlib.sha256(data).hexdigest()
+
+
+def blob_path(audio_id: str) -> str:
+    return os.path.join(AUDIO_STORE_DIR, audio_id[:2], audio_id + '.opus')
+
+
+def accel_path(audio_id: str) -> str:
+    """Path for X-Accel-Redirect (nginx location AUDIO_ACCEL_REDIRECT -> AUDIO_STORE_DIR)."""
+    return AUDIO_ACCEL_REDIRECT.rstrip('/') + f'/{audio_id[:2]}/{audio_id}.opus'
+
+
+def usage_bytes(db, user_id: int) -> int:
+    return int(db.scalar(select(func.coalesce(func.sum(AudioBlob.size_bytes), 0))
+                         .where(AudioBlob.user_id == user_id)) or 0)
+
+
+def _encode_opus(src_path: str, dst_path: str) -> bool:
+    cmd = ['ffmpeg', '-y', '-v', 'error', '-i', src_path, '-vn', '-ac', '1', '-c:a', 'libopus',
+           '-b:a', AUDIO_OPUS_BITRATE, '-application', 'voip', '-f', 'ogg', dst_path]
+    try:
+        res = subprocess.run(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True)
+    except Exception as e:
+        log.warning('opus encode exception', error=str(e))
+        return False
+    if res.returncode != 0:
+        log.warning('opus encode error', returncode=res.returncode, stderr=res.stderr[-2000:])
+        return False
+    return True
+
+
+def store(user_id: int, data: bytes, ext: str = '.webm') -> Optional[str]:
+    """Keep the recording for user_id; returns its audio_id, or None (disabled, over quota, encode failed)."""
+    if not AUDIO_STORE or not user_id or not data:
+        return None
+    audio_id = blob_id(data)
+    path = blob_path(audio_id)
+    db = SessionLocal()
+    try:
+        row = db.get(AudioBlob, audio_id)
+        if row is not None and row.user_id != user_id:
+            return None
+        if row is not None and os.path.exists(path):
+            # Повтор той же загрузки: блоб уже есть
+            return audio_id
+        if usage_bytes(db, user_id) >= AUDIO_QUOTA_MB * 1024 * 1024:
+            log.info('audio quota exceeded', user_id=user_id, quota_mb=AUDIO_QUOTA_MB)
+            return None
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with tempfile.NamedTemporaryFile(delete=False, suffix=ext or '.webm') as src:
+            src.write(data)
+        tmp_path = f'{path}.{os.getpid()}.{threading.get_ident()}.tmp'
+        try:
+            if not _encode_opus(src.name, tmp_path):
+                return None
+            os.replace(tmp_path, path)
+        finally:
+            for p in (src.name, tmp_path):
+                if os.path.exists(p):
+                    os.remove(p)
+        if row is None:
+            db.add(AudioBlob(sha256=audio_id, user_id=user_id, size_bytes=os.path.getsize(path)))
+        db.commit()
+        log.debug('audio stored', user_id=user_id, audio_id=audio_id, source_bytes=len(data),
+                  stored_bytes=os.path.getsize(path))
+        return audio_id
+    except Exception as e:
+        db.rollback()
+        log.warning('audio store error', error=str(e))
+        return None
+    finally:
+        db.close()
+
+
+def _get_pool() -> ThreadPoolExecutor:
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                _pool = ThreadPoolExecutor(max_workers=max(1, AUDIO_STORE_WORKERS), thread_name_prefix='audio-store')
+    return _pool
+
+
+def submit(user_id: Optional[int], data: bytes, ext: str = '.webm') -> Optional[Future]:
+    """store() in the background, so encoding overlaps the transcription call; None when nothing will be stored."""
+    if not AUDIO_STORE or not user_id or not data:
+        return None
+    return _get_pool().submit(store, user_id, data, ext)
+
+
+def wait(future: Optional[Future]) -> Optional[str]:
+    if future is None:
+        return None
+    try:
+        return future.result(timeout=AUDIO_STORE_WAIT_SECONDS)
+    except Exception as e:
+        log.warning('audio store wait error', error=str(e) or type(e).__name__)
+        return None
+
+
+def owned(db, user_id: int, audio_id) -> bool:
+    """audio_id can be linked to an entry of user_id."""
+    if not valid_id(audio_id):
+        return False
+    row = db.get(AudioBlob, audio_id)
+    return row is not None and row.user_id == user_id
+
+
+# --- Garbage collection ---
+
+def gc(grace_hours: float = None) -> dict:
+    """Delete unreferenced blobs older than the grace period and stray files; returns counters."""
+    grace = AUDIO_GC_GRACE_HOURS if grace_hours is None else grace_hours
+    cutoff = datetime.utcnow() - timedelta(hours=grace)
+    referenced = exists().where(Entry.audio_sha256 == AudioBlob.sha256, Entry.deleted_at.is_(None))
+    db = SessionLocal()
+    try:
+        doomed = db.scalars(select(AudioBlob.sha256).where(AudioBlob.created_at < cutoff, ~referenced)).all()
+        deleted = 0
+        for audio_id in doomed:
+            # Сначала строка (с повторной проверкой ссылок — запись могла появиться только что), потом файл
+            if not db.execute(delete(AudioBlob).where(AudioBlob.sha256 == audio_id, ~referenced)).rowcount:
+                continue
+            db.commit()
+            deleted += 1
+            try:
+                os.remove(blob_path(audio_id))
+            except FileNotFoundError:
+                pass
+        known = set(db.scalars(select(AudioBlob.sha256)).all())
+    except Exception:
+        db.rollback()
+        raise
+    finally:
+        db.close()
+
+    strays = 0
+    cutoff_ts = time.time() - grace * 3600
+    if os.path.isdir(AUDIO_STORE_DIR):
+        for shard in os.scandir(AUDIO_STORE_DIR):
+            if not shard.is_dir():
+                continue
+            for item in os.scandir(shard.path):
+                audio_id = item.name.split('.', 1)[0]
+                if (item.name.endswith('.tmp') or audio_id not in known) and item.stat().st_mtime < cutoff_ts:
+                    try:
+                        os.remove(item.path)
+                        strays += 1
+                    except FileNotFoundError:
+                        pass
+    return {'deleted_blobs': deleted, 'deleted_strays': strays}
+
+
+def _gc_loop():
+    import fcntl
+    lock_path = os.path.join(AUDIO_STORE_DIR, '.gc.lock')
+    while True:
+        time.sleep(AUDIO_GC_INTERVAL_SECONDS)
+        try:
+            with open(lock_path, 'a') as lock:
+                try:
+                    fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                except BlockingIOError:
+                    continue  # GC уже идёт в другом воркере
+                result = gc()
+            if result['deleted_blobs'] or result['deleted_strays']:
+                log.info('audio gc', **result)
+        except Exception as e:
+            log.warning('audio gc error', error=str(e))
+
+
+def ensure_gc():
+    """Start the background GC thread of this process (once)."""
+    global _gc_started
+    if not AUDIO_STORE or AUDIO_GC_INTERVAL_SECONDS <= 0 or _gc_started:
+        return
+    with _gc_lock:
+        if _gc_started:
+            return
+        os.makedirs(AUDIO_STORE_DIR, exist_ok=True)
+        threading.Thread(target=_gc_loop, name='audio-gc', daemon=True).start()
+        _gc_started = True
@@ -0,0 +1,117 @@
+"""
+Response compression negotiated from Accept-Encoding.
+
+brotli is preferred when the optional ``brotli`` module is installed;
+otherwise gzip is used.
+
+- Only text-like bodies are compressed: JSON, NDJSON, text/* and SVG. Audio,
+  images, SSE streams, streamed/passthrough bodies (``send_file``), ranges,
+  and responses that already have Content-Encoding are skipped. Bodies under
+  ``COMPRESS_MIN_BYTES`` are skipped too, because the gain does not pay for
+  the CPU.
+- Compressible responses get ``Vary: Accept-Encoding``. ETags in the API are
+  weak, so they stay valid for the compressed representation.
+- ``COMPRESS=false`` turns it off, e.g. when nginx/Caddy in front already
+  compress. They leave responses that have Content-Encoding alone.
+
+Settings: ``COMPRESS_MIN_BYTES`` (1024), ``COMPRESS_GZIP_LEVEL`` (5) and
+``COMPRESS_BR_QUALITY`` (5). Low levels give almost the same ratio on JSON at
+a fraction of the CPU.
+"""
+import gzip
+import os
+from typing import Optional
+
+try:
+    import brotli
+except Exception:  # optional dependency
+    brotli = None
+
+COMPRESS = os.getenv('COMPRESS', 'true').strip().lower() in ('1', 'true', 'yes', 'on')
+COMPRESS_MIN_BYTES = int(os.getenv('COMPRESS_MIN_BYTES', '1024'))
+COMPRESS_GZIP_LEVEL = int(os.getenv('COMPRESS_GZIP_LEVEL', '5'))
+COMPRESS_BR_QUALITY = int(os.getenv('COMPRESS_BR_QUALITY', '5'))
+
+COMPRESSIBLE_TYPES = ('application/json', 'application/x-ndjson', 'application/javascript', 'image/svg+xml')
+SKIP_STATUSES = (204, 206, 304)
+
+
+def _accepted(accept_encoding: str) -> dict:
+    # "gzip, br;q=0.8, *;q=0" -> {'gzip': 1.0, 'br': 0.8, '*': 0.0}
+    result = {}
+    for part in (accept_encoding or '').split(','):
+        name, _, params = part.strip().partition(';')
+        name = name.strip().lower()
+        if not name:
+            continue
+        q = 1.0
+        params = params.strip()
+        if params.startswith('q='):
+            try:
+                q = float(params[2:])
+            except ValueError:
+                q = 0.0
+        result[name] = q
+    return result
+
+
+def negotiate(accept_encoding: str) -> Optional[str]:
+    """'br' | 'gzip' | None for the given Accept-Encoding header."""
+    accepted = _accepted(accept_encoding)
+    wildcard = accepted.get('*', 0.0)
+    for encoding in (('br', 'gzip') if brotli is not None else ('gzip',)):
+        if accepted.get(encoding, wildcard) > 0:
+            return encoding
+    return None
+
+
+def compressible(mimetype: Optional[str]) -> bool:
+    mimetype = (mimetype or '').lower()
+    if mimetype == 'text/event-stream':
+        return False
+    return mimetype.startswith('text/') or mimetype in COMPRESSIBLE_TYPES or mimetype.endswith('+json')
+
+
+def compress(data: bytes, encoding: str) -> bytes:
+    if encoding == 'br':
+        return brotli.compress(data, quality=COMPRESS_BR_QUALITY)
+    return gzip.compress(data, compresslevel=COMPRESS_GZIP_LEVEL, mtime=0)
+
+
+def should_compress(resp) -> bool:
+    """Response-level checks shared by the Flask and Quart hooks (the body size is checked by the caller)."""
+    return (
+        COMPRESS
+        and 200 <= resp.status_code < 300
+        and resp.status_code not in SKIP_STATUSES
+        and 'Content-Encoding' not in resp.headers
+        and 'Content-Range' not in resp.headers
+        and compressible(resp.mimetype)
+    )
+
+
+def apply(resp, data: bytes, accept_encoding: str) -> Optional[bytes]:
+    """Compressed body for resp (headers are updated), or None to send data as is."""
+    resp.vary.add('Accept-Encoding')
+    encoding = negotiate(accept_encoding)
+    if not encoding or len(data) < COMPRESS_MIN_BYTES:
+        return None
+    body = compress(data, encoding)
+    if len(body) >= len(data):
+        return None
+    resp.headers['Content-Encoding'] = encoding
+    return body
+
+
+def init_app(app):
+    """Compress eligible Flask responses in after_request."""
+
+    @app.after_request
+    def _compress_response(resp):
+        from flask import request
+        if resp.direct_passthrough or resp.is_streamed or not should_compress(resp):
+            return resp
+        body = apply(resp, resp.get_data(), request.headers.get('Accept-Encoding', ''))
+        if body is not None:
+            resp.set_data(body)
+        return resp
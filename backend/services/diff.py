@@ -0,0 +1,301 @@
+"""
+Token-level diff for review highlighting.
+
+Texts are split with a precompiled tokenizer into words and single punctuation
+marks; a word/non-word class array is computed once per text and reused for
+spacing decisions. Token sequences are aligned with a patience diff (unique
+tokens anchor the alignment, which suits natural language where function
+words repeat constantly) and the gaps between anchors fall back to a bounded
+Myers O(ND) diff. Opcodes have the same shape as ``difflib`` opcodes:
+``(tag, i1, i2, j1, j2)``.
+
+``highlight_diff`` renders corrected text with ``<mark>`` around replaced or
+inserted tokens; with ``refine=True`` a replaced span is refined to the
+changed characters when both sides are short enough. ``diff_ops`` returns the
+same alignment as compact arrays for client-side rendering, without building
+any HTML.
+"""
+import re
+from bisect import bisect_left
+from difflib import SequenceMatcher
+from typing import List, Sequence, Tuple
+
+TOKEN_RE = re.compile(r"\w+|[^\w\s]", re.UNICODE)
+WORD_RE = re.compile(r"\w", re.UNICODE)
+_QUOTES = frozenset(['"', "'"])
+
+# Gaps between patience anchors with more edits than this are reported as one replace
+MYERS_MAX_D = 512
+# Character refinement is only attempted for replaced spans up to this many characters per side
+REFINE_MAX_CHARS = 64
+
+Opcode = Tuple[str, int, int, int, int]
+
+
+def tokenize(text: str) -> List[str]:
+    return TOKEN_RE.findall(text or '')
+
+
+def tokenize_spans(text: str) -> Tuple[List[str], List[int], List[int]]:
+    """Токены и их символьные границы [start, end) в исходной строке."""
+    tokens, starts, ends = [], [], []
+    for m in TOKEN_RE.finditer(text or ''):
+        tokens.append(m.group())
+        starts.append(m.start())
+        ends.append(m.end())
+    return tokens, starts, ends
+
+
+def word_flags(tokens: Sequence[str]) -> List[bool]:
+    """True для токенов-слов; считается один раз на текст."""
+    match = WORD_RE.match
+    return [match(t) is not None for t in tokens]
+
+
+def _needs_space(prev_tok: str, prev_word: bool, next_tok: str, next_word: bool) -> bool:
+    if prev_word and next_word:
+        return True
+    if prev_tok in _QUOTES and next_word:
+        return True
+    if prev_word and next_tok in _QUOTES:
+        return True
+    return False
+
+
+def rebuild_with_spaces(tokens: Sequence[str], flags: Sequence[bool] = None) -> str:
+    if flags is None:
+        flags = word_flags(tokens)
+    res = []
+    last = len(tokens) - 1
+    for i, t in enumerate(tokens):
+        res.append(t)
+        if i < last and _needs_space(t, flags[i], tokens[i + 1], flags[i + 1]):
+            res.append(' ')
+    return ''.join(res)
+
+
+# --- Alignment ---
+
+def _unique_anchors(a, b, alo, ahi, blo, bhi) -> List[Tuple[int, int]]:
+    """Токены, встречающиеся ровно один раз в обоих диапазонах, в порядке наибольшей общей подпоследовательности."""
+    count_a, pos_a = {}, {}
+    for i in range(alo, ahi):
+        t = a[i]
+        count_a[t] = count_a.get(t, 0) + 1
+        pos_a[t] = i
+    count_b, pos_b = {}, {}
+    for j in range(blo, bhi):
+        t = b[j]
+        if t in count_a:
+            count_b[t] = count_b.get(t, 0) + 1
+            pos_b[t] = j
+    pairs = sorted(
+        (pos_a[t], pos_b[t]) for t, n in count_b.items() if n == 1 and count_a[t] == 1
+    )
+    if not pairs:
+        return []
+    # Longest increasing subsequence by b index (patience sorting)
+    tails, tails_idx, back = [], [], [-1] * len(pairs)
+    for idx, (_, bj) in enumerate(pairs):
+        k = bisect_left(tails, bj)
+        if k == len(tails):
+            tails.append(bj)
+            tails_idx.append(idx)
+        else:
+            tails[k] = bj
+            tails_idx[k] = idx
+        back[idx] = tails_idx[k - 1] if k else -1
+    result = []
+    idx = tails_idx[-1]
+    while idx != -1:
+        result.append(pairs[idx])
+        idx = back[idx]
+    result.reverse()
+    return result
+
+
+def _myers(a, b, alo, ahi, blo, bhi, out: list, max_d: int):
+    n, m = ahi - alo, bhi - blo
+    if n == 0 or m == 0:
+        return
+    v = {1: 0}
+    trace = []
+    for d in range(min(n + m, max_d) + 1):
+        trace.append(v.copy())
+        for k in range(-d, d + 1, 2):
+            if k == -d or (k != d and v[k - 1] < v[k + 1]):
+                x = v[k + 1]
+            else:
+                x = v[k - 1] + 1
+            y = x - k
+            while x < n and y < m and a[alo + x] == b[blo + y]:
+                x += 1
+                y += 1
+            v[k] = x
+            if x >= n and y >= m:
+                _myers_backtrack(trace, n, m, alo, blo, out)
+                return
+    # Too many edits: leave the gap unmatched (rendered as a single replace)
+
+
+def _myers_backtrack(trace, n, m, alo, blo, out: list):
+    pairs = []
+    x, y = n, m
+    for d in range(len(trace) - 1, 0, -1):
+        v = trace[d]
+        k = x - y
+        if k == -d or (k != d and v[k - 1] < v[k + 1]):
+            prev_k = k + 1
+        else:
+            prev_k = k - 1
+        prev_x = v[prev_k]
+        prev_y = prev_x - prev_k
+        while x > prev_x and y > prev_y:
+            x -= 1
+            y -= 1
+            pairs.append((alo + x, blo + y))
+        x, y = prev_x, prev_y
+    while x > 0 and y > 0:
+        x -= 1
+        y -= 1
+        pairs.append((alo + x, blo + y))
+    pairs.reverse()
+    out.extend(pairs)
+
+
+def _patience(a, b, alo, ahi, blo, bhi, out: list, max_d: int):
+    while alo < ahi and blo < bhi and a[alo] == b[blo]:
+        out.append((alo, blo))
+        alo += 1
+        blo += 1
+    suffix = []
+    while alo < ahi and blo < bhi and a[ahi - 1] == b[bhi - 1]:
+        ahi -= 1
+        bhi -= 1
+        suffix.append((ahi, bhi))
+    if alo < ahi and blo < bhi:
+        anchors = _unique_anchors(a, b, alo, ahi, blo, bhi)
+        if anchors:
+            pa, pb = alo, blo
+            for ai, bj in anchors:
+                _patience(a, b, pa, ai, pb, bj, out, max_d)
+                out.append((ai, bj))
+                pa, pb = ai + 1, bj + 1
+            _patience(a, b, pa, ahi, pb, bhi, out, max_d)
+        else:
+            _myers(a, b, alo, ahi, blo, bhi, out, max_d)
+    out.extend(reversed(suffix))
+
+
+def _opcodes_from_matches(matches, n: int, m: int) -> List[Opcode]:
+    ops: List[Opcode] = []
+    i = j = 0
+    for ai, bj in matches + [(n, m)]:
+        if ai > i or bj > j:
+            tag = 'replace' if ai > i and bj > j else ('delete' if ai > i else 'insert')
+            ops.append((tag, i, ai, j, bj))
+        if ai < n and bj < m:
+            if ops and ops[-1][0] == 'equal' and ops[-1][2] == ai and ops[-1][4] == bj:
+                _, i1, _, j1, _ = ops[-1]
+                ops[-1] = ('equal', i1, ai + 1, j1, bj + 1)
+            else:
+                ops.append(('equal', ai, ai + 1, bj, bj + 1))
+        i, j = ai + 1, bj + 1
+    return ops
+
+
+def diff_tokens(a: Sequence[str], b: Sequence[str], max_d: int = MYERS_MAX_D) -> List[Opcode]:
+    """difflib-совместимые опкоды выравнивания двух последовательностей токенов."""
+    matches: list = []
+    _patience(a, b, 0, len(a), 0, len(b), matches, max_d)
+    return _opcodes_from_matches(matches, len(a), len(b))
+
+
+def refine_chars(a_text: str, b_text: str) -> List[Opcode]:
+    """Опкоды по символам внутри заменённого фрагмента (пусто, если фрагменты слишком длинные)."""
+    if not a_text or not b_text or len(a_text) > REFINE_MAX_CHARS or len(b_text) > REFINE_MAX_CHARS:
+        return []
+    return SequenceMatcher(None, a_text, b_text, autojunk=False).get_opcodes()
+
+
+def _render_refined(a_text: str, b_text: str) -> str:
+    char_ops = refine_chars(a_text, b_text)
+    equal_chars = sum(j2 - j1 for tag, _, _, j1, j2 in char_ops if tag == 'equal')
+    # Refine only when most of the word survived; otherwise mark the whole span
+    if not char_ops or equal_chars * 2 < len(b_text):
+        return '<mark>' + b_text + '</mark>'
+    parts = []
+    for tag, _, _, j1, j2 in char_ops:
+        if j1 == j2:
+            continue
+        piece = b_text[j1:j2]
+        parts.append(piece if tag == 'equal' else '<mark>' + piece + '</mark>')
+    return ''.join(parts)
+
+
+def highlight_diff(original: str, corrected: str, refine: bool = False) -> str:
+    orig_tokens = tokenize(original)
+    corr_tokens = tokenize(corrected)
+    orig_flags = word_flags(orig_tokens)
+    corr_flags = word_flags(corr_tokens)
+    parts = []
+    prev = -1  # index of the last emitted corrected token
+
+    for tag, i1, i2, j1, j2 in diff_tokens(orig_tokens, corr_tokens):
+        if j1 == j2:
+            continue
+        if prev >= 0 and _needs_space(corr_tokens[prev], corr_flags[prev], corr_tokens[j1], corr_flags[j1]):
+            parts.append(' ')
+        text = rebuild_with_spaces(corr_tokens[j1:j2], corr_flags[j1:j2])
+        if tag == 'equal':
+            parts.append(text)
+        elif refine and tag == 'replace':
+            parts.append(_render_refined(rebuild_with_spaces(orig_tokens[i1:i2], orig_flags[i1:i2]), text))
+        else:
+            parts.append('<mark>' + text + '</mark>')
+        prev = j2 - 1
+    return ''.join(parts)
+
+
+# --- Structured output ---
+
+OPS_VERSION = 1
+OPS_FIELDS = ['tag', 'orig_tok_start', 'orig_tok_end', 'corr_tok_start', 'corr_tok_end',
+              'orig_char_start', 'orig_char_end', 'corr_char_start', 'corr_char_end']
+_OP_TAGS = {'equal': '=', 'replace': '~', 'delete': '-', 'insert': '+'}
+
+
+def _char_span(starts, ends, t1: int, t2: int, fallback: int) -> Tuple[int, int]:
+    if t1 == t2:
+        # Empty token range: zero-width position before token t1 (or text end)
+        pos = starts[t1] if t1 < len(starts) else fallback
+        return pos, pos
+    return starts[t1], ends[t2 - 1]
+
+
+def diff_ops(original: str, corrected: str, refine: bool = False) -> dict:
+    """Компактное представление диффа: массивы опкодов с токенными и символьными смещениями.
+
+    Каждый опкод — список в порядке OPS_FIELDS; tag: '=' equal, '~' replace, '-' delete, '+' insert.
+    Символьные смещения указывают в original_text / corrected_text, так что клиент берёт фрагменты
+    срезами строк. С refine=True для коротких замен добавляется 'chars': {индекс опкода: символьные опкоды
+    [tag, a1, a2, b1, b2] относительно фрагментов}.
+    """
+    original = original or ''
+    corrected = corrected or ''
+    a, a_starts, a_ends = tokenize_spans(original)
+    b, b_starts, b_ends = tokenize_spans(corrected)
+    ops = []
+    chars = {}
+    for tag, i1, i2, j1, j2 in diff_tokens(a, b):
+        a0, a1 = _char_span(a_starts, a_ends, i1, i2, len(original))
+        b0, b1 = _char_span(b_starts, b_ends, j1, j2, len(corrected))
+        if refine and tag == 'replace':
+            refined = refine_chars(original[a0:a1], corrected[b0:b1])
+            if refined:
+                chars[str(len(ops))] = [[_OP_TAGS[t], x1, x2, y1, y2] for t, x1, x2, y1, y2 in refined]
+        ops.append([_OP_TAGS[tag], i1, i2, j1, j2, a0, a1, b0, b1])
+    result = {'version': OPS_VERSION, 'fields': OPS_FIELDS, 'ops': ops}
+    if refine:
+        result['chars'] = chars
+    return result
@@ -0,0 +1,332 @@
+"""
+Local stand-in for the network key-value store of ``services/shared_state.py``.
+
+A single-process asyncio server that speaks the Redis protocol (RESP2) and
+covers the commands ``RedisState`` uses: PING, SELECT, GET, MGET, SET (EX/PX,
+NX), DEL, INCRBY, PEXPIRE/EXPIRE, TTL/PTTL, RPUSH, LPOP, BLPOP, LLEN,
+WATCH/UNWATCH/MULTI/EXEC/DISCARD, DBSIZE and FLUSHDB. ``CLIENT`` subcommands
+are acknowledged. Commands run one at a time on the event loop, so
+MULTI/EXEC is atomic. WATCH compares per-key write versions. State is kept in
+memory only.
+
+    cd backend && python services/fake_kv.py --port 6390
+    SHARED_STATE_URL=redis://127.0.0.1:6390/0 gunicorn ...   # several app processes/nodes
+
+It is meant for tests and local multi-node runs, not for production.
+"""
+import argparse
+import asyncio
+import time
+from collections import deque
+from typing import Dict, List, Optional
+
+
+class _Error(Exception):
+    pass
+
+
+class _Db:
+    def __init__(self):
+        self.data: Dict[bytes, object] = {}  # bytes (строка) или deque (список)
+        self.expires: Dict[bytes, float] = {}
+        self.versions: Dict[bytes, int] = {}
+
+    def live(self, key: bytes):
+        expires = self.expires.get(key)
+        if expires is not None and expires <= time.monotonic():
+            self.data.pop(key, None)
+            self.expires.pop(key, None)
+            self.touch(key)
+        return self.data.get(key)
+
+    def touch(self, key: bytes):
+        self.versions[key] = self.versions.get(key, 0) + 1
+
+    def version(self, key: bytes) -> int:
+        self.live(key)
+        return self.versions.get(key, 0)
+
+
+class FakeKV:
+    def __init__(self):
+        self.dbs: Dict[int, _Db] = {}
+        self.changed = asyncio.Event()
+
+    def db(self, index: int) -> _Db:
+        return self.dbs.setdefault(index, _Db())
+
+    # --- Commands (args: list of bytes; returns a Python value encoded by _encode) ---
+
+    def execute(self, conn: '_Conn', name: str, args: List[bytes]):
+        db = self.db(conn.db)
+        handler = getattr(self, 'cmd_' + name, None)
+        if handler is None:
+            raise _Error(f"ERR unknown command '{name}'")
+        return handler(conn, db, args)
+
+    def cmd_ping(self, conn, db, args):
+        return args[0] if args else 'PONG'
+
+    def cmd_client(self, conn, db, args):
+        return 'OK'
+
+    def cmd_select(self, conn, db, args):
+        conn.db = int(args[0])
+        return 'OK'
+
+    def cmd_get(self, conn, db, args):
+        value = db.live(args[0])
+        if isinstance(value, deque):
+            raise _Error('WRONGTYPE Operation against a key holding the wrong kind of value')
+        return value
+
+    def cmd_mget(self, conn, db, args):
+        return [v if isinstance(v, bytes) else None for v in (db.live(k) for k in args)]
+
+    def cmd_set(self, conn, db, args):
+        key, value, opts = args[0], args[1], [a.upper() for a in args[2:]]
+        ttl, nx, i = None, False, 0
+        while i < len(opts):
+            if opts[i] in (b'EX', b'PX'):
+                ttl = float(opts[i + 1]) * (1.0 if opts[i] == b'EX' else 0.001)
+                i += 2
+                continue
+            if opts[i] == b'NX':
+                nx = True
+            i += 1
+        if nx and db.live(key) is not None:
+            return None
+        db.data[key] = value
+        if ttl is not None:
+            db.expires[key] = time.monotonic() + ttl
+        else:
+            db.expires.pop(key, None)
+        db.touch(key)
+        return 'OK'
+
+    def cmd_del(self, conn, db, args):
+        n = 0
+        for key in args:
+            if db.live(key) is not None:
+                del db.data[key]
+                db.expires.pop(key, None)
+                db.touch(key)
+                n += 1
+        return n
+
+    def cmd_incrby(self, conn, db, args):
+        key = args[0]
+        current = db.live(key)
+        try:
+            value = int(current or 0) + int(args[1])
+        except ValueError:
+            raise _Error('ERR value is not an integer or out of range')
+        db.data[key] = str(value).encode()
+        db.touch(key)
+        return value
+
+    def cmd_incr(self, conn, db, args):
+        return self.cmd_incrby(conn, db, [args[0], b'1'])
+
+    def cmd_pexpire(self, conn, db, args):
+        if db.live(args[0]) is None:
+            return 0
+        db.expires[args[0]] = time.monotonic() + int(args[1]) / 1000.0
+        db.touch(args[0])
+        return 1
+
+    def cmd_expire(self, conn, db, args):
+        return self.cmd_pexpire(conn, db, [args[0], str(int(args[1]) * 1000).encode()])
+
+    def cmd_pttl(self, conn, db, args):
+        if db.live(args[0]) is None:
+            return -2
+        expires = db.expires.get(args[0])
+        return -1 if expires is None else int((expires - time.monotonic()) * 1000)
+
+    def cmd_ttl(self, conn, db, args):
+        ms = self.cmd_pttl(conn, db, args)
+        return ms if ms < 0 else (ms + 999) // 1000
+
+    def cmd_rpush(self, conn, db, args):
+        items = db.live(args[0])
+        if items is None:
+            items = db.data[args[0]] = deque()
+        items.extend(args[1:])
+        db.touch(args[0])
+        self.changed.set()
+        return len(items)
+
+    def cmd_lpop(self, conn, db, args):
+        items = db.live(args[0])
+        if not items:
+            return None
+        value = items.popleft()
+        if not items:
+            del db.data[args[0]]
+        db.touch(args[0])
+        return value
+
+    def cmd_llen(self, conn, db, args):
+        items = db.live(args[0])
+        return len(items) if items else 0
+
+    def cmd_dbsize(self, conn, db, args):
+        return sum(1 for k in list(db.data) if db.live(k) is not None)
+
+    def cmd_flushdb(self, conn, db, args):
+        for key in list(db.data):
+            db.touch(key)
+        db.data.clear()
+        db.expires.clear()
+        return 'OK'
+
+    async def blpop(self, conn, args) -> Optional[list]:
+        keys, timeout = args[:-1], float(args[-1])
+        deadline = None if timeout == 0 else time.monotonic() + timeout
+        while True:
+            db = self.db(conn.db)
+            for key in keys:
+                value = self.cmd_lpop(conn, db, [key])
+                if value is not None:
+                    return [key, value]
+            remaining = None if deadline is None else deadline - time.monotonic()
+            if remaining is not None and remaining <= 0:
+                return None
+            self.changed.clear()
+            try:
+                await asyncio.wait_for(self.changed.wait(), timeout=min(remaining or 1.0, 1.0))
+            except asyncio.TimeoutError:
+                pass
+
+
+class _Conn:
+    def __init__(self):
+        self.db = 0
+        self.watched: Dict[bytes, int] = {}
+        self.queued: Optional[list] = None
+
+
+def _encode(value) -> bytes:
+    if value is None:
+        return b'$-1\r\n'
+    if isinstance(value, _Error):
+        return b'-' + str(value).encode() + b'\r\n'
+    if isinstance(value, str):
+        return b'+' + value.encode() + b'\r\n'
+    if isinstance(value, bool) or isinstance(value, int):
+        return b':' + str(int(value)).encode() + b'\r\n'
+    if isinstance(value, bytes):
+        return b'$' + str(len(value)).encode() + b'\r\n' + value + b'\r\n'
+    if isinstance(value, list):
+        return b'*' + str(len(value)).encode() + b'\r\n' + b''.join(_encode(v) for v in value)
+    raise TypeError(type(value))
+
+
+async def _read_command(reader: asyncio.StreamReader) -> Optional[List[bytes]]:
+    line = await reader.readline()
+    if not line:
+        return None
+    if not line.startswith(b'*'):
+        return line.strip().split()  # inline-команда (redis-cli, telnet)
+    args = []
+    for _ in range(int(line[1:])):
+        size = int((await reader.readline())[1:])
+        args.append((await reader.readexactly(size + 2))[:-2])
+    return args
+
+
+async def _serve(kv: FakeKV, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+    conn = _Conn()
+    try:
+        while True:
+            args = await _read_command(reader)
+            if args is None:
+                break
+            if not args:
+                continue
+            name, rest = args[0].decode().lower(), args[1:]
+            try:
+                if name == 'quit':
+                    writer.write(_encode('OK'))
+                    break
+                if name == 'multi':
+                    conn.queued = []
+                    reply = 'OK'
+                elif name == 'discard':
+                    conn.queued, conn.watched = None, {}
+                    reply = 'OK'
+                elif name == 'exec':
+                    queued, conn.queued = conn.queued or [], None
+                    db = kv.db(conn.db)
+                    if any(db.version(k) != v for k, v in conn.watched.items()):
+                        reply = None
+                        writer.write(b'*-1\r\n')
+                    else:
+                        results = []
+                        for qname, qargs in queued:
+                            try:
+                                results.append(kv.execute(conn, qname, qargs))
+                            except _Error as e:
+                                results.append(e)
+                        reply = results
+                    conn.watched = {}
+                    if reply is None:
+                        await writer.drain()
+                        continue
+                elif conn.queued is not None:
+                    conn.queued.append((name, rest))
+                    reply = 'QUEUED'
+                elif name == 'watch':
+                    db = kv.db(conn.db)
+                    for key in rest:
+                        conn.watched[key] = db.version(key)
+                    reply = 'OK'
+                elif name == 'unwatch':
+                    conn.watched = {}
+                    reply = 'OK'
+                elif name == 'blpop':
+                    reply = await kv.blpop(conn, rest)
+                    if reply is None:
+                        writer.write(b'*-1\r\n')
+                        await writer.drain()
+                        continue
+                else:
+                    reply = kv.execute(conn, name, rest)
+            except _Error as e:
+                reply = e
+            except (ValueError, IndexError):
+                reply = _Error(f"ERR syntax error in '{name}'")
+            writer.write(_encode(reply))
+            await writer.drain()
+    except (ConnectionError, asyncio.IncompleteReadError):
+        pass
+    finally:
+        writer.close()
+
+
+async def start(host: str = '127.0.0.1', port: int = 6390) -> asyncio.AbstractServer:
+    kv = FakeKV()
+    return await asyncio.start_server(lambda r, w: _serve(kv, r, w), host, port)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Local stand-in key-value server (Redis protocol subset)')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=6390)
+    args = parser.parse_args(argv)
+
+    async def _run():
+        server = await start(args.host, args.port)
+        print(f"[FAKE_KV] Listening on {args.host}:{args.port}", flush=True)
+        async with server:
+            await server.serve_forever()
+
+    try:
+        asyncio.run(_run())
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    main()
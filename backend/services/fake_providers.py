@@ -0,0 +1,235 @@
+"""
+Offline stand-ins for the AI providers, for load tests and local runs without keys.
+
+Enabled per provider with ``FAKE_PROVIDERS=groq,gemini,edge_tts,gtts`` (or
+``all``); ``services/providers.py`` returns these objects instead of the real
+clients. Each call sleeps ``FAKE_PROVIDER_LATENCY_MS`` and fails with
+probability ``FAKE_PROVIDER_ERROR_RATE``, so the gateway limits and load
+shedding can be exercised without network access. Per-provider overrides:
+``FAKE_GROQ_LATENCY_MS``, ``FAKE_GEMINI_ERROR_RATE`` and so on.
+
+Latency specs: ``200`` (fixed), ``100-400`` (uniform) or ``lognormal:800:0.5``
+(median 800 ms, sigma 0.5 — long tail like real provider APIs).
+
+- groq: ``client.audio.transcriptions.create(file=...)`` returns a fixed text
+  (``FakeAsyncGroq`` — the same for ``AsyncGroq``).
+- gemini: review prompts get the input back unchanged (``changed=false``), or
+  with probability ``FAKE_GEMINI_CHANGE_RATE`` with a one-character
+  correction; translation prompts get the source text back; ``stream=True``
+  and ``generate_content_async`` are supported.
+- edge_tts / gtts: a few bytes of fake audio.
+- local_whisper: ``WhisperModel.transcribe`` returns one segment with a fixed
+  text (it never fails: a local engine has no provider errors).
+- local_tts: every voice exists; ``synthesize`` returns a few bytes of fake MP3.
+- embeddings: hashed bag of words and word prefixes (256 dims), so texts that
+  share words come out similar.
+"""
+import asyncio
+import json
+import math
+import os
+import random
+import re
+import time
+import zlib
+from types import SimpleNamespace
+
+def enabled(provider: str) -> bool:
+    names = {n.strip().lower() for n in os.getenv('FAKE_PROVIDERS', '').split(',') if n.strip()}
+    return provider in names or 'all' in names
+
+
+def _setting(provider: str, key: str, default: str) -> str:
+    return os.getenv(f'FAKE_{provider.upper()}_{key}') or os.getenv(f'FAKE_PROVIDER_{key}', default)
+
+
+def sample_latency_ms(spec: str) -> float:
+    spec = (spec or '0').strip()
+    if spec.startswith('lognormal:'):
+        _, median, sigma = spec.split(':')
+        return float(median) * math.exp(random.gauss(0.0, float(sigma)))
+    lo, _, hi = spec.partition('-')
+    return random.uniform(float(lo or 0), float(hi)) if hi else float(lo or 0)
+
+
+def _latency(provider: str) -> float:
+    return sample_latency_ms(_setting(provider, 'LATENCY_MS', '200')) / 1000.0
+
+
+def _maybe_fail(provider: str):
+    if random.random() < float(_setting(provider, 'ERROR_RATE', '0')):
+        raise RuntimeError(f"fake {provider} error")
+
+
+# --- Groq ---
+
+def _transcription(file):
+    # file: открытый файл или кортеж (имя, байты), как принимает groq
+    if file is None:
+        size = 0
+    elif isinstance(file, tuple):
+        size = len(file[1])
+    else:
+        size = len(file.read())
+    return SimpleNamespace(text=f"Fake transcription of {size} bytes.")
+
+
+class _FakeTranscriptions:
+    def create(self, file=None, model=None, language=None, **kwargs):
+        time.sleep(_latency('groq'))
+        _maybe_fail('groq')
+        return _transcription(file)
+
+
+class _FakeAsyncTranscriptions:
+    async def create(self, file=None, model=None, language=None, **kwargs):
+        await asyncio.sleep(_latency('groq'))
+        _maybe_fail('groq')
+        return _transcription(file)
+
+
+class FakeGroq:
+    def __init__(self):
+        self.audio = SimpleNamespace(transcriptions=_FakeTranscriptions())
+
+
+class FakeAsyncGroq:
+    def __init__(self):
+        self.audio = SimpleNamespace(transcriptions=_FakeAsyncTranscriptions())
+
+
+class FakeWhisperModel:
+    def transcribe(self, audio, language=None, **kwargs):
+        time.sleep(_latency('local_whisper'))
+        size = len(audio.read()) if hasattr(audio, 'read') else os.path.getsize(audio)
+        info = SimpleNamespace(language=language or 'en', duration=0.0)
+        return iter([SimpleNamespace(text=f" Fake local transcription of {size} bytes.")]), info
+
+
+# --- Gemini ---
+
+_REVIEW_MARK = 'Фраза: """'
+_TRANSLATE_MARKS = ('HTML: \n', 'Текст: \n')
+
+
+def _reply(prompt: str) -> str:
+    if _REVIEW_MARK in prompt:
+        source = prompt.split(_REVIEW_MARK, 1)[1].rsplit('"""', 1)[0]
+        changed = bool(source) and random.random() < float(os.getenv('FAKE_GEMINI_CHANGE_RATE', '0'))
+        corrected = source[:1].swapcase() + source[1:] if changed else source
+        return json.dumps({
+            'corrected_text': corrected,
+            'explanations': ['1. Fake correction.'] if changed else [],
+            'language': 'en',
+            'changed': changed,
+            'ui_translation': corrected,
+        }, ensure_ascii=False)
+    for mark in _TRANSLATE_MARKS:
+        if mark in prompt:
+            return prompt.split(mark, 1)[1]
+    return prompt
+
+
+class _FakeResponse:
+    usage_metadata = None
+
+    def __init__(self, text: str, chunk_chars: int = 0):
+        self.text = text
+        self._chunk_chars = chunk_chars
+
+    def __iter__(self):
+        step = self._chunk_chars or len(self.text) or 1
+        delay = _latency('gemini') / max(1, len(self.text) // step)
+        for i in range(0, len(self.text), step):
+            time.sleep(delay)
+            yield SimpleNamespace(text=self.text[i:i + step])
+
+
+class _FakeAsyncResponse(_FakeResponse):
+    async def __aiter__(self):
+        step = self._chunk_chars or len(self.text) or 1
+        delay = _latency('gemini') / max(1, len(self.text) // step)
+        for i in range(0, len(self.text), step):
+            await asyncio.sleep(delay)
+            yield SimpleNamespace(text=self.text[i:i + step])
+
+
+class _FakeModel:
+    def __init__(self, model_name: str):
+        self.model_name = model_name
+
+    def generate_content(self, prompt, stream: bool = False, **kwargs):
+        _maybe_fail('gemini')
+        if stream:
+            return _FakeResponse(_reply(prompt), chunk_chars=16)
+        time.sleep(_latency('gemini'))
+        return _FakeResponse(_reply(prompt))
+
+    async def generate_content_async(self, prompt, stream: bool = False, **kwargs):
+        _maybe_fail('gemini')
+        if stream:
+            return _FakeAsyncResponse(_reply(prompt), chunk_chars=16)
+        await asyncio.sleep(_latency('gemini'))
+        return _FakeAsyncResponse(_reply(prompt))
+
+
+class FakeGenai:
+    GenerativeModel = _FakeModel
+
+    @staticmethod
+    def configure(**kwargs):
+        pass
+
+
+# --- TTS ---
+
+class _FakeCommunicate:
+    def __init__(self, text: str, voice: str = None, **kwargs):
+        self.text = text
+        self.voice = voice
+
+    async def stream(self):
+        await asyncio.sleep(_latency('edge_tts'))
+        _maybe_fail('edge_tts')
+        yield {'type': 'audio', 'data': b'ID3fake-' + self.text[:16].encode('utf-8')}
+
+
+FakeEdgeTTS = SimpleNamespace(Communicate=_FakeCommunicate)
+
+
+class FakeGTTS:
+    def __init__(self, text: str, lang: str = 'en', **kwargs):
+        self.text = text
+        self.lang = lang
+
+    def write_to_fp(self, fp):
+        time.sleep(_latency('gtts'))
+        _maybe_fail('gtts')
+        fp.write(b'ID3fake-' + self.text[:16].encode('utf-8'))
+
+
+class FakeLocalTTS:
+    def has_voice(self, voice: str) -> bool:
+        return True
+
+    def synthesize(self, text: str, voice: str) -> bytes:
+        time.sleep(_latency('local_tts'))
+        return b'ID3fake-local-' + text[:16].encode('utf-8')
+
+
+# --- Embeddings ---
+
+class FakeEmbedder:
+    name = 'fake-hash'
+    dim = 256
+
+    def embed(self, texts):
+        import numpy as np
+        from services import semantic
+        time.sleep(_latency('embeddings'))
+        vecs = np.zeros((len(texts), self.dim), dtype=np.float32)
+        for row, text in enumerate(texts):
+            for word in re.findall(r'\w+', (text or '').lower()):
+                for feature in (word, word[:4]):
+                    vecs[row, zlib.crc32(feature.encode('utf-8')) % self.dim] += 1.0
+        return semantic.normalize(vecs)
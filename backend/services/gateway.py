@@ -0,0 +1,288 @@
+"""
+Client-side concurrency limits, deadlines and load shedding for AI providers.
+
+Every outbound call to Groq, Gemini, edge_tts and gTTS goes through
+``call(provider, fn, *args)``:
+
+- Per-provider adaptive limit (AIMD): a call that finishes without error and
+  under the provider's target latency raises the limit by ``1/limit``
+  (about +1 per round trip at full load); an overload signal (timeout, 5xx,
+  429, connection error) or a slow call multiplies it by ``PROVIDER_BACKOFF``.
+  Client and configuration errors (bad key, 4xx prompt errors, unknown model)
+  say nothing about provider load and leave the limit unchanged
+  (``overload_signal``). The limit stays within ``[min, max]``.
+- Deadlines: the Flask app sets a per-request deadline (``X-Request-Timeout``
+  header, capped by ``REQUEST_DEADLINE_SECONDS``); each call's timeout is the
+  smaller of the provider timeout and the time left. Threads started with
+  ``contextvars.copy_context()`` inherit the deadline.
+- Load shedding: when all slots are busy a call waits at most
+  ``PROVIDER_QUEUE_WAIT`` seconds (bounded by the deadline) and then fails
+  fast with ``ProviderOverloaded``; routes answer 503 with ``Retry-After``.
+
+The provider function runs in a per-provider thread pool so a hung provider
+can be abandoned at the deadline. Its slot is released only when the call
+actually returns, so the limit reflects real in-flight load on the provider.
+
+``acall(provider, coro_fn, *args)`` is the same for the async serving mode
+(``asgi.py``): the coroutine is awaited on the event loop with the same
+limits and counters, and is cancelled at the deadline, which frees its slot.
+
+Settings per provider (NAME = GROQ, GEMINI, EDGE_TTS, GTTS, LOCAL_WHISPER,
+LOCAL_TTS):
+``PROVIDER_<NAME>_LIMIT`` (initial), ``_MIN_LIMIT``, ``_MAX_LIMIT``,
+``_TIMEOUT`` (seconds), ``_TARGET_MS`` (latency above which the limit shrinks).
+"""
+import asyncio
+import contextvars
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeout
+from typing import Callable, Dict, Optional
+
+REQUEST_DEADLINE_SECONDS = float(os.getenv('REQUEST_DEADLINE_SECONDS', '25'))
+PROVIDER_QUEUE_WAIT = float(os.getenv('PROVIDER_QUEUE_WAIT', '0.5'))
+PROVIDER_BACKOFF = float(os.getenv('PROVIDER_BACKOFF', '0.7'))
+
+# name: (initial, min, max, timeout seconds, target latency ms)
+_DEFAULTS = {
+    'groq': (4, 1, 16, 20.0, 8000),
+    'gemini': (4, 1, 16, 20.0, 6000),
+    'edge_tts': (4, 1, 16, 10.0, 3000),
+    'gtts': (2, 1, 8, 10.0, 3000),
+    # Локальный Whisper на CPU: лимит — число одновременных расшифровок (LOCAL_WHISPER_WORKERS)
+    'local_whisper': (2, 1, 4, 30.0, 10000),
+    'local_tts': (2, 1, 4, 10.0, 1000),
+    # Эмбеддинг поискового запроса локальной моделью (services/semantic.py)
+    'embeddings': (2, 1, 4, 5.0, 500),
+}
+
+_deadline: contextvars.ContextVar = contextvars.ContextVar('provider_deadline', default=None)
+
+
+class ProviderUnavailable(Exception):
+    """Провайдер недоступен сейчас; запрос стоит повторить позже (HTTP 503)."""
+    reason = 'unavailable'
+
+    def __init__(self, provider: str, message: str, retry_after: int = 1):
+        super().__init__(message)
+        self.provider = provider
+        self.retry_after = retry_after
+
+
+class ProviderOverloaded(ProviderUnavailable):
+    reason = 'overloaded'
+
+
+class ProviderTimeout(ProviderUnavailable):
+    reason = 'timeout'
+
+
+class DeadlineExceeded(ProviderUnavailable):
+    reason = 'deadline'
+
+
+# --- Deadlines ---
+
+def set_deadline(seconds: Optional[float]):
+    """Установить дедлайн текущего контекста; возвращает токен для reset_deadline."""
+    return _deadline.set(time.monotonic() + seconds if seconds else None)
+
+
+def reset_deadline(token):
+    _deadline.reset(token)
+
+
+def remaining() -> Optional[float]:
+    deadline = _deadline.get()
+    return None if deadline is None else deadline - time.monotonic()
+
+
+def request_timeout(header_value: Optional[str]) -> float:
+    """Таймаут запроса из заголовка X-Request-Timeout (секунды), не больше REQUEST_DEADLINE_SECONDS."""
+    try:
+        value = float(header_value) if header_value else 0.0
+    except ValueError:
+        value = 0.0
+    if value <= 0:
+        return REQUEST_DEADLINE_SECONDS
+    return min(value, REQUEST_DEADLINE_SECONDS)
+
+
+# --- Adaptive limit ---
+
+# Имена классов ошибок SDK (groq/httpx, google.api_core, aiohttp), означающих перегрузку или сбой сети
+_OVERLOAD_NAMES = ('Timeout', 'Connect', 'Connection', 'Unavailable', 'RateLimit', 'ResourceExhausted',
+                   'ServerError', 'TooManyRequests', 'ServerDisconnected')
+
+
+def _status(exc: BaseException) -> Optional[int]:
+    for value in (getattr(exc, 'status_code', None), getattr(exc, 'code', None), getattr(exc, 'status', None),
+                  getattr(getattr(exc, 'response', None), 'status_code', None)):
+        if isinstance(value, int) and 100 <= value < 600:
+            return value
+    return None
+
+
+def overload_signal(exc: BaseException) -> bool:
+    """Ошибка говорит о перегрузке провайдера (таймаут, 5xx, 429, сеть), а не о запросе или настройке."""
+    if isinstance(exc, (TimeoutError, asyncio.TimeoutError, ConnectionError, ProviderUnavailable)):
+        return True
+    status = _status(exc)
+    if status is not None:
+        return status == 429 or status >= 500
+    if isinstance(exc, OSError):
+        return True
+    return any(part in cls.__name__ for cls in type(exc).__mro__ for part in _OVERLOAD_NAMES)
+
+
+def _outcome(exc: Optional[BaseException]) -> Optional[bool]:
+    # True — успех, False — сигнал перегрузки, None — ошибка клиента/настройки (лимит не меняется)
+    if exc is None:
+        return True
+    return False if overload_signal(exc) else None
+
+def _env(name: str, key: str, default):
+    raw = os.getenv(f"PROVIDER_{name.upper()}_{key}")
+    return type(default)(raw) if raw else default
+
+
+class AdaptiveLimit:
+    def __init__(self, name: str):
+        initial, min_limit, max_limit, timeout, target_ms = _DEFAULTS.get(name, (4, 1, 16, 20.0, 5000))
+        self.name = name
+        self.min_limit = max(1, _env(name, 'MIN_LIMIT', min_limit))
+        self.max_limit = max(self.min_limit, _env(name, 'MAX_LIMIT', max_limit))
+        self.limit = float(min(max(_env(name, 'LIMIT', initial), self.min_limit), self.max_limit))
+        self.timeout = _env(name, 'TIMEOUT', timeout)
+        self.target = _env(name, 'TARGET_MS', target_ms) / 1000.0
+        self.inflight = 0
+        self.counters = {'calls': 0, 'errors': 0, 'client_errors': 0, 'slow': 0, 'timeouts': 0, 'shed': 0}
+        self._cond = threading.Condition()
+        self._pool = ThreadPoolExecutor(max_workers=self.max_limit, thread_name_prefix=f'provider-{name}')
+
+    def _overloaded(self) -> ProviderOverloaded:
+        self.counters['shed'] += 1
+        return ProviderOverloaded(
+            self.name, f"{self.name} is overloaded ({self.inflight} calls in flight), try again later")
+
+    def acquire(self, wait: float):
+        with self._cond:
+            end = time.monotonic() + max(0.0, wait)
+            while self.inflight >= int(self.limit):
+                left = end - time.monotonic()
+                if left <= 0:
+                    raise self._overloaded()
+                self._cond.wait(left)
+            self.inflight += 1
+
+    async def acquire_async(self, wait: float):
+        # Слоты общие с синхронными вызовами (потоки WSGI в том же процессе), поэтому ждём опросом, не блокируя цикл
+        end = time.monotonic() + max(0.0, wait)
+        while True:
+            with self._cond:
+                if self.inflight < int(self.limit):
+                    self.inflight += 1
+                    return
+                if time.monotonic() >= end:
+                    raise self._overloaded()
+            await asyncio.sleep(min(0.01, max(0.0, end - time.monotonic())))
+
+    def release(self, latency: float, ok: Optional[bool]):
+        """ok: True — успех, False — перегрузка/сбой, None — нейтральная ошибка клиента."""
+        with self._cond:
+            self.inflight -= 1
+            self.counters['calls'] += 1
+            if ok is None:
+                self.counters['client_errors'] += 1
+                self._cond.notify()
+                return
+            if not ok:
+                self.counters['errors'] += 1
+            elif latency > self.target:
+                self.counters['slow'] += 1
+            if ok and latency <= self.target:
+                self.limit = min(float(self.max_limit), self.limit + 1.0 / self.limit)
+            else:
+                self.limit = max(float(self.min_limit), self.limit * PROVIDER_BACKOFF)
+            self._cond.notify()
+
+    def snapshot(self) -> dict:
+        with self._cond:
+            return dict(self.counters, limit=round(self.limit, 2), inflight=self.inflight)
+
+
+_limits: Dict[str, AdaptiveLimit] = {}
+_limits_lock = threading.Lock()
+
+
+def get_limit(provider: str) -> AdaptiveLimit:
+    limit = _limits.get(provider)
+    if limit is None:
+        with _limits_lock:
+            limit = _limits.get(provider)
+            if limit is None:
+                limit = _limits[provider] = AdaptiveLimit(provider)
+    return limit
+
+
+def call(provider: str, fn: Callable, *args, **kwargs):
+    """Вызвать fn(*args, **kwargs) с учётом лимита провайдера и дедлайна запроса."""
+    limit = get_limit(provider)
+    left = remaining()
+    if left is not None and left <= 0:
+        raise DeadlineExceeded(provider, f"Request deadline exceeded before calling {provider}")
+    timeout = limit.timeout if left is None else min(limit.timeout, left)
+    limit.acquire(min(PROVIDER_QUEUE_WAIT, timeout))
+
+    started = time.monotonic()
+    try:
+        future = limit._pool.submit(contextvars.copy_context().run, fn, *args, **kwargs)
+    except Exception:
+        limit.release(0.0, False)
+        raise
+    timed_out = []  # брошенный по таймауту вызов считается ошибкой, даже если потом завершится успешно
+    future.add_done_callback(
+        lambda f: limit.release(time.monotonic() - started, False if timed_out else _outcome(f.exception())))
+    try:
+        return future.result(timeout=max(0.0, timeout - (time.monotonic() - started)))
+    except FutureTimeout:
+        timed_out.append(True)
+        with limit._cond:
+            limit.counters['timeouts'] += 1
+        raise ProviderTimeout(provider, f"{provider} did not respond within {timeout:.1f}s",
+                              retry_after=max(1, int(limit.target)))
+
+
+async def acall(provider: str, fn: Callable, *args, **kwargs):
+    """await fn(*args, **kwargs) с учётом лимита провайдера и дедлайна запроса (async-режим)."""
+    limit = get_limit(provider)
+    left = remaining()
+    if left is not None and left <= 0:
+        raise DeadlineExceeded(provider, f"Request deadline exceeded before calling {provider}")
+    timeout = limit.timeout if left is None else min(limit.timeout, left)
+    await limit.acquire_async(min(PROVIDER_QUEUE_WAIT, timeout))
+
+    started = time.monotonic()
+    ok = False
+    try:
+        result = await asyncio.wait_for(fn(*args, **kwargs), max(0.0, timeout - (time.monotonic() - started)))
+        ok = True
+        return result
+    except asyncio.TimeoutError:
+        with limit._cond:
+            limit.counters['timeouts'] += 1
+        raise ProviderTimeout(provider, f"{provider} did not respond within {timeout:.1f}s",
+                              retry_after=max(1, int(limit.target)))
+    except asyncio.CancelledError:
+        ok = None  # запрос отменил клиент — провайдер тут ни при чём
+        raise
+    except Exception as e:
+        ok = _outcome(e)
+        raise
+    finally:
+        limit.release(time.monotonic() - started, ok)
+
+
+def snapshot() -> dict:
+    return {name: limit.snapshot() for name, limit in sorted(_limits.items())}
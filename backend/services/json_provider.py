@@ -0,0 +1,85 @@
+"""
+JSON provider for ``app.json`` (Flask and the Quart app in asgi.py).
+
+orjson is used when it is installed; otherwise the stdlib encoder is used.
+Both backends write datetimes and dates as ISO 8601, the same as
+``datetime.isoformat()``, so models can hand raw datetime values to
+``jsonify``. Flask's default provider would write them as HTTP dates.
+
+- orjson emits compact UTF-8 (no ``\\uXXXX`` escapes for Cyrillic). Keys stay
+  sorted, as they are with Flask's provider.
+- Pretty-printed output (``debug`` / ``JSONIFY_PRETTYPRINT``) and values
+  orjson cannot encode (ints beyond 64 bits, for example) go through the
+  stdlib path.
+- ``JSON_PROVIDER=stdlib`` forces the stdlib encoder (for benchmarks and
+  debugging).
+"""
+import dataclasses
+import decimal
+import os
+import uuid
+from datetime import date, datetime
+
+from flask.json.provider import DefaultJSONProvider
+
+try:
+    import orjson
+except Exception:  # optional dependency
+    orjson = None
+
+JSON_PROVIDER = os.getenv('JSON_PROVIDER', 'auto').strip().lower()
+
+if orjson is not None:
+    _ORJSON_OPTIONS = orjson.OPT_SORT_KEYS | orjson.OPT_NON_STR_KEYS
+
+
+def _default(o):
+    if isinstance(o, (datetime, date)):
+        return o.isoformat()
+    if isinstance(o, (decimal.Decimal, uuid.UUID)):
+        return str(o)
+    if dataclasses.is_dataclass(o):
+        return dataclasses.asdict(o)
+    if hasattr(o, '__html__'):
+        return str(o.__html__())
+    raise TypeError(f"Object of type {type(o).__name__} is not JSON serializable")
+
+
+def backend() -> str:
+    return 'orjson' if orjson is not None and JSON_PROVIDER != 'stdlib' else 'stdlib'
+
+
+class FastJSONProvider(DefaultJSONProvider):
+    default = staticmethod(_default)
+
+    def __init__(self, app, use_orjson=None):
+        super().__init__(app)
+        self.use_orjson = backend() == 'orjson' if use_orjson is None else bool(use_orjson and orjson)
+
+    def _orjson_bytes(self, obj, newline: bool = False):
+        # None — orjson не справился, остаётся путь через stdlib
+        option = _ORJSON_OPTIONS | orjson.OPT_APPEND_NEWLINE if newline else _ORJSON_OPTIONS
+        try:
+            return orjson.dumps(obj, default=_default, option=option)
+        except TypeError:
+            return None
+
+    def dumps(self, obj, **kwargs) -> str:
+        if self.use_orjson and not kwargs:
+            data = self._orjson_bytes(obj)
+            if data is not None:
+                return data.decode('utf-8')
+        return super().dumps(obj, **kwargs)
+
+    def loads(self, s, **kwargs):
+        if self.use_orjson and not kwargs:
+            return orjson.loads(s)
+        return super().loads(s, **kwargs)
+
+    def response(self, *args, **kwargs):
+        pretty = self.compact is False or (self.compact is None and self._app.debug)
+        if self.use_orjson and not pretty:
+            data = self._orjson_bytes(self._prepare_response_obj(args, kwargs), newline=True)
+            if data is not None:
+                return self._app.response_class(data, mimetype=self.mimetype)
+        return super().response(*args, **kwargs)
@@ -0,0 +1,74 @@
+"""
+Local neural TTS on the worker's CPU (Piper voices, ONNX), as an engine of synthesize_tts.
+
+Voices are Piper models ``LOCAL_TTS_DIR/<voice>.onnx`` (plus ``.onnx.json``),
+named in the per-language voice mapping of app.py (the ``'local'`` key next
+to the Edge TTS voices). A voice is loaded on its first use and stays resident
+in the worker. Threads share it: onnxruntime sessions are thread-safe, and
+concurrency is bounded by the gateway limit ``local_tts``.
+
+Synthesis produces raw 16-bit PCM that is encoded to MP3 in memory with
+``lameenc`` when installed; otherwise it goes through an ffmpeg pipe. The result
+is the same ``audio/mpeg`` as the network engines return, with no temp files
+and no network.
+
+``TTS_ENGINES`` (app.py) sets the engine priority, e.g.
+``local_tts,edge_tts,gtts``. Voices whose model file is missing are left out of
+the plan.
+"""
+import os
+import subprocess
+import threading
+from typing import Dict
+
+LOCAL_TTS_DIR = os.getenv('LOCAL_TTS_DIR', '/app/data/piper')
+LOCAL_TTS_MP3_KBPS = int(os.getenv('LOCAL_TTS_MP3_KBPS', '64'))
+
+
+def _encode_mp3(pcm: bytes, sample_rate: int) -> bytes:
+    try:
+        import lameenc
+    except Exception:
+        lameenc = None
+    if lameenc is not None:
+        encoder = lameenc.Encoder()
+        encoder.set_bit_rate(LOCAL_TTS_MP3_KBPS)
+        encoder.set_in_sample_rate(sample_rate)
+        encoder.set_channels(1)
+        encoder.set_quality(5)
+        return encoder.encode(pcm) + encoder.flush()
+    cmd = ['ffmpeg', '-v', 'error', '-f', 's16le', '-ar', str(sample_rate), '-ac', '1', '-i', 'pipe:0',
+           '-f', 'mp3', '-b:a', f'{LOCAL_TTS_MP3_KBPS}k', 'pipe:1']
+    res = subprocess.run(cmd, input=pcm, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    if res.returncode != 0:
+        raise RuntimeError(f"ffmpeg mp3 encode failed: {res.stderr.decode('utf-8', 'replace')[-500:]}")
+    return res.stdout
+
+
+class PiperEngine:
+    def __init__(self, voice_class, voices_dir: str = LOCAL_TTS_DIR):
+        self._voice_class = voice_class
+        self.voices_dir = voices_dir
+        self._voices: Dict[str, object] = {}
+        self._lock = threading.Lock()
+
+    def model_path(self, voice: str) -> str:
+        return os.path.join(self.voices_dir, voice + '.onnx')
+
+    def has_voice(self, voice: str) -> bool:
+        return voice in self._voices or os.path.exists(self.model_path(voice))
+
+    def _voice(self, voice: str):
+        model = self._voices.get(voice)
+        if model is None:
+            with self._lock:
+                model = self._voices.get(voice)
+                if model is None:
+                    model = self._voices[voice] = self._voice_class.load(self.model_path(voice))
+        return model
+
+    def synthesize(self, text: str, voice: str) -> bytes:
+        """MP3 bytes of text spoken by the Piper voice."""
+        model = self._voice(voice)
+        pcm = b''.join(model.synthesize_stream_raw(text))
+        return _encode_mp3(pcm, model.config.sample_rate)
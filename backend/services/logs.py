@@ -0,0 +1,236 @@
+"""
+Structured JSON logging for the request path.
+
+- ``get_logger('transcribe')`` returns a logger for category ``transcribe``;
+  keyword arguments become JSON fields:
+  ``log.info('transcribed', sample='transcribe.success', bytes=n, chars=m)``.
+- Every record carries the current request id (``X-Request-ID`` from the
+  client or a generated one), so all lines of one request can be grouped.
+- Levels: ``LOG_LEVEL`` (default INFO); per-category overrides in
+  ``LOG_LEVELS`` (``transcribe=DEBUG,tts=WARNING``).
+- Sampling: ``LOG_SAMPLE`` (``transcribe.success=0.01,review=0.1``) keeps the
+  given share of INFO/DEBUG records of a category (or of an explicit
+  ``sample=`` key); WARNING and above are never sampled out.
+- Output: records go through a bounded in-memory queue to a background
+  thread that formats and writes them to stdout, so the request thread never
+  blocks on I/O. When the queue is full records are dropped and counted
+  (``dropped()``) instead of stalling requests.
+
+``LOG_FORMAT=text`` switches to the old ``[CATEGORY] message key=value`` lines
+for local development.
+"""
+import atexit
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import random
+import re
+import sys
+import threading
+import uuid
+from contextvars import ContextVar
+from datetime import datetime, timezone
+from typing import Dict, Optional
+
+ROOT = 'diary'
+LOG_LEVEL = os.getenv('LOG_LEVEL', 'INFO').upper()
+LOG_FORMAT = os.getenv('LOG_FORMAT', 'json').lower()
+LOG_QUEUE_SIZE = int(os.getenv('LOG_QUEUE_SIZE', '10000'))
+_DEFAULT_SAMPLE = 'transcribe.success=0.01'
+
+_request_id: ContextVar = ContextVar('request_id', default='-')
+_REQUEST_ID_RE = re.compile(r'^[A-Za-z0-9._-]{1,64}$')
+_RESERVED = frozenset(['exc_info', 'stack_info', 'stacklevel', 'extra'])
+
+_setup_lock = threading.Lock()
+_listener: Optional[logging.handlers.QueueListener] = None
+_rates: Dict[str, float] = {}
+_dropped = 0
+_dropped_lock = threading.Lock()
+
+
+def _parse_pairs(raw: str) -> Dict[str, str]:
+    pairs = {}
+    for item in (raw or '').split(','):
+        key, sep, value = item.partition('=')
+        if sep and key.strip():
+            pairs[key.strip().lower()] = value.strip()
+    return pairs
+
+
+# --- Request id ---
+
+def new_request_id(header_value: Optional[str] = None) -> str:
+    """Request id из заголовка клиента (если корректный) или новый."""
+    if header_value and _REQUEST_ID_RE.match(header_value):
+        return header_value
+    return uuid.uuid4().hex[:16]
+
+
+def set_request_id(value: str):
+    return _request_id.set(value)
+
+
+def get_request_id() -> str:
+    return _request_id.get()
+
+
+# --- Records ---
+
+def _sampled_out(category: str, sample: Optional[str]) -> bool:
+    key = sample or category
+    rate = _rates.get(key)
+    if rate is None and '.' in key:
+        rate = _rates.get(key.split('.', 1)[0])
+    return rate is not None and random.random() >= rate
+
+
+class StructuredLogger(logging.LoggerAdapter):
+    """log.info(msg, key=value, ...): именованные аргументы попадают в JSON полями; sample= — ключ семплирования."""
+
+    def __init__(self, logger, category: str):
+        super().__init__(logger, {})
+        self.category = category
+
+    def log(self, level, msg, *args, **kwargs):
+        # Семплирование до создания LogRecord: отброшенная запись почти ничего не стоит
+        if not self.isEnabledFor(level):
+            return
+        if level < logging.WARNING and _rates and _sampled_out(self.category, kwargs.get('sample')):
+            return
+        super().log(level, msg, *args, **kwargs)
+
+    def process(self, msg, kwargs):
+        fields = {k: kwargs.pop(k) for k in list(kwargs) if k not in _RESERVED}
+        fields.pop('sample', None)
+        if fields:
+            kwargs.setdefault('extra', {})['fields'] = fields
+        return msg, kwargs
+
+
+def _category(record) -> str:
+    name = record.name
+    return name[len(ROOT) + 1:] if name.startswith(ROOT + '.') else name
+
+
+class _ContextFilter(logging.Filter):
+    """Выполняется в потоке запроса: фиксирует request id (форматирование идёт в другом потоке)."""
+
+    def filter(self, record) -> bool:
+        record.request_id = _request_id.get()
+        return True
+
+
+class _NonBlockingQueueHandler(logging.handlers.QueueHandler):
+    def enqueue(self, record):
+        global _dropped
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            # Очередь полна у многих потоков сразу: без блокировки += теряет инкременты
+            with _dropped_lock:
+                _dropped += 1
+
+    def prepare(self, record):
+        # Форматирование — в фоновом потоке; здесь только фиксируем текст сообщения и трассировку
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        record.msg = record.getMessage()
+        record.args = None
+        return record
+
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record) -> str:
+        data = {
+            'ts': datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec='milliseconds'),
+            'level': record.levelname.lower(),
+            'category': _category(record),
+            'msg': record.getMessage(),
+            'request_id': getattr(record, 'request_id', '-'),
+        }
+        fields = getattr(record, 'fields', None)
+        if fields:
+            for key, value in fields.items():
+                data.setdefault(key, value)
+        if record.exc_text:
+            data['exc'] = record.exc_text
+        return json.dumps(data, ensure_ascii=False, default=str)
+
+
+class TextFormatter(logging.Formatter):
+    def format(self, record) -> str:
+        parts = [f"[{_category(record).upper()}]", record.getMessage()]
+        fields = getattr(record, 'fields', None)
+        if fields:
+            parts.extend(f"{k}={v}" for k, v in fields.items())
+        rid = getattr(record, 'request_id', '-')
+        if rid != '-':
+            parts.append(f"rid={rid}")
+        line = ' '.join(parts)
+        if record.exc_text:
+            line += '\n' + record.exc_text
+        return line
+
+
+def setup(stream=None):
+    """Настроить логгер 'diary' (один раз на процесс): очередь + фоновый поток вывода."""
+    global _listener, _rates
+    with _setup_lock:
+        if _listener is not None:
+            return
+        root = logging.getLogger(ROOT)
+        root.setLevel(LOG_LEVEL)
+        root.propagate = False
+        for category, level in _parse_pairs(os.getenv('LOG_LEVELS', '')).items():
+            logging.getLogger(f'{ROOT}.{category}').setLevel(level.upper())
+
+        _rates = {k: float(v) for k, v in _parse_pairs(os.getenv('LOG_SAMPLE', _DEFAULT_SAMPLE)).items()}
+        output = logging.StreamHandler(stream or sys.stdout)
+        output.setFormatter(TextFormatter() if LOG_FORMAT == 'text' else JsonFormatter())
+        log_queue = queue.Queue(maxsize=LOG_QUEUE_SIZE)
+        handler = _NonBlockingQueueHandler(log_queue)
+        handler.addFilter(_ContextFilter())
+        root.handlers[:] = [handler]
+        _listener = logging.handlers.QueueListener(log_queue, output, respect_handler_level=False)
+        _listener.start()
+        atexit.register(shutdown)
+
+
+def shutdown():
+    """Дописать очередь и остановить фоновый поток."""
+    global _listener
+    with _setup_lock:
+        if _listener is not None:
+            _listener.stop()
+            _listener = None
+
+
+def get_logger(category: str) -> StructuredLogger:
+    setup()
+    return StructuredLogger(logging.getLogger(f'{ROOT}.{category}'), category)
+
+
+def dropped() -> int:
+    return _dropped
+
+
+def init_app(app):
+    """Request id на каждый запрос (X-Request-ID в ответе)."""
+
+    @app.before_request
+    def _bind_request_id():
+        from flask import request
+        set_request_id(new_request_id(request.headers.get('X-Request-ID')))
+
+    @app.after_request
+    def _expose_request_id(resp):
+        resp.headers['X-Request-ID'] = get_request_id()
+        return resp
+
+    @app.teardown_request
+    def _clear_request_id(exc):
+        set_request_id('-')
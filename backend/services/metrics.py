@@ -0,0 +1,158 @@
+"""
+Prometheus metrics: per-stage latency histograms, DB query time, payload sizes
+and cache hit/miss counters.
+
+Instrumentation is a thin layer over ``prometheus_client``:
+
+- ``with metrics.stage('ffmpeg'):`` / ``@metrics.instrument('tts_total')`` time
+  a block or wrap an existing function (also ``async def``); the result and
+  exceptions pass through unchanged and the outcome label is ``ok`` or ``error``.
+- ``instrument_engine(engine)`` times every SQL statement via SQLAlchemy
+  cursor events (label = statement verb).
+- ``cache_event(cache, hit)`` counts hits and misses (hit ratio in PromQL:
+  ``rate(diary_cache_events_total{result="hit"}[5m]) / rate(diary_cache_events_total[5m])``).
+
+Multiprocess mode: with ``PROMETHEUS_MULTIPROC_DIR`` set (Dockerfile), each
+gunicorn worker writes its samples to mmap files in that directory and
+``render()`` aggregates all workers; ``gunicorn.conf.py`` clears the
+directory on start and marks exited workers dead. Without
+``prometheus_client`` installed all hooks are no-ops.
+"""
+import inspect
+import os
+import time
+from contextlib import contextmanager
+from functools import wraps
+
+try:
+    import prometheus_client
+    from prometheus_client import Counter, Histogram
+except Exception:  # pragma: no cover - optional dependency
+    prometheus_client = None
+
+_LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 20.0, 30.0)
+_DB_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0)
+_SIZE_BUCKETS = (256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304, 16777216)
+
+if prometheus_client is not None:
+    STAGE_SECONDS = Histogram(
+        'diary_stage_seconds', 'Duration of a processing stage (target: provider model or voice)',
+        ['stage', 'target', 'outcome'], buckets=_LATENCY_BUCKETS)
+    HTTP_SECONDS = Histogram(
+        'diary_http_request_seconds', 'HTTP request handling time',
+        ['method', 'endpoint', 'status'], buckets=_LATENCY_BUCKETS)
+    DB_SECONDS = Histogram(
+        'diary_db_query_seconds', 'SQL statement execution time', ['statement'], buckets=_DB_BUCKETS)
+    PAYLOAD_BYTES = Histogram(
+        'diary_payload_bytes', 'Request/response body size', ['direction', 'endpoint'], buckets=_SIZE_BUCKETS)
+    CACHE_EVENTS = Counter('diary_cache_events_total', 'Cache lookups by result', ['cache', 'result'])
+
+
+def enabled() -> bool:
+    return prometheus_client is not None
+
+
+def observe(name: str, seconds: float, target: str = '', outcome: str = 'ok'):
+    if prometheus_client is not None:
+        STAGE_SECONDS.labels(name, target or '', outcome).observe(seconds)
+
+
+@contextmanager
+def stage(name: str, target: str = ''):
+    """Измерить длительность блока как этап name (исключения пробрасываются, outcome=error)."""
+    started = time.perf_counter()
+    outcome = 'error'
+    try:
+        yield
+        outcome = 'ok'
+    finally:
+        observe(name, time.perf_counter() - started, target, outcome)
+
+
+def instrument(name: str, target: str = ''):
+    """Декоратор: та же функция, но время вызова пишется в diary_stage_seconds{stage=name}."""
+    def decorator(fn):
+        if prometheus_client is None:
+            return fn
+
+        if inspect.iscoroutinefunction(fn):
+            @wraps(fn)
+            async def async_wrapper(*args, **kwargs):
+                with stage(name, target):
+                    return await fn(*args, **kwargs)
+            return async_wrapper
+
+        @wraps(fn)
+        def wrapper(*args, **kwargs):
+            with stage(name, target):
+                return fn(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def cache_event(cache: str, hit: bool):
+    if prometheus_client is not None:
+        CACHE_EVENTS.labels(cache, 'hit' if hit else 'miss').inc()
+
+
+def observe_http(method: str, endpoint: str, status: int, seconds: float):
+    if prometheus_client is not None:
+        HTTP_SECONDS.labels(method, endpoint, str(status)).observe(seconds)
+
+
+def observe_payload(direction: str, endpoint: str, size):
+    if prometheus_client is not None and size is not None:
+        PAYLOAD_BYTES.labels(direction, endpoint).observe(size)
+
+
+# --- SQLAlchemy ---
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault('metrics_query_start', []).append(time.perf_counter())
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    starts = conn.info.get('metrics_query_start')
+    if starts:
+        verb = statement.lstrip().split(None, 1)[0].upper() if statement else ''
+        DB_SECONDS.labels(verb[:16]).observe(time.perf_counter() - starts.pop())
+
+
+def _handle_error(context):
+    conn = context.connection
+    starts = conn.info.get('metrics_query_start') if conn is not None else None
+    if starts:
+        starts.pop()
+
+
+def instrument_engine(engine):
+    """Повесить замер времени SQL на engine (повторный вызов ничего не меняет)."""
+    if prometheus_client is None:
+        return
+    from sqlalchemy import event
+    if event.contains(engine, 'before_cursor_execute', _before_cursor_execute):
+        return
+    event.listen(engine, 'before_cursor_execute', _before_cursor_execute)
+    event.listen(engine, 'after_cursor_execute', _after_cursor_execute)
+    event.listen(engine, 'handle_error', _handle_error)
+
+
+# --- Exposition ---
+
+def render():
+    """(body, content_type) для /metrics; в multiprocess-режиме агрегирует все воркеры."""
+    if prometheus_client is None:
+        return b'', 'text/plain; charset=utf-8'
+    if os.getenv('PROMETHEUS_MULTIPROC_DIR'):
+        from prometheus_client import CollectorRegistry, multiprocess
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    else:
+        registry = prometheus_client.REGISTRY
+    return prometheus_client.generate_latest(registry), prometheus_client.CONTENT_TYPE_LATEST
+
+
+def mark_process_dead(pid: int):
+    if prometheus_client is not None and os.getenv('PROMETHEUS_MULTIPROC_DIR'):
+        from prometheus_client import multiprocess
+        multiprocess.mark_process_dead(pid)
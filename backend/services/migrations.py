@@ -0,0 +1,319 @@
+"""
+Versioned schema migrations.
+
+Each migration has an integer version and is applied at most once; applied
+versions are recorded in the ``schema_version`` table. Migrations are run
+explicitly (``python manage.py migrate``) before gunicorn forks its workers,
+so worker startup only needs ``schema_is_current()`` — a single
+``SELECT MAX(version)``.
+"""
+from collections import defaultdict
+from dataclasses import dataclass
+from datetime import date, datetime
+from typing import Callable, Dict, List, Optional
+
+from sqlalchemy import (
+    BigInteger, Column, Date, DateTime, Float, ForeignKey, Index, Integer, MetaData, String, Table, Text, bindparam,
+    func, inspect, select, text,
+)
+from sqlalchemy import exc as sa_exc
+from sqlalchemy.engine import Connection, Engine
+
+try:
+    from ..db import Base, Entry, User  # type: ignore
+except ImportError:
+    from db import Base, Entry, User  # type: ignore
+
+
+_meta = MetaData()
+schema_version = Table(
+    'schema_version', _meta,
+    Column('version', Integer, primary_key=True),
+    Column('description', String(255), nullable=False),
+    Column('applied_at', DateTime, nullable=False, default=datetime.utcnow),
+)
+
+# Tables as created by migrations 5-8, frozen at their version: later model changes need a new migration,
+# not an edit here. 'user' is only an FK target and 'entry' only the version-4 columns the backfills read;
+# neither is ever created from this metadata.
+_v = MetaData()
+Table('user', _v, Column('id', Integer, primary_key=True))
+
+_entry_v4 = Table(
+    'entry', _v,
+    Column('id', Integer, primary_key=True),
+    Column('text', Text, nullable=False),
+    Column('language', String(10), nullable=False),
+    Column('timestamp', DateTime),
+    Column('audio_duration', Float),
+    Column('user_id', Integer),
+    Column('deleted_at', DateTime),
+)
+
+_user_stats_daily_v5 = Table(
+    'user_stats_daily', _v,
+    Column('user_id', Integer, ForeignKey('user.id'), primary_key=True),
+    Column('language', String(10), primary_key=True),
+    Column('day', Date, primary_key=True),
+    Column('entries_count', Integer, nullable=False, server_default='0'),
+    Column('speaking_seconds', Float, nullable=False, server_default='0'),
+    Column('reviews_count', Integer, nullable=False, server_default='0'),
+    Column('corrected_count', Integer, nullable=False, server_default='0'),
+)
+
+_token_usage_daily_v6 = Table(
+    'token_usage_daily', _v,
+    Column('user_id', Integer, primary_key=True),
+    Column('endpoint', String(64), primary_key=True),
+    Column('day', Date, primary_key=True),
+    Column('calls', Integer, nullable=False, server_default='0'),
+    Column('prompt_tokens', BigInteger, nullable=False, server_default='0'),
+    Column('response_tokens', BigInteger, nullable=False, server_default='0'),
+)
+
+_audio_blob_v7 = Table(
+    'audio_blob', _v,
+    Column('sha256', String(64), primary_key=True),
+    Column('user_id', Integer, ForeignKey('user.id'), nullable=False),
+    Column('size_bytes', BigInteger, nullable=False),
+    Column('created_at', DateTime, nullable=False),
+    Index('ix_audio_blob_user_id', 'user_id'),
+)
+
+_user_vocab_v8 = Table(
+    'user_vocab', _v,
+    Column('user_id', Integer, ForeignKey('user.id'), primary_key=True),
+    Column('language', String(10), primary_key=True),
+    Column('word', String(64), primary_key=True),
+    Column('uses', Integer, nullable=False, server_default='0'),
+    Column('corrected', Integer, nullable=False, server_default='0'),
+    Column('first_seen', Date, nullable=False),
+    Index('ix_user_vocab_top', 'user_id', 'language', 'uses'),
+)
+
+# Arbitrary constant for pg_advisory_lock so that concurrent `migrate` runs serialize
+_PG_LOCK_KEY = 0x5D1A7
+
+
+@dataclass(frozen=True)
+class Migration:
+    version: int
+    description: str
+    apply: Callable[[Connection], None]
+
+
+def _has_column(conn: Connection, table: str, column: str) -> bool:
+    return column in [c['name'] for c in inspect(conn).get_columns(table)]
+
+
+def _is_postgres(conn: Connection) -> bool:
+    return conn.dialect.name in ['postgresql', 'postgres']
+
+
+def _write_rows(conn: Connection, table: Table, key: List[str], rows: List[dict], existing, columns: List[str]):
+    # INSERT для новых ключей, UPDATE columns для уже существующих (existing — множество/словарь кортежей ключа)
+    fresh = [r for r in rows if tuple(r[k] for k in key) not in existing]
+    known = [r for r in rows if tuple(r[k] for k in key) in existing]
+    if fresh:
+        conn.execute(table.insert(), fresh)
+    if known:
+        stmt = table.update().where(*(table.c[k] == bindparam(f'k_{k}') for k in key)).values(
+            {c: bindparam(f'v_{c}') for c in columns})
+        conn.execute(stmt, [dict({f'k_{k}': r[k] for k in key}, **{f'v_{c}': r[c] for c in columns}) for r in known])
+
+
+# --- Migrations ---
+
+def _m0001_baseline(conn: Connection):
+    # Create tables if needed; guard against rare pg composite type name clashes
+    try:
+        with conn.begin_nested():
+            Base.metadata.create_all(bind=conn, tables=[User.__table__, Entry.__table__])
+    except sa_exc.IntegrityError as e:
+        msg = str(e.orig) if hasattr(e, 'orig') else str(e)
+        if 'pg_type_typname_nsp_index' in msg:
+            print('[DB] WARNING: Skipping create_all due to existing composite type name clash; schema likely present')
+        else:
+            raise
+
+
+def _m0002_entry_user_id(conn: Connection):
+    # Databases created before multi-user support lack entry.user_id
+    if not _has_column(conn, 'entry', 'user_id'):
+        conn.execute(text('ALTER TABLE entry ADD COLUMN user_id INTEGER'))
+        print('[DB] Added column entry.user_id')
+
+
+def _m0003_telegram_id_bigint(conn: Connection):
+    # Ensure user.telegram_id uses BIGINT in PostgreSQL to fit large Telegram IDs
+    if not _is_postgres(conn):
+        return
+    tele_col = next((c for c in inspect(conn).get_columns('user') if c.get('name') == 'telegram_id'), None)
+    if tele_col and 'bigint' not in str(tele_col.get('type')).lower():
+        conn.execute(text('ALTER TABLE "user" ALTER COLUMN telegram_id TYPE BIGINT USING telegram_id::bigint'))
+        print('[DB] Migrated user.telegram_id to BIGINT')
+
+
+def _m0004_entry_sync_columns(conn: Connection):
+    # updated_at / soft delete / change sequence for incremental sync
+    for column, ddl in [
+        ('updated_at', 'ALTER TABLE entry ADD COLUMN updated_at TIMESTAMP'),
+        ('deleted_at', 'ALTER TABLE entry ADD COLUMN deleted_at TIMESTAMP'),
+        ('change_seq', 'ALTER TABLE entry ADD COLUMN change_seq BIGINT'),
+    ]:
+        if not _has_column(conn, 'entry', column):
+            conn.execute(text(ddl))
+    for column in ['change_seq', 'sync_floor']:
+        if not _has_column(conn, 'user', column):
+            conn.execute(text(f'ALTER TABLE "user" ADD COLUMN {column} BIGINT NOT NULL DEFAULT 0'))
+    # Existing rows: id is monotonic, so it is a valid initial change number
+    conn.execute(text('UPDATE entry SET change_seq = id WHERE change_seq IS NULL'))
+    conn.execute(text('UPDATE entry SET updated_at = timestamp WHERE updated_at IS NULL'))
+    conn.execute(text(
+        'UPDATE "user" SET change_seq = COALESCE((SELECT MAX(e.change_seq) FROM entry e WHERE e.user_id = "user".id), 0)'
+    ))
+    if 'ix_entry_user_change_seq' not in [i['name'] for i in inspect(conn).get_indexes('entry')]:
+        conn.execute(text('CREATE INDEX ix_entry_user_change_seq ON entry (user_id, change_seq)'))
+
+
+def _m0005_user_stats_daily(conn: Connection):
+    # Per-day learning stats rollups, backfilled from existing entries (same result as stats.rebuild at version 5)
+    t, e = _user_stats_daily_v5, _entry_v4
+    key = ['user_id', 'language', 'day']
+    t.create(bind=conn, checkfirst=True)
+    existing = {tuple(r) for r in conn.execute(select(t.c.user_id, t.c.language, t.c.day))}
+    conn.execute(t.update().values(entries_count=0, speaking_seconds=0.0))
+    day_col = func.date(e.c.timestamp)
+    totals: Dict[tuple, list] = defaultdict(lambda: [0, 0.0])
+    for uid, language, day, count, seconds in conn.execute(
+        select(e.c.user_id, e.c.language, day_col, func.count(e.c.id), func.coalesce(func.sum(e.c.audio_duration), 0.0))
+        .where(e.c.user_id.is_not(None), e.c.deleted_at.is_(None))
+        .group_by(e.c.user_id, e.c.language, day_col)
+    ):
+        if day is None:
+            continue
+        day = day if isinstance(day, date) else date.fromisoformat(str(day)[:10])
+        acc = totals[(uid, (language or 'unknown')[:10], day)]
+        acc[0] += int(count)
+        acc[1] += float(seconds or 0.0)
+    rows = [
+        {'user_id': uid, 'language': language, 'day': day, 'entries_count': count, 'speaking_seconds': seconds,
+         'reviews_count': 0, 'corrected_count': 0}
+        for (uid, language, day), (count, seconds) in totals.items()
+    ]
+    _write_rows(conn, t, key, rows, existing, ['entries_count', 'speaking_seconds'])
+    print(f'[DB] Backfilled {len(rows)} user_stats_daily rows')
+
+
+def _m0006_token_usage_daily(conn: Connection):
+    _token_usage_daily_v6.create(bind=conn, checkfirst=True)
+
+
+def _m0007_audio_blobs(conn: Connection):
+    # Stored voice recordings (services/audio_store.py) and their link to entries
+    _audio_blob_v7.create(bind=conn, checkfirst=True)
+    if not _has_column(conn, 'entry', 'audio_sha256'):
+        conn.execute(text('ALTER TABLE entry ADD COLUMN audio_sha256 VARCHAR(64)'))
+    if 'ix_entry_audio_sha256' not in [i['name'] for i in inspect(conn).get_indexes('entry')]:
+        conn.execute(text('CREATE INDEX ix_entry_audio_sha256 ON entry (audio_sha256)'))
+
+
+def _m0008_user_vocab(conn: Connection):
+    # Per-user vocabulary index, backfilled from existing entries (same result as vocabulary.rebuild at version 8).
+    # Only the tokenizer is shared with live code: it works on plain text, not on the schema.
+    from services.vocabulary import words
+
+    t, e = _user_vocab_v8, _entry_v4
+    key = ['user_id', 'language', 'word']
+    t.create(bind=conn, checkfirst=True)
+    conn.execute(t.update().values(uses=0))
+    n = 0
+    current, deltas = None, {}
+
+    def _flush():
+        nonlocal n
+        if current is None:
+            return
+        # Существующие строки (повторный запуск): corrected сохраняется, first_seen — самая ранняя дата
+        existing = {(current, r.language, r.word): r.first_seen for r in conn.execute(
+            select(t.c.language, t.c.word, t.c.first_seen).where(t.c.user_id == current))}
+        rows = []
+        for (language, word), (uses, first_seen) in deltas.items():
+            old = existing.get((current, language, word))
+            rows.append({'user_id': current, 'language': language, 'word': word, 'uses': uses, 'corrected': 0,
+                         'first_seen': min(old, first_seen) if old else first_seen})
+        _write_rows(conn, t, key, rows, existing, ['uses', 'first_seen'])
+        n += len(rows)
+        deltas.clear()
+
+    # Записи упорядочены по пользователю: в памяти — словарь только одного пользователя
+    query = select(e.c.user_id, e.c.language, e.c.text, e.c.timestamp).where(
+        e.c.user_id.is_not(None), e.c.deleted_at.is_(None)).order_by(e.c.user_id)
+    for uid, language, entry_text, ts in conn.execute(query.execution_options(yield_per=1000)):
+        if uid != current:
+            _flush()
+            current = uid
+        language = (language or 'unknown').split('-')[0].strip().lower()[:10] or 'unknown'
+        day = ts.date() if isinstance(ts, datetime) else datetime.utcnow().date()
+        for word, count in words(entry_text).items():
+            d = deltas.setdefault((language, word), [0, day])
+            d[0] += count
+            d[1] = min(d[1], day)
+    _flush()
+    conn.execute(t.delete().where(t.c.uses <= 0, t.c.corrected <= 0))
+    print(f'[DB] Backfilled {n} user_vocab rows')
+
+
+MIGRATIONS: List[Migration] = [
+    Migration(1, 'baseline: user and entry tables', _m0001_baseline),
+    Migration(2, 'entry.user_id column', _m0002_entry_user_id),
+    Migration(3, 'user.telegram_id as BIGINT', _m0003_telegram_id_bigint),
+    Migration(4, 'entry sync columns: updated_at, deleted_at, change_seq', _m0004_entry_sync_columns),
+    Migration(5, 'user_stats_daily rollups', _m0005_user_stats_daily),
+    Migration(6, 'token_usage_daily accounting', _m0006_token_usage_daily),
+    Migration(7, 'audio_blob store and entry.audio_sha256', _m0007_audio_blobs),
+    Migration(8, 'user_vocab vocabulary index', _m0008_user_vocab),
+]
+
+LATEST_VERSION = MIGRATIONS[-1].version
+
+
+def current_version(engine: Engine) -> int:
+    """Return the highest applied version, 0 for an unversioned database."""
+    try:
+        with engine.connect() as conn:
+            return conn.execute(select(func.max(schema_version.c.version))).scalar() or 0
+    except sa_exc.DBAPIError:
+        return 0
+
+
+def schema_is_current(engine: Engine) -> bool:
+    return current_version(engine) >= LATEST_VERSION
+
+
+def migrate(engine: Engine, target: Optional[int] = None) -> List[int]:
+    """Apply pending migrations up to ``target`` (default: latest). Returns applied versions."""
+    target = LATEST_VERSION if target is None else target
+    applied: List[int] = []
+    with engine.connect() as lock_conn:
+        if _is_postgres(lock_conn):
+            lock_conn.execute(text('SELECT pg_advisory_lock(:k)'), {'k': _PG_LOCK_KEY})
+            lock_conn.commit()
+        try:
+            _meta.create_all(bind=engine)
+            done = current_version(engine)
+            for m in MIGRATIONS:
+                if m.version <= done or m.version > target:
+                    continue
+                with engine.begin() as conn:
+                    m.apply(conn)
+                    conn.execute(schema_version.insert().values(
+                        version=m.version, description=m.description, applied_at=datetime.utcnow()
+                    ))
+                print(f'[DB] Applied migration {m.version:04d}: {m.description}')
+                applied.append(m.version)
+        finally:
+            if _is_postgres(lock_conn):
+                lock_conn.execute(text('SELECT pg_advisory_unlock(:k)'), {'k': _PG_LOCK_KEY})
+                lock_conn.commit()
+    return applied
@@ -0,0 +1,275 @@
+"""
+Review, translation and TTS steps shared by the sync (``app.py``) and async
+(``asgi.py``) serving modes.
+
+Each step is a generator of provider operations. It yields an operation, gets
+back the result, or gets the provider's exception thrown at the ``yield``, and
+returns the final value. All provider-independent logic lives here and is
+written once:
+
+- the ``GEMINI_MODEL_CANDIDATES`` loop, prompts and reply parsing;
+- the review fallback;
+- chunk split and merge (``services/prompts.py``);
+- iteration over the TTS plan with per-voice fallback.
+
+The two modes differ only in transport:
+
+- ``run(steps, perform)``: ``perform(op)`` blocks (``gateway.call``).
+  ``Parallel`` runs in ``prompts.map_chunks`` threads.
+- ``arun(steps, aperform)``: ``aperform(op)`` is awaited (``gateway.acall``).
+  ``Parallel`` runs in ``asyncio.gather`` with at most ``PROMPT_CHUNK_WORKERS``
+  at a time.
+
+Operations:
+
+- ``Generate(model, prompt, on_partial)``: one Gemini ``generate_content``,
+  streamed when ``on_partial`` is set;
+- ``Synthesize(provider, target, text)``: one TTS attempt (local_tts voice,
+  edge_tts voice or gtts language), returns audio bytes;
+- ``Parallel(chunks, make_steps)``: ``make_steps(text)`` for each chunk,
+  concurrently; the result is the list of their results in order.
+"""
+import asyncio
+import base64
+import json
+from typing import Callable, Generator, List, NamedTuple, Optional, Sequence
+
+from services import gateway, logs, prompts, providers
+
+log_review = logs.get_logger('review')
+log_translate = logs.get_logger('translate')
+log_tts = logs.get_logger('tts')
+
+GEMINI_MODEL_CANDIDATES = ['gemini-1.5-pro-latest', 'gemini-1.5-pro', 'gemini-2.5-flash-latest', 'gemini-2.5-flash']
+
+REVIEW_UNAVAILABLE = 'Проверка недоступна: отсутствует ключ Gemini или библиотека.'
+REVIEW_FAILED = 'Не удалось выполнить проверку, используем исходный текст.'
+
+
+class Generate(NamedTuple):
+    model: object
+    prompt: str
+    on_partial: Optional[Callable[[str], None]] = None
+
+
+class Synthesize(NamedTuple):
+    provider: str
+    target: str
+    text: str
+
+
+class Parallel(NamedTuple):
+    chunks: Sequence[prompts.Chunk]
+    make_steps: Callable[[str], Generator]
+
+
+# --- Drivers ---
+
+def run(steps: Generator, perform: Callable):
+    """Выполнить шаги синхронно: perform(op) — блокирующий вызов провайдера."""
+    result, error = None, None
+    while True:
+        try:
+            op = steps.throw(error) if error is not None else steps.send(result)
+        except StopIteration as stop:
+            return stop.value
+        result, error = None, None
+        try:
+            if isinstance(op, Parallel):
+                result = prompts.map_chunks(lambda text: run(op.make_steps(text), perform), op.chunks)
+            else:
+                result = perform(op)
+        except Exception as e:
+            error = e
+
+
+async def arun(steps: Generator, aperform: Callable):
+    """Выполнить шаги в цикле событий: aperform(op) — корутина вызова провайдера."""
+    result, error = None, None
+    while True:
+        try:
+            op = steps.throw(error) if error is not None else steps.send(result)
+        except StopIteration as stop:
+            return stop.value
+        result, error = None, None
+        try:
+            if isinstance(op, Parallel):
+                result = await _agather(op, aperform)
+            else:
+                result = await aperform(op)
+        except Exception as e:
+            error = e
+
+
+async def _agather(op: Parallel, aperform: Callable) -> List:
+    # Не больше PROMPT_CHUNK_WORKERS фрагментов одновременно, как prompts.map_chunks в синхронном режиме
+    sem = asyncio.Semaphore(max(1, prompts.PROMPT_CHUNK_WORKERS))
+
+    async def _one(text):
+        async with sem:
+            return await arun(op.make_steps(text), aperform)
+    return await asyncio.gather(*(_one(text) for text, _ in op.chunks))
+
+
+# --- Review ---
+
+def build_review_prompt(text: str, language: str, ui_language: str = 'ru'):
+    lang_label = language or 'auto'
+    ui_label = (ui_language or 'ru').lower()
+    return (
+        "Ты опытный преподаватель иностранного языка. Проверь фразу на грамматическую и смысловую корректность, сохраняя исходный смысл. "
+        "Если нужны исправления — предоставь исправленный вариант. Ответь строго одним JSON-объектом без Markdown и без пояснений вне JSON. "
+        "Используй ключи: corrected_text (string), explanations (array of strings — пиши пояснения на языке интерфейса), language (string — код языка исходного текста), changed (boolean), ui_translation (string — перевод corrected_text на язык интерфейса). "
+        "Если исправлений нет, верни corrected_text равным исходному тексту и changed=false. Всегда добавляй ui_translation как перевод corrected_text. "
+        f"Язык интерфейса: {ui_label}. Язык фразы: {lang_label}. Фраза: \"\"\"{text}\"\"\""
+    )
+
+
+def review_fallback(text: str, language: str, message: str) -> dict:
+    return {
+        'corrected_text': text,
+        'explanations': [message],
+        'language': language,
+        'changed': False,
+        'ui_translation': '',
+        'fallback': True
+    }
+
+
+def parse_review_reply(resp, text: str, language: str) -> dict:
+    """Ответ Gemini (JSON, возможно в обрамлении) -> результат проверки; бросает ValueError для не-JSON."""
+    raw = (getattr(resp, 'text', '') or '').strip()
+    # Try to extract JSON
+    start = raw.find('{')
+    end = raw.rfind('}')
+    if start != -1 and end != -1:
+        raw = raw[start:end + 1]
+    data = json.loads(raw)
+    corrected = data.get('corrected_text') or text
+    explanations = data.get('explanations') or []
+    changed = data.get('changed')
+    if changed is None:
+        changed = corrected.strip() != text.strip()
+    ui_translation = data.get('ui_translation') or ''
+    return {
+        'corrected_text': corrected,
+        'explanations': explanations,
+        'language': data.get('language') or language,
+        'changed': bool(changed),
+        'ui_translation': ui_translation
+    }
+
+
+def review_steps(text: str, language: str, ui_language: str = 'ru', on_partial=None):
+    """Проверка одного фрагмента: модели GEMINI_MODEL_CANDIDATES по очереди, при неудаче всех — исходный текст."""
+    genai = providers.get_genai()
+    if genai is None:
+        return review_fallback(text, language, REVIEW_UNAVAILABLE)
+    last_err = None
+    for model_name in GEMINI_MODEL_CANDIDATES:
+        try:
+            resp = yield Generate(genai.GenerativeModel(model_name), build_review_prompt(text, language, ui_language),
+                                  on_partial)
+            return parse_review_reply(resp, text, language)
+        except gateway.ProviderUnavailable:
+            raise
+        except Exception as e:
+            last_err = e
+            log_review.warning('Gemini model error', model=model_name, error=str(e))
+    log_review.error('Gemini failed, using fallback', error=str(last_err))
+    return review_fallback(text, language, REVIEW_FAILED)
+
+
+def review_text_steps(text: str, language: str, ui_language: str = 'ru', on_partial=None):
+    """review_steps с разбиением длинного текста на фрагменты по предложениям и параллельной проверкой.
+    on_partial (потоковый вывод модели) используется только для текста из одного фрагмента."""
+    chunks = prompts.split_chunks(text, prompts.PROMPT_CHUNK_CHARS)
+    if len(chunks) == 1:
+        return (yield from review_steps(text, language, ui_language, on_partial=on_partial))
+    log_review.info('long text split into chunks', chars=len(text), chunks=len(chunks))
+    results = yield Parallel(chunks, lambda chunk: review_steps(chunk, language, ui_language))
+    return prompts.merge_reviews(chunks, results, language)
+
+
+# --- Translation ---
+
+def build_translate_prompt(text: str, from_language: str, to_language: str, fmt: str = 'text'):
+    ui_label = (to_language or 'ru').lower()
+    src_label = (from_language or 'auto').lower()
+    if fmt == 'html':
+        return (
+            "Переведи следующий HTML на указанный язык, сохраняя ВСЕ теги и их порядок без изменений. "
+            "Переводи только текстовое содержимое внутри тегов. Верни строго один результат: готовую HTML-строку без пояснений и Markdown. "
+            f"Язык исходного текста: {src_label}. Целевой язык: {ui_label}. HTML: \n" + text
+        )
+    return (
+        "Переведи следующий текст на указанный язык. Сохрани пунктуацию и форматирование. "
+        "Верни строго одну строку без пояснений и без Markdown."
+        f" Язык исходного текста: {src_label}. Целевой язык: {ui_label}. Текст: \n" + text
+    )
+
+
+def translate_steps(text: str, from_language: str, to_language: str, fmt: str = 'text'):
+    if not text:
+        return {'translated_text': ''}
+    genai = providers.get_genai()
+    if genai is None:
+        # Нет ключа/библиотеки — возвращаем ошибку, чтобы UI обработал
+        raise Exception('Translation unavailable: missing API configuration')
+    last_err = None
+    for model_name in GEMINI_MODEL_CANDIDATES:
+        try:
+            resp = yield Generate(genai.GenerativeModel(model_name),
+                                  build_translate_prompt(text, from_language, to_language, fmt))
+            # Для HTML оставляем как есть, для текста — одна строка
+            return {'translated_text': (getattr(resp, 'text', '') or '').strip()}
+        except gateway.ProviderUnavailable:
+            raise
+        except Exception as e:
+            last_err = e
+            log_translate.warning('Gemini model error', model=model_name, error=str(e))
+    log_translate.error('translation failed', error=str(last_err))
+    raise last_err or Exception('Translation failed for all candidate models')
+
+
+def translate_text_steps(text: str, from_language: str, to_language: str, fmt: str = 'text'):
+    """translate_steps с разбиением длинного текста (HTML — по <br>)."""
+    boundary = prompts.HTML_LINE_BOUNDARY_RE if fmt == 'html' else prompts.SENTENCE_BOUNDARY_RE
+    chunks = prompts.split_chunks(text, prompts.PROMPT_CHUNK_CHARS, boundary)
+    if len(chunks) == 1:
+        return (yield from translate_steps(text, from_language, to_language, fmt))
+    results = yield Parallel(chunks, lambda chunk: translate_steps(chunk, from_language, to_language, fmt))
+    return prompts.merge_translations(chunks, results)
+
+
+# --- TTS ---
+
+def audio_data_url(data: bytes) -> str:
+    b64 = base64.b64encode(data).decode('ascii')
+    return f"data:audio/mpeg;base64,{b64}"
+
+
+def tts_steps(text: str, plan, on_exhausted: Optional[Callable[[], None]] = None):
+    """Синтез по плану [(provider, target)] (app._tts_plan): первая удачная попытка даёт data URL аудио,
+    ошибка голоса — переход к следующему; ошибка gTTS (последний движок) — None."""
+    if not text:
+        return None
+    edge_tts = providers.get_edge_tts()
+    gTTS = providers.get_gtts()
+    for provider, target in plan:
+        if provider == 'edge_tts' and edge_tts is None:
+            continue
+        if provider == 'gtts' and gTTS is None:
+            log_tts.warning('gTTS library unavailable, skipping synthesis')
+            return None
+        try:
+            return audio_data_url((yield Synthesize(provider, target, text)))
+        except Exception as e:
+            if provider == 'gtts':
+                log_tts.warning('gTTS error', error=str(e))
+                return None
+            log_tts.warning('local tts voice failed' if provider == 'local_tts' else 'edge-tts voice failed',
+                            voice=target, error=str(e))
+    if on_exhausted is not None:
+        on_exhausted()
+    return None
@@ -0,0 +1,207 @@
+"""
+Opt-in sampling profiler for slow requests.
+
+A profiled request gets a background thread that samples the request
+thread's Python stack every ``PROFILE_INTERVAL_MS`` (wall clock, so time
+spent waiting on providers, the DB or the network shows up as the frame that
+waits). On completion the samples are written as collapsed stacks
+(``frame;frame;frame count`` — loadable by speedscope.app and
+``flamegraph.pl``) plus a small JSON summary.
+
+Which requests are profiled:
+
+- ``PROFILE_SAMPLE_RATE`` (default 0 = off): share of requests whose path
+  starts with one of ``PROFILE_PATHS`` (default ``/api/review,/api/transcribe``);
+- any request with a valid ``X-Profile`` header, ``<unix_ts>.<hmac>`` where
+  ``hmac = HMAC-SHA256(PROFILE_SECRET, unix_ts)`` hex, accepted for 5 minutes.
+
+Output goes to ``PROFILE_DIR``; only the newest ``PROFILE_MAX_FILES`` profiles
+are kept. ``recent()`` lists the slowest ones for the admin endpoint.
+"""
+import hashlib
+import hmac
+import json
+import os
+import random
+import sys
+import threading
+import time
+from typing import List, Optional
+
+PROFILE_SAMPLE_RATE = float(os.getenv('PROFILE_SAMPLE_RATE', '0'))
+PROFILE_PATHS = tuple(p.strip() for p in os.getenv('PROFILE_PATHS', '/api/review,/api/transcribe').split(',') if p.strip())
+PROFILE_SECRET = os.getenv('PROFILE_SECRET', '')
+PROFILE_DIR = os.getenv('PROFILE_DIR', '/tmp/diary-profiles')
+PROFILE_MAX_FILES = int(os.getenv('PROFILE_MAX_FILES', '200'))
+PROFILE_INTERVAL_MS = float(os.getenv('PROFILE_INTERVAL_MS', '5'))
+PROFILE_MAX_SECONDS = float(os.getenv('PROFILE_MAX_SECONDS', '60'))
+SIGNATURE_TTL = 300
+
+_prune_lock = threading.Lock()
+
+
+def sign(ts: Optional[int] = None, secret: Optional[str] = None) -> str:
+    """Значение заголовка X-Profile для текущего момента (для curl/скриптов)."""
+    ts = int(ts if ts is not None else time.time())
+    key = (secret if secret is not None else PROFILE_SECRET).encode('utf-8')
+    return f"{ts}.{hmac.new(key, str(ts).encode('ascii'), hashlib.sha256).hexdigest()}"
+
+
+def valid_signature(value: Optional[str], now: Optional[float] = None) -> bool:
+    if not PROFILE_SECRET or not value or '.' not in value:
+        return False
+    ts_raw, _, _ = value.partition('.')
+    try:
+        ts = int(ts_raw)
+    except ValueError:
+        return False
+    if abs((now or time.time()) - ts) > SIGNATURE_TTL:
+        return False
+    return hmac.compare_digest(value, sign(ts))
+
+
+def should_profile(path: str, header_value: Optional[str]) -> bool:
+    if header_value and valid_signature(header_value):
+        return True
+    if PROFILE_SAMPLE_RATE <= 0 or not path.startswith(PROFILE_PATHS):
+        return False
+    return random.random() < PROFILE_SAMPLE_RATE
+
+
+def _frame_label(code) -> str:
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+
+
+class Sampler:
+    """Снимает стек потока thread_id каждые interval секунд, пока не вызван stop()."""
+
+    def __init__(self, thread_id: int, interval: float = PROFILE_INTERVAL_MS / 1000.0):
+        self.thread_id = thread_id
+        self.interval = interval
+        self.stacks = {}
+        self.samples = 0
+        self.started = time.perf_counter()
+        self.duration = 0.0
+        self._stop = threading.Event()
+        self._labels = {}
+        self._thread = threading.Thread(target=self._run, name='profile-sampler', daemon=True)
+
+    def start(self) -> 'Sampler':
+        self._thread.start()
+        return self
+
+    def _run(self):
+        deadline = self.started + PROFILE_MAX_SECONDS
+        labels = self._labels
+        while not self._stop.wait(self.interval) and time.perf_counter() < deadline:
+            frame = sys._current_frames().get(self.thread_id)
+            parts = []
+            while frame is not None:
+                code = frame.f_code
+                label = labels.get(code)
+                if label is None:
+                    label = labels[code] = _frame_label(code)
+                parts.append(label)
+                frame = frame.f_back
+            if parts:
+                key = ';'.join(reversed(parts))
+                self.stacks[key] = self.stacks.get(key, 0) + 1
+                self.samples += 1
+
+    def stop(self):
+        self.duration = time.perf_counter() - self.started
+        self._stop.set()
+        self._thread.join()
+
+    def collapsed(self) -> str:
+        return ''.join(f"{stack} {count}\n" for stack, count in sorted(self.stacks.items()))
+
+
+def save(sampler: Sampler, meta: dict) -> Optional[str]:
+    """Записать профиль (.collapsed + .json) в PROFILE_DIR; возвращает имя профиля."""
+    if not sampler.samples:
+        return None
+    os.makedirs(PROFILE_DIR, exist_ok=True)
+    slug = meta.get('path', '').strip('/').replace('/', '_') or 'root'
+    name = f"{int(time.time() * 1000)}-{os.getpid()}-{slug}-{meta.get('request_id', '-')}"
+    meta = dict(meta, name=name, duration_ms=round(sampler.duration * 1000, 1), samples=sampler.samples,
+                interval_ms=round(sampler.interval * 1000, 2), created=time.time())
+    with open(os.path.join(PROFILE_DIR, name + '.collapsed'), 'w', encoding='utf-8') as f:
+        f.write(sampler.collapsed())
+    # .json пишется последним: по нему профиль считается готовым
+    with open(os.path.join(PROFILE_DIR, name + '.json'), 'w', encoding='utf-8') as f:
+        json.dump(meta, f)
+    _prune()
+    return name
+
+
+def _prune():
+    with _prune_lock:
+        try:
+            metas = sorted(f for f in os.listdir(PROFILE_DIR) if f.endswith('.json'))
+        except FileNotFoundError:
+            return
+        for old in metas[:max(0, len(metas) - PROFILE_MAX_FILES)]:
+            base = old[:-len('.json')]
+            for ext in ('.json', '.collapsed'):
+                try:
+                    os.remove(os.path.join(PROFILE_DIR, base + ext))
+                except FileNotFoundError:
+                    pass
+
+
+def recent(limit: int = 20, sort: str = 'duration') -> List[dict]:
+    """Сводки сохранённых профилей: самые медленные (sort=duration) или самые новые (sort=created)."""
+    items = []
+    try:
+        names = [f for f in os.listdir(PROFILE_DIR) if f.endswith('.json')]
+    except FileNotFoundError:
+        return []
+    for fname in names:
+        try:
+            with open(os.path.join(PROFILE_DIR, fname), encoding='utf-8') as f:
+                items.append(json.load(f))
+        except (OSError, ValueError):
+            continue
+    key = 'created' if sort == 'created' else 'duration_ms'
+    items.sort(key=lambda m: m.get(key) or 0, reverse=True)
+    return items[:limit]
+
+
+def profile_path(name: str) -> Optional[str]:
+    """Путь к .collapsed по имени профиля (без выхода за PROFILE_DIR)."""
+    if not name or os.path.basename(name) != name:
+        return None
+    path = os.path.join(PROFILE_DIR, name + '.collapsed')
+    return path if os.path.isfile(path) else None
+
+
+def init_app(app):
+    """Профилирование запросов по PROFILE_SAMPLE_RATE или подписанному X-Profile."""
+    from flask import g, request
+
+    from services import logs
+
+    @app.before_request
+    def _profile_start():
+        if should_profile(request.path, request.headers.get('X-Profile')):
+            g.profile_sampler = Sampler(threading.get_ident()).start()
+
+    @app.after_request
+    def _profile_stop(resp):
+        sampler = g.pop('profile_sampler', None)
+        if sampler is None:
+            return resp
+        sampler.stop()
+        try:
+            name = save(sampler, {
+                'request_id': logs.get_request_id(),
+                'method': request.method,
+                'path': request.path,
+                'status': resp.status_code,
+            })
+            if name:
+                resp.headers['X-Profile-Id'] = name
+        except Exception as e:
+            logs.get_logger('profile').warning('profile save error', error=str(e))
+        return resp
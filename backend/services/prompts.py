@@ -0,0 +1,212 @@
+"""
+Prompt-size control and token accounting for Gemini calls.
+
+- Input limits: ``REVIEW_MAX_CHARS`` / ``TRANSLATE_MAX_CHARS`` reject oversized
+  texts before any provider call (``InputTooLong`` -> HTTP 413).
+- Chunking: texts longer than ``PROMPT_CHUNK_CHARS`` are split on sentence
+  boundaries (``<br>`` for HTML), chunks are processed in parallel with
+  ``PROMPT_CHUNK_WORKERS`` threads and the results are merged back in order
+  (explanations are renumbered across chunks).
+- Accounting: every ``generate_content`` response adds prompt/response token
+  counts (``usage_metadata``, or a chars/4 estimate when it is missing) to a
+  per-request ``UsageLedger``; the request flushes it once into the
+  ``token_usage_daily`` rollup keyed by user, endpoint and day.
+"""
+import contextvars
+import os
+import re
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from typing import Callable, List, Optional, Sequence, Tuple
+
+from sqlalchemy import func, select
+
+from db import TokenUsageDaily
+from services.rollups import upsert_counters
+
+REVIEW_MAX_CHARS = int(os.getenv('REVIEW_MAX_CHARS', '20000'))
+TRANSLATE_MAX_CHARS = int(os.getenv('TRANSLATE_MAX_CHARS', '20000'))
+PROMPT_CHUNK_CHARS = int(os.getenv('PROMPT_CHUNK_CHARS', '2000'))
+PROMPT_CHUNK_WORKERS = int(os.getenv('PROMPT_CHUNK_WORKERS', '4'))
+
+SENTENCE_BOUNDARY_RE = re.compile(r"(?<=[.!?…;])\s+")
+HTML_LINE_BOUNDARY_RE = re.compile(r"<br\s*/?>", re.IGNORECASE)
+_WHITESPACE_RE = re.compile(r"\s+")
+_ENUM_PREFIX_RE = re.compile(r"^\s*\d+[.)]\s+")
+
+Chunk = Tuple[str, str]  # (text, separator that followed it in the source)
+
+
+class InputTooLong(ValueError):
+    def __init__(self, length: int, max_chars: int):
+        super().__init__(f'Text too long: {length} characters (max {max_chars})')
+        self.length = length
+        self.max_chars = max_chars
+
+
+def check_input(text: str, max_chars: int):
+    if max_chars > 0 and len(text or '') > max_chars:
+        raise InputTooLong(len(text), max_chars)
+
+
+# --- Chunking ---
+
+def _pieces(text: str, boundary_re) -> List[Chunk]:
+    pieces, pos = [], 0
+    for m in boundary_re.finditer(text):
+        pieces.append((text[pos:m.start()], m.group()))
+        pos = m.end()
+    pieces.append((text[pos:], ''))
+    return pieces
+
+
+def _split_long(piece: str, sep: str, max_chars: int) -> List[Chunk]:
+    # A single sentence over the limit: cut on whitespace
+    out, buf = [], ''
+    for word, ws in _pieces(piece, _WHITESPACE_RE):
+        if buf and len(buf) + len(word) > max_chars:
+            body = buf.rstrip()
+            out.append((body, buf[len(body):]))
+            buf = ''
+        buf += word + ws
+    body = buf.rstrip()
+    out.append((body, buf[len(body):] + sep))
+    return out
+
+
+def split_chunks(text: str, max_chars: int = PROMPT_CHUNK_CHARS, boundary_re=SENTENCE_BOUNDARY_RE) -> List[Chunk]:
+    """Разбить текст на фрагменты не длиннее max_chars по границам предложений.
+    ''.join(text + sep) по результату восстанавливает исходную строку."""
+    if max_chars <= 0 or len(text) <= max_chars:
+        return [(text, '')]
+    chunks: List[Chunk] = []
+    buf, buf_sep = '', ''
+    for piece, sep in _pieces(text, boundary_re):
+        if len(piece) > max_chars:
+            if buf:
+                chunks.append((buf, buf_sep))
+                buf, buf_sep = '', ''
+            chunks.extend(_split_long(piece, sep, max_chars))
+            continue
+        if buf and len(buf) + len(buf_sep) + len(piece) > max_chars:
+            chunks.append((buf, buf_sep))
+            buf, buf_sep = '', ''
+        buf = buf + buf_sep + piece if buf else piece
+        buf_sep = sep
+    if buf or not chunks:
+        chunks.append((buf, buf_sep))
+    return chunks
+
+
+def map_chunks(fn: Callable[[str], dict], chunks: Sequence[Chunk], workers: int = PROMPT_CHUNK_WORKERS) -> List[dict]:
+    """fn по каждому фрагменту параллельно; контекст вызывающего (в т.ч. Flask request/g) виден в потоках."""
+    if len(chunks) == 1:
+        return [fn(chunks[0][0])]
+    with ThreadPoolExecutor(max_workers=max(1, min(workers, len(chunks)))) as pool:
+        futures = [pool.submit(contextvars.copy_context().run, fn, text) for text, _ in chunks]
+        return [f.result() for f in futures]
+
+
+def _renumber(explanations: List[str]) -> List[str]:
+    if not any(_ENUM_PREFIX_RE.match(e or '') for e in explanations):
+        return explanations
+    return [f"{i}. {_ENUM_PREFIX_RE.sub('', e or '', count=1)}" for i, e in enumerate(explanations, start=1)]
+
+
+def merge_reviews(chunks: Sequence[Chunk], results: Sequence[dict], language: str) -> dict:
+    corrected = ''.join((r.get('corrected_text') or text) + sep for (text, sep), r in zip(chunks, results))
+    explanations: List[str] = []
+    for r in results:
+        explanations.extend(r.get('explanations') or [])
+    return {
+        'corrected_text': corrected,
+        'explanations': _renumber(explanations),
+        'language': next((r.get('language') for r in results if r.get('language')), language),
+        'changed': any(bool(r.get('changed')) for r in results),
+        'ui_translation': ' '.join(r.get('ui_translation') for r in results if r.get('ui_translation')),
+        'fallback': all(r.get('fallback') for r in results),
+    }
+
+
+def merge_translations(chunks: Sequence[Chunk], results: Sequence[dict]) -> dict:
+    return {'translated_text': ''.join((r.get('translated_text') or '') + sep for (_, sep), r in zip(chunks, results))}
+
+
+# --- Token accounting ---
+
+def estimate_tokens(text: str) -> int:
+    return max(1, len(text or '') // 4) if text else 0
+
+
+def usage_from_response(resp, prompt: str) -> Tuple[int, int]:
+    """(prompt_tokens, response_tokens) из usage_metadata ответа Gemini или оценка по длине."""
+    meta = getattr(resp, 'usage_metadata', None)
+    prompt_tokens = getattr(meta, 'prompt_token_count', None) if meta is not None else None
+    response_tokens = getattr(meta, 'candidates_token_count', None) if meta is not None else None
+    if not prompt_tokens:
+        prompt_tokens = estimate_tokens(prompt)
+    if response_tokens is None:
+        try:
+            response_tokens = estimate_tokens(getattr(resp, 'text', '') or '')
+        except Exception:
+            response_tokens = 0
+    return int(prompt_tokens), int(response_tokens)
+
+
+class UsageLedger:
+    """Накопитель расхода токенов в рамках одного запроса (потокобезопасный: чанки идут параллельно)."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.calls = 0
+        self.prompt_tokens = 0
+        self.response_tokens = 0
+
+    def add(self, prompt_tokens: int, response_tokens: int):
+        with self._lock:
+            self.calls += 1
+            self.prompt_tokens += prompt_tokens
+            self.response_tokens += response_tokens
+
+
+def record(db, user_id: Optional[int], endpoint: str, ledger: UsageLedger):
+    """Записать накопленный расход в token_usage_daily (вызывающий делает commit)."""
+    if not ledger.calls:
+        return
+    upsert_counters(
+        db, TokenUsageDaily.__table__, ['user_id', 'endpoint', 'day'],
+        {'user_id': user_id or 0, 'endpoint': endpoint[:64], 'day': datetime.utcnow().date()},
+        {'calls': ledger.calls, 'prompt_tokens': ledger.prompt_tokens, 'response_tokens': ledger.response_tokens},
+    )
+
+
+def usage_summary(db, user_id: Optional[int] = None, days: int = 30) -> dict:
+    since = datetime.utcnow().date() - timedelta(days=days - 1)
+    query = select(
+        TokenUsageDaily.endpoint,
+        func.sum(TokenUsageDaily.calls),
+        func.sum(TokenUsageDaily.prompt_tokens),
+        func.sum(TokenUsageDaily.response_tokens),
+    ).where(TokenUsageDaily.day >= since)
+    if user_id is not None:
+        query = query.where(TokenUsageDaily.user_id == user_id)
+    by_endpoint = {}
+    totals = {'calls': 0, 'prompt_tokens': 0, 'response_tokens': 0}
+    for endpoint, calls, p_tok, r_tok in db.execute(query.group_by(TokenUsageDaily.endpoint)):
+        item = {'calls': int(calls or 0), 'prompt_tokens': int(p_tok or 0), 'response_tokens': int(r_tok or 0)}
+        by_endpoint[endpoint] = item
+        for k in totals:
+            totals[k] += item[k]
+    return {'days': days, 'totals': totals, 'by_endpoint': by_endpoint}
+
+
+def top_users(db, days: int = 30, limit: int = 20) -> List[dict]:
+    since = datetime.utcnow().date() - timedelta(days=days - 1)
+    total = func.sum(TokenUsageDaily.prompt_tokens + TokenUsageDaily.response_tokens)
+    rows = db.execute(
+        select(TokenUsageDaily.user_id, func.sum(TokenUsageDaily.calls), total)
+        .where(TokenUsageDaily.day >= since)
+        .group_by(TokenUsageDaily.user_id).order_by(total.desc()).limit(limit)
+    )
+    return [{'user_id': uid, 'calls': int(calls or 0), 'tokens': int(tok or 0)} for uid, calls, tok in rows]
@@ -0,0 +1,160 @@
+"""
+Lazily initialized clients for external AI providers.
+
+Importing groq / google.generativeai / gtts / edge_tts costs hundreds of
+milliseconds, and most requests (entries CRUD, auth, health) never need them.
+Each getter imports and configures its provider on first use and caches the
+result for the lifetime of the worker process. Getters return ``None`` when
+the library or its credentials are unavailable.
+
+With ``FAKE_PROVIDERS`` set, the listed providers are replaced by the offline
+stand-ins from ``services/fake_providers.py``.
+"""
+import os
+import threading
+from functools import lru_cache
+
+from services import fake_providers, logs
+
+log_transcribe = logs.get_logger('transcribe')
+log_semantic = logs.get_logger('semantic')
+log_review = logs.get_logger('review')
+
+_genai_lock = threading.Lock()
+_whisper_lock = threading.Lock()
+_embedder_lock = threading.Lock()
+
+
+def gemini_api_key():
+    return os.getenv('GEMINI_API_KEY') or os.getenv('GOOGLE_API_KEY') or os.getenv('GENAI_API_KEY')
+
+
+@lru_cache(maxsize=None)
+def get_groq_client():
+    """Groq client; raises if the library or GROQ_API_KEY is missing (callers report the error)."""
+    if fake_providers.enabled('groq'):
+        return fake_providers.FakeGroq()
+    from groq import Groq
+    return Groq(api_key=os.getenv('GROQ_API_KEY'))
+
+
+@lru_cache(maxsize=None)
+def get_async_groq_client():
+    """AsyncGroq client for the async serving mode (asgi.py); raises like get_groq_client."""
+    if fake_providers.enabled('groq'):
+        return fake_providers.FakeAsyncGroq()
+    from groq import AsyncGroq
+    return AsyncGroq(api_key=os.getenv('GROQ_API_KEY'))
+
+
+@lru_cache(maxsize=None)
+def get_local_whisper():
+    """faster-whisper ``WhisperModel`` (CTranslate2, CPU) shared by all threads of the worker, or None.
+
+    Loading takes seconds and hundreds of MB, so the lock keeps concurrent first calls from loading it twice;
+    services/stt.py preloads it at worker start.
+    """
+    if fake_providers.enabled('local_whisper'):
+        return fake_providers.FakeWhisperModel()
+    with _whisper_lock:
+        try:
+            from faster_whisper import WhisperModel
+        except Exception as e:
+            log_transcribe.warning('local whisper unavailable', error=str(e))
+            return None
+        try:
+            return WhisperModel(
+                os.getenv('LOCAL_WHISPER_MODEL', 'small'),
+                device='cpu',
+                compute_type=os.getenv('LOCAL_WHISPER_COMPUTE_TYPE', 'int8'),
+                cpu_threads=int(os.getenv('LOCAL_WHISPER_THREADS', '0')),
+                num_workers=int(os.getenv('LOCAL_WHISPER_WORKERS', '2')),
+                download_root=os.getenv('LOCAL_WHISPER_DIR') or None,
+            )
+        except Exception as e:
+            log_transcribe.warning('local whisper model failed to load', error=str(e))
+            return None
+
+
+@lru_cache(maxsize=None)
+def get_embedder():
+    """Sentence-embedding model for semantic search (fastembed, ONNX on CPU), shared by the worker, or None."""
+    if fake_providers.enabled('embeddings'):
+        return fake_providers.FakeEmbedder()
+    with _embedder_lock:
+        from services import semantic
+        try:
+            from fastembed import TextEmbedding
+        except Exception as e:
+            log_semantic.warning('fastembed unavailable, semantic search disabled', error=str(e))
+            return None
+        try:
+            model = TextEmbedding(
+                model_name=semantic.SEMANTIC_MODEL,
+                cache_dir=os.getenv('SEMANTIC_MODEL_DIR') or None,
+                threads=int(os.getenv('SEMANTIC_THREADS', '0')) or None,
+            )
+            return semantic.FastEmbedder(model, semantic.SEMANTIC_MODEL)
+        except Exception as e:
+            log_semantic.warning('embedding model failed to load, semantic search disabled', error=str(e))
+            return None
+
+
+@lru_cache(maxsize=None)
+def get_local_tts():
+    """Local Piper TTS engine (services/local_tts.py) or None when piper-tts is not installed."""
+    if fake_providers.enabled('local_tts'):
+        return fake_providers.FakeLocalTTS()
+    try:
+        from piper.voice import PiperVoice
+    except Exception:
+        return None
+    from services.local_tts import PiperEngine
+    return PiperEngine(PiperVoice)
+
+
+@lru_cache(maxsize=None)
+def get_genai():
+    """Configured ``google.generativeai`` module or None (review falls back, translate errors)."""
+    if fake_providers.enabled('gemini'):
+        return fake_providers.FakeGenai
+    api_key = gemini_api_key()
+    if not api_key:
+        log_review.warning('Gemini API key not found, review runs in fallback mode')
+        return None
+    with _genai_lock:
+        try:
+            import google.generativeai as genai
+        except Exception as e:
+            log_review.warning('google.generativeai unavailable, review runs in fallback mode', error=str(e))
+            return None
+        try:
+            genai.configure(api_key=api_key)
+            log_review.info('Gemini configured')
+        except Exception as e:
+            log_review.warning('Gemini configure error', error=str(e))
+        return genai
+
+
+@lru_cache(maxsize=None)
+def get_gtts():
+    """``gTTS`` class or None."""
+    if fake_providers.enabled('gtts'):
+        return fake_providers.FakeGTTS
+    try:
+        from gtts import gTTS
+        return gTTS
+    except Exception:
+        return None
+
+
+@lru_cache(maxsize=None)
+def get_edge_tts():
+    """``edge_tts`` module or None."""
+    if fake_providers.enabled('edge_tts'):
+        return fake_providers.FakeEdgeTTS
+    try:
+        import edge_tts
+        return edge_tts
+    except Exception:
+        return None
@@ -0,0 +1,341 @@
+"""
+Rate limiting of the provider-bound endpoints (``/api/transcribe``, ``/api/review``, ``/api/translate``).
+
+Every such request takes tokens from up to three buckets, all or nothing:
+
+- ``user:<id>`` — the authenticated user (JWT ``sub``), ``RATE_LIMIT_USER``;
+- ``ip:<addr>`` — the client address, ``RATE_LIMIT_IP``. By default this is
+  the socket address, because any client can set forwarding headers. Behind
+  the compose nginx (``RATE_LIMIT_TRUST_PROXY=true``) it is the address the
+  proxy reports in ``RATE_LIMIT_PROXY_HEADER``. For ``X-Real-IP`` (the
+  default) that is the header nginx overwrites. For ``X-Forwarded-For`` it is
+  the hop that the nearest of ``RATE_LIMIT_PROXY_HOPS`` trusted proxies
+  appended, and the client-sent entries on the left are ignored;
+- ``provider:<name>`` — all traffic to one upstream (groq, gemini), so bots
+  cannot burn the shared API quota, ``RATE_LIMIT_GROQ`` / ``RATE_LIMIT_GEMINI``.
+
+Limits are ``<units>/<seconds>``: the bucket holds ``units`` tokens and refills
+completely in ``seconds``. The cost is weighted by the work a request causes,
+estimated from ``Content-Length`` without reading the body. Audio costs one
+unit per ``RATE_LIMIT_AUDIO_SECONDS_PER_UNIT`` seconds, at
+``RATE_LIMIT_AUDIO_BYTES_PER_SECOND``. Text costs one unit per
+``RATE_LIMIT_TEXT_CHARS_PER_UNIT`` characters. Every request costs at least
+one unit.
+
+Buckets use GCRA: one number per key, the time at which the bucket will be full
+again. The state lives in a SQLite file shared by the gunicorn workers
+(``RATE_LIMIT_DB``, WAL mode; a check is one ``BEGIN IMMEDIATE`` transaction).
+With ``SHARED_STATE_URL`` it lives in the shared key-value store, so the
+limits hold across all nodes (``RATE_LIMIT_STORE=shared``). With
+``RATE_LIMIT_STORE=memory`` it lives in process memory. The check runs in a
+``before_request`` hook before authentication, database access and body
+parsing. A limited request gets a small 429 with ``Retry-After``. All checked
+responses carry ``RateLimit-Limit``, ``RateLimit-Remaining``,
+``RateLimit-Reset`` and ``RateLimit-Policy`` for the tightest bucket.
+"""
+import math
+import os
+import random
+import sqlite3
+import tempfile
+import threading
+import time
+from functools import lru_cache
+from typing import Callable, Dict, List, Optional, Tuple
+
+from services import logs, shared_state
+
+RATE_LIMIT = os.getenv('RATE_LIMIT', 'true').strip().lower() in ('1', 'true', 'yes', 'on')
+# shared — services/shared_state.py (по умолчанию, если задан SHARED_STATE_URL), sqlite — файл на хосте, memory — процесс
+RATE_LIMIT_STORE = os.getenv('RATE_LIMIT_STORE', 'shared' if shared_state.networked() else 'sqlite').strip().lower()
+RATE_LIMIT_DB = os.getenv('RATE_LIMIT_DB', os.path.join(tempfile.gettempdir(), 'diary-ratelimit.sqlite'))
+RATE_LIMIT_TRUST_PROXY = os.getenv('RATE_LIMIT_TRUST_PROXY', 'false').strip().lower() in ('1', 'true', 'yes', 'on')
+RATE_LIMIT_PROXY_HEADER = os.getenv('RATE_LIMIT_PROXY_HEADER', 'X-Real-IP').strip()
+RATE_LIMIT_PROXY_HOPS = max(1, int(os.getenv('RATE_LIMIT_PROXY_HOPS', '1')))
+RATE_LIMIT_AUDIO_BYTES_PER_SECOND = float(os.getenv('RATE_LIMIT_AUDIO_BYTES_PER_SECOND', '4000'))
+RATE_LIMIT_AUDIO_SECONDS_PER_UNIT = float(os.getenv('RATE_LIMIT_AUDIO_SECONDS_PER_UNIT', '15'))
+RATE_LIMIT_TEXT_CHARS_PER_UNIT = float(os.getenv('RATE_LIMIT_TEXT_CHARS_PER_UNIT', '1000'))
+
+# Лимиты по умолчанию: <units>/<seconds>; переопределяются RATE_LIMIT_<SCOPE>
+_DEFAULTS = {
+    'user': '40/60',
+    'ip': '120/60',
+    'groq': '300/60',
+    'gemini': '300/60',
+}
+
+# Путь -> (провайдер, вид стоимости)
+ENDPOINTS = {
+    '/api/transcribe': ('groq', 'audio'),
+    '/api/review': ('gemini', 'text'),
+    '/api/review/stream': ('gemini', 'text'),
+    '/api/translate': ('gemini', 'text'),
+}
+
+HEADERS = ['RateLimit-Limit', 'RateLimit-Remaining', 'RateLimit-Reset', 'RateLimit-Policy']
+TOO_MANY_BODY = b'{"error":"Too many requests","status":429}\n'
+
+log = logs.get_logger('ratelimit')
+
+
+class Limit:
+    """Bucket of `units` tokens that refills completely in `seconds` (GCRA)."""
+
+    __slots__ = ('units', 'seconds', 'interval', 'tolerance')
+
+    def __init__(self, units: float, seconds: float):
+        self.units = units
+        self.seconds = seconds
+        self.interval = seconds / units  # время восстановления одного токена
+        self.tolerance = seconds
+
+    @classmethod
+    def parse(cls, spec: str) -> Optional['Limit']:
+        units, _, seconds = (spec or '').partition('/')
+        try:
+            units, seconds = float(units), float(seconds or 1)
+        except ValueError:
+            return None
+        return cls(units, seconds) if units > 0 and seconds > 0 else None
+
+    @property
+    def policy(self) -> str:
+        return f'{self.units:g};w={self.seconds:g}'
+
+
+@lru_cache(maxsize=None)
+def limit_for(scope: str) -> Optional[Limit]:
+    """Limit of a bucket scope; '0' or 'off' in RATE_LIMIT_<SCOPE> turns it off."""
+    return Limit.parse(os.getenv(f'RATE_LIMIT_{scope.upper()}', _DEFAULTS.get(scope, '')))
+
+
+# --- State stores ---
+
+class MemoryStore:
+    """Buckets of this process only (one worker, tests)."""
+
+    def __init__(self):
+        self._tats: Dict[str, float] = {}
+        self._lock = threading.Lock()
+
+    def update(self, keys: List[str], fn: Callable[[Dict[str, float]], Optional[Dict[str, float]]]):
+        with self._lock:
+            new = fn({k: self._tats[k] for k in keys if k in self._tats})
+            if new:
+                self._tats.update(new)
+                if len(self._tats) > 100000:
+                    now = time.time()
+                    self._tats = {k: v for k, v in self._tats.items() if v > now}
+
+
+class SQLiteStore:
+    """Buckets in a SQLite file shared by the workers of one host."""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._local = threading.local()
+
+    def _conn(self) -> sqlite3.Connection:
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=5, isolation_level=None, check_same_thread=False)
+            # Состояние эфемерно: fsync не нужен, потеря при сбое питания лишь обнуляет лимиты
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=OFF')
+            conn.execute('CREATE TABLE IF NOT EXISTS bucket (key TEXT PRIMARY KEY, tat REAL NOT NULL) WITHOUT ROWID')
+            self._local.conn = conn
+        return conn
+
+    def update(self, keys: List[str], fn: Callable[[Dict[str, float]], Optional[Dict[str, float]]]):
+        conn = self._conn()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            marks = ','.join('?' * len(keys))
+            new = fn(dict(conn.execute(f'SELECT key, tat FROM bucket WHERE key IN ({marks})', keys).fetchall()))
+            if new:
+                conn.executemany('INSERT INTO bucket (key, tat) VALUES (?, ?) '
+                                 'ON CONFLICT(key) DO UPDATE SET tat = excluded.tat', list(new.items()))
+                if random.random() < 0.001:
+                    # Полные корзины неотличимы от отсутствующих
+                    conn.execute('DELETE FROM bucket WHERE tat < ?', (time.time(),))
+            conn.execute('COMMIT')
+        except Exception:
+            conn.execute('ROLLBACK')
+            raise
+
+
+class SharedStore:
+    """Buckets in services/shared_state.py: one limit for all nodes behind a load balancer."""
+
+    def __init__(self, state):
+        self.state = state
+
+    def update(self, keys: List[str], fn: Callable[[Dict[str, float]], Optional[Dict[str, float]]]):
+        def _apply(current: Dict[str, bytes]):
+            new = fn({k: float(v) for k, v in current.items()})
+            if not new:
+                return None
+            now = time.time()
+            # Ключ живёт, пока корзина не наполнилась снова
+            return {f'rl:{k}': (repr(tat).encode(), max(tat - now, 1.0)) for k, tat in new.items()}
+
+        prefixed = {f'rl:{k}': k for k in keys}
+        self.state.update(list(prefixed), lambda current: _apply({prefixed[k]: v for k, v in current.items()}))
+
+
+_store = None
+_store_lock = threading.Lock()
+
+
+def get_store():
+    global _store
+    if _store is None:
+        with _store_lock:
+            if _store is None:
+                if RATE_LIMIT_STORE == 'shared':
+                    _store = SharedStore(shared_state.get_state())
+                elif RATE_LIMIT_STORE == 'memory':
+                    _store = MemoryStore()
+                else:
+                    _store = SQLiteStore(RATE_LIMIT_DB)
+    return _store
+
+
+# --- Checks ---
+
+class Decision:
+    __slots__ = ('allowed', 'scope', 'limit', 'remaining', 'reset', 'retry_after')
+
+    def __init__(self, allowed: bool, scope: str, limit: Limit, remaining: int, reset: float, retry_after: float):
+        self.allowed = allowed
+        self.scope = scope
+        self.limit = limit
+        self.remaining = remaining
+        self.reset = reset
+        self.retry_after = retry_after
+
+    def headers(self) -> Dict[str, str]:
+        headers = {
+            'RateLimit-Limit': f'{self.limit.units:g}',
+            'RateLimit-Remaining': str(self.remaining),
+            'RateLimit-Reset': str(math.ceil(self.reset)),
+            'RateLimit-Policy': self.limit.policy,
+        }
+        if not self.allowed:
+            headers['Retry-After'] = str(max(1, math.ceil(self.retry_after)))
+        return headers
+
+
+def cost(kind: str, content_length: Optional[int]) -> float:
+    size = float(content_length or 0)
+    if kind == 'audio':
+        units = size / RATE_LIMIT_AUDIO_BYTES_PER_SECOND / RATE_LIMIT_AUDIO_SECONDS_PER_UNIT
+    else:
+        units = size / RATE_LIMIT_TEXT_CHARS_PER_UNIT
+    return max(1.0, units)
+
+
+def client_ip(headers, remote_addr: Optional[str]) -> str:
+    """Адрес клиента для корзины ip:. Заголовки читаются только за доверенным прокси и только тот,
+    который прокси перезаписывает: иначе клиент получал бы новую корзину на каждый запрос."""
+    if RATE_LIMIT_TRUST_PROXY:
+        value = headers.get(RATE_LIMIT_PROXY_HEADER) or ''
+        if RATE_LIMIT_PROXY_HEADER.lower() == 'x-forwarded-for':
+            # Прокси дописывают адрес справа; всё левее адреса, добавленного ближайшим доверенным, прислал клиент
+            hops = [h.strip() for h in value.split(',') if h.strip()]
+            value = hops[-min(RATE_LIMIT_PROXY_HOPS, len(hops))] if hops else ''
+        if value.strip():
+            return value.strip()
+    return remote_addr or 'unknown'
+
+
+def take(buckets: List[Tuple[str, str, Limit]], units: float, now: Optional[float] = None) -> Optional[Decision]:
+    """Take `units` from every bucket (scope, key, limit) or from none; Decision of the tightest bucket."""
+    if not buckets:
+        return None
+    now = time.time() if now is None else now
+    result = {}
+
+    def _apply(tats: Dict[str, float]) -> Optional[Dict[str, float]]:
+        new, tightest, denied = {}, None, None
+        for scope, key, limit in buckets:
+            # Стоимость больше ёмкости корзины никогда бы не прошла: такой запрос просто опустошает её
+            need = min(units, limit.units) * limit.interval
+            tat = max(tats.get(key, now), now) + need
+            allow_at = tat - limit.tolerance
+            if allow_at > now:
+                if denied is None or allow_at - now > denied[1]:
+                    denied = (scope, allow_at - now, limit, tats.get(key, now))
+                continue
+            new[key] = tat
+            remaining = int((limit.tolerance - (tat - now)) / limit.interval)
+            if tightest is None or remaining < tightest.remaining:
+                tightest = Decision(True, scope, limit, remaining, tat - now, 0.0)
+        if denied is not None:
+            scope, retry, limit, tat = denied
+            result['decision'] = Decision(False, scope, limit, 0, max(tat, now) - now, retry)
+            return None
+        result['decision'] = tightest
+        return new
+
+    get_store().update([key for _, key, _ in buckets], _apply)
+    return result['decision']
+
+
+def check(path: str, method: str, content_length: Optional[int], user_id: Optional[int],
+          ip: str) -> Optional[Decision]:
+    """Decision for a request, or None when the path is not limited (or limiting is off, or the store failed)."""
+    if not RATE_LIMIT or method != 'POST':
+        return None
+    endpoint = ENDPOINTS.get(path)
+    if endpoint is None:
+        return None
+    provider, kind = endpoint
+    buckets = []
+    for scope, key in (('user', f'user:{user_id}' if user_id else None), ('ip', f'ip:{ip}'),
+                       (provider, f'provider:{provider}')):
+        limit = limit_for(scope) if key else None
+        if limit is not None:
+            buckets.append((scope, key, limit))
+    try:
+        decision = take(buckets, cost(kind, content_length))
+    except Exception as e:
+        # Сбой хранилища не должен ронять запросы: пропускаем без лимита
+        log.warning('rate limit store error', error=str(e))
+        return None
+    if decision is not None and not decision.allowed:
+        log.info('rate limited', scope=decision.scope, path=path, user_id=user_id, ip=ip,
+                 retry_after=round(decision.retry_after, 2))
+    return decision
+
+
+def check_request(req, user_id: Optional[int]) -> Optional[Decision]:
+    """check() для запроса Flask или Quart (оба режима сервера)."""
+    return check(req.path, req.method, req.content_length, user_id, client_ip(req.headers, req.remote_addr))
+
+
+def rejection(response_class, decision: Optional[Decision]):
+    """Ответ 429, если запрос не прошёл лимит; иначе None."""
+    if decision is not None and not decision.allowed:
+        return response_class(TOO_MANY_BODY, status=429, mimetype='application/json', headers=decision.headers())
+    return None
+
+
+def add_headers(resp, decision: Optional[Decision]):
+    if decision is not None and decision.allowed:
+        resp.headers.update(decision.headers())
+    return resp
+
+
+def init_app(app, identify: Callable):
+    """Check limits in before_request; identify(request) -> user id or None (JWT only, no database)."""
+    from flask import g, request
+
+    @app.before_request
+    def _rate_limit():
+        g.rate_limit = check_request(request, identify(request))
+        return rejection(app.response_class, g.rate_limit)
+
+    @app.after_request
+    def _rate_limit_headers(resp):
+        return add_headers(resp, g.get('rate_limit'))
@@ -0,0 +1,105 @@
+"""
+Read-replica routing for Flask requests (``DATABASE_REPLICA_URL``, see ``db.py``).
+
+- GET/HEAD requests are read-only: their ``SessionLocal()`` sessions read from
+  the replica while it is healthy. Flushes, INSERT/UPDATE/DELETE and every
+  other method go to the primary.
+- Read-your-writes: after a successful write the client reads from the primary
+  for ``DATABASE_STICKY_SECONDS``. The window is kept in the ``db_sticky``
+  cookie, which the frontend already sends with credentials, and in the
+  ``X-DB-Sticky`` response header, which API clients may echo back. It is also
+  stored under the user's key in ``services/shared_state.py``, so that it holds
+  for clients without cookies on every worker and node.
+- When the replica lags more than ``DATABASE_REPLICA_MAX_LAG_SECONDS`` or fails,
+  ``db.RoutingSession`` reads from the primary; see ``db.replica_health``.
+
+Without ``DATABASE_REPLICA_URL`` the hooks are not registered.
+"""
+import math
+import os
+import time
+from typing import Callable, Optional
+
+import db
+from services import shared_state
+
+DATABASE_STICKY_SECONDS = float(os.getenv('DATABASE_STICKY_SECONDS', '5'))
+COOKIE = 'db_sticky'
+HEADER = 'X-DB-Sticky'
+HEADERS = [HEADER]
+_SAFE_METHODS = ('GET', 'HEAD', 'OPTIONS')
+
+
+def _sticky_key(user_id: int) -> str:
+    return f"db:sticky:{user_id}"
+
+
+def _until(raw: Optional[str]) -> float:
+    try:
+        return float(raw or 0)
+    except ValueError:
+        return 0.0
+
+
+def sticky(cookies, headers, user_id: Optional[int]) -> bool:
+    """Клиент недавно писал: читаем с основной БД, чтобы он увидел свою запись."""
+    now = time.time()
+    if max(_until(cookies.get(COOKIE)), _until(headers.get(HEADER))) > now:
+        return True
+    if user_id is not None:
+        try:
+            return _until((shared_state.get_state().get(_sticky_key(user_id)) or b'').decode()) > now
+        except Exception:
+            return True
+    return False
+
+
+def remember_write(user_id: Optional[int]) -> str:
+    """Окно чтения с основной БД для пользователя (общее состояние); возвращает его конец для cookie/заголовка.
+    Для записей, сделанных после отправки заголовков ответа (SSE), вызывается отдельно."""
+    value = f"{time.time() + DATABASE_STICKY_SECONDS:.3f}"
+    if user_id is not None and db.replica_engine is not None:
+        try:
+            shared_state.get_state().set(_sticky_key(user_id), value, ttl=DATABASE_STICKY_SECONDS)
+        except Exception:
+            pass  # cookie/заголовок всё равно защищают этого клиента
+    return value
+
+
+def mark_write(resp, user_id: Optional[int]):
+    value = remember_write(user_id)
+    secure = (os.getenv('ENV', '').lower() in ['prod', 'production']) or (os.getenv('ENABLE_SECURE_COOKIE', 'false').lower() == 'true')
+    resp.set_cookie(COOKIE, value, httponly=True, secure=secure, samesite='None' if secure else 'Lax',
+                    max_age=max(1, math.ceil(DATABASE_STICKY_SECONDS)))
+    resp.headers[HEADER] = value
+
+
+def after_response(method: str, resp, user_id: Optional[int]):
+    """Успешный запрос-запись (не GET/HEAD/OPTIONS): клиент читает с основной БД; для Flask и Quart."""
+    if db.replica_engine is not None and method not in _SAFE_METHODS and resp.status_code < 400:
+        mark_write(resp, user_id)
+    return resp
+
+
+def init_app(app, identify: Callable):
+    """Mark read-only requests and record writes; identify(request) -> user id or None (JWT only, no database)."""
+    if db.replica_engine is None:
+        return
+    from flask import g, request
+
+    @app.before_request
+    def _route_reads():
+        if request.method not in ('GET', 'HEAD'):
+            return None
+        g.db_replica_token = db.use_replica(not sticky(request.cookies, request.headers, identify(request)))
+        return None
+
+    @app.after_request
+    def _remember_write(resp):
+        return after_response(request.method, resp, identify(request))
+
+    @app.teardown_request
+    def _reset_route(exc):
+        token = g.pop('db_replica_token', None)
+        if token is not None:
+            db.reset_replica(token)
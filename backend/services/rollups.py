@@ -0,0 +1,56 @@
+"""
+Counter rollup tables: add-or-insert upserts shared by stats and usage accounting.
+
+Uses ``INSERT ... ON CONFLICT DO UPDATE`` on Postgres and SQLite and falls back
+to UPDATE-then-INSERT on other dialects. The caller owns the transaction.
+"""
+from typing import Sequence
+
+from sqlalchemy import Table, and_, case, update
+
+
+def _insert_for(db):
+    dialect = db.get_bind().dialect.name
+    if dialect in ('postgresql', 'postgres'):
+        from sqlalchemy.dialects.postgresql import insert
+    elif dialect == 'sqlite':
+        from sqlalchemy.dialects.sqlite import insert
+    else:
+        return None
+    return insert
+
+
+def upsert_counters(db, table: Table, key_columns: Sequence[str], key: dict, values: dict, add: bool = True):
+    """Прибавить (add=True) или записать значения счётчиков в строку с ключом key."""
+    insert = _insert_for(db)
+    if insert is not None:
+        stmt = insert(table).values(**key, **values)
+        set_ = {k: (table.c[k] + stmt.excluded[k]) if add else stmt.excluded[k] for k in values}
+        db.execute(stmt.on_conflict_do_update(index_elements=list(key_columns), set_=set_))
+        return
+    where = [table.c[k] == v for k, v in key.items()]
+    set_ = {k: (table.c[k] + v) if add else v for k, v in values.items()}
+    if db.execute(update(table).where(*where).values(**set_)).rowcount == 0:
+        db.execute(table.insert().values(**key, **values))
+
+
+def upsert_counters_many(db, table: Table, key_columns: Sequence[str], rows: Sequence[dict],
+                         counters: Sequence[str], earliest: Sequence[str] = (), add: bool = True):
+    """upsert_counters для пачки строк одним executemany; столбцы earliest хранят наименьшее значение (даты)."""
+    if not rows:
+        return
+    insert = _insert_for(db)
+    if insert is not None:
+        stmt = insert(table)
+        set_ = {k: (table.c[k] + stmt.excluded[k]) if add else stmt.excluded[k] for k in counters}
+        for k in earliest:
+            set_[k] = case((stmt.excluded[k] < table.c[k], stmt.excluded[k]), else_=table.c[k])
+        db.execute(stmt.on_conflict_do_update(index_elements=list(key_columns), set_=set_), list(rows))
+        return
+    for row in rows:
+        where = and_(*[table.c[k] == row[k] for k in key_columns])
+        set_ = {k: (table.c[k] + row[k]) if add else row[k] for k in counters}
+        for k in earliest:
+            set_[k] = case((table.c[k] > row[k], row[k]), else_=table.c[k])
+        if db.execute(update(table).where(where).values(**set_)).rowcount == 0:
+            db.execute(table.insert().values(**row))
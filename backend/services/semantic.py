@@ -0,0 +1,389 @@
+"""
+Semantic search over diary entries (``/api/search?mode=semantic``, optional: ``SEMANTIC_SEARCH=true``).
+
+Entries are embedded by a local multilingual sentence-embedding model on CPU
+(fastembed/ONNX, ``SEMANTIC_MODEL``, loaded once per worker). A query finds
+entries with similar meaning even when the wording differs.
+
+- Storage: one shard file per user, ``SEMANTIC_INDEX_DIR/NN/u<id>.vec``. It is
+  an array of records ``(entry_id int64, change_seq int64, vec float16[dim])``
+  read through ``numpy.memmap``, with the model name and dim in ``u<id>.json``.
+  New vectors are appended. A replaced or deleted entry's row is marked dead
+  (``entry_id = -1``), and the shard is rewritten without dead rows once they
+  exceed ``SEMANTIC_COMPACT_RATIO``. Writers hold a per-shard ``flock``, so
+  gunicorn workers can share the directory.
+- Updates: ``touch(user_id)`` after an entry write queues the user for the
+  background indexer thread. The queue lives in ``services/shared_state.py``.
+  The indexer compares ``(id, change_seq)`` of the live entries with the shard
+  and embeds only new or changed entries, in batches of
+  ``SEMANTIC_BATCH_SIZE``. The same sync backfills existing entries: on the
+  user's first semantic query, or for everyone with
+  ``python manage.py semantic-backfill``.
+- Queries: vectorized cosine top-k over the memmapped shard. Shards with at
+  least ``SEMANTIC_HNSW_MIN_ROWS`` rows use an HNSW index (``hnswlib``) over
+  the rows present when it was built, plus a brute-force scan of rows
+  appended since. The index is rebuilt when that tail grows past 20%.
+
+numpy, fastembed and hnswlib are imported on first use.
+"""
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+from typing import Dict, List, Optional, Tuple
+
+from sqlalchemy import select
+
+from db import Entry, SessionLocal
+from services import gateway, logs, providers, shared_state
+
+SEMANTIC_SEARCH = os.getenv('SEMANTIC_SEARCH', 'false').strip().lower() in ('1', 'true', 'yes', 'on')
+SEMANTIC_INDEX_DIR = os.getenv('SEMANTIC_INDEX_DIR', '/app/data/semantic')
+SEMANTIC_MODEL = os.getenv('SEMANTIC_MODEL', 'sentence-transformers/paraphrase-multilingual-MiniLM-L12-v2')
+SEMANTIC_BATCH_SIZE = int(os.getenv('SEMANTIC_BATCH_SIZE', '32'))
+SEMANTIC_HNSW_MIN_ROWS = int(os.getenv('SEMANTIC_HNSW_MIN_ROWS', '5000'))
+SEMANTIC_COMPACT_RATIO = float(os.getenv('SEMANTIC_COMPACT_RATIO', '0.25'))
+SEMANTIC_CACHE_USERS = int(os.getenv('SEMANTIC_CACHE_USERS', '64'))
+# Пауза перед синхронизацией: серия правок одного пользователя попадает в один проход
+SEMANTIC_DEBOUNCE_SECONDS = float(os.getenv('SEMANTIC_DEBOUNCE_SECONDS', '0.5'))
+
+log = logs.get_logger('semantic')
+
+
+class SemanticUnavailable(Exception):
+    """Модель эмбеддингов недоступна (не установлена или не загрузилась)."""
+
+
+def preload():
+    """Load the embedding model in the background at worker start."""
+    if SEMANTIC_SEARCH:
+        threading.Thread(target=providers.get_embedder, name='embedder-preload', daemon=True).start()
+
+
+class FastEmbedder:
+    """fastembed ``TextEmbedding`` -> L2-normalized float32 rows."""
+
+    def __init__(self, model, name: str):
+        self._model = model
+        self.name = name
+        self.dim = int(self.embed(['dim probe']).shape[1])
+
+    def embed(self, texts: List[str]):
+        import numpy as np
+        vecs = np.asarray(list(self._model.embed(texts, batch_size=SEMANTIC_BATCH_SIZE)), dtype=np.float32)
+        return normalize(vecs)
+
+
+def normalize(vecs):
+    import numpy as np
+    norms = np.linalg.norm(vecs, axis=1, keepdims=True)
+    return vecs / np.maximum(norms, 1e-12)
+
+
+# --- Shards ---
+
+def _dtype(dim: int):
+    import numpy as np
+    return np.dtype([('id', '<i8'), ('seq', '<i8'), ('vec', '<f2', (dim,))])
+
+
+class Shard:
+    def __init__(self, user_id: int, model: str, dim: int):
+        base = os.path.join(SEMANTIC_INDEX_DIR, f'{user_id % 100:02d}', f'u{user_id}')
+        self.path = base + '.vec'
+        self.meta_path = base + '.json'
+        self.lock_path = base + '.lock'
+        self.model = model
+        self.dim = dim
+        self.dtype = _dtype(dim)
+
+    @contextmanager
+    def locked(self):
+        import fcntl
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        with open(self.lock_path, 'a') as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            try:
+                self._check_meta()
+                yield self
+            finally:
+                fcntl.flock(lock, fcntl.LOCK_UN)
+
+    def _check_meta(self):
+        meta = {'model': self.model, 'dim': self.dim}
+        try:
+            with open(self.meta_path) as f:
+                if json.load(f) == meta:
+                    return
+        except (OSError, ValueError):
+            pass
+        # Другая модель или размерность: векторы несовместимы, шард строится заново
+        if os.path.exists(self.path):
+            os.remove(self.path)
+        with open(self.meta_path, 'w') as f:
+            json.dump(meta, f)
+
+    def read(self):
+        """Records currently in the shard (read-only memmap) or None."""
+        import numpy as np
+        try:
+            rows = os.path.getsize(self.path) // self.dtype.itemsize
+        except OSError:
+            return None
+        if rows == 0:
+            return None
+        # Недописанная последняя запись (параллельная дозапись) не попадает в отображение
+        return np.memmap(self.path, dtype=self.dtype, mode='r', shape=(rows,))
+
+    def append(self, ids, seqs, vecs):
+        import numpy as np
+        records = np.zeros(len(ids), dtype=self.dtype)
+        records['id'] = ids
+        records['seq'] = seqs
+        records['vec'] = vecs.astype(np.float16)
+        with open(self.path, 'ab') as f:
+            f.write(records.tobytes())
+
+    def kill(self, rows: List[int]):
+        import numpy as np
+        if not rows:
+            return
+        dead = np.int64(-1).tobytes()
+        with open(self.path, 'r+b') as f:
+            for row in rows:
+                f.seek(row * self.dtype.itemsize)
+                f.write(dead)
+
+    def compact(self):
+        import numpy as np
+        records = self.read()
+        if records is None:
+            return
+        live = np.array(records[records['id'] >= 0])
+        tmp = f'{self.path}.{os.getpid()}.tmp'
+        with open(tmp, 'wb') as f:
+            f.write(live.tobytes())
+        # Замена файла атомарна: читатели видят старый или новый шард целиком (новый inode)
+        os.replace(tmp, self.path)
+
+
+def _shard(user_id: int, embedder) -> Shard:
+    return Shard(user_id, embedder.name, embedder.dim)
+
+
+def sync_user(user_id: int) -> int:
+    """Bring the user's shard in line with their live entries; returns the number of entries embedded."""
+    import numpy as np
+    embedder = providers.get_embedder()
+    if embedder is None:
+        return 0
+    db = SessionLocal()
+    try:
+        live = dict(db.execute(select(Entry.id, Entry.change_seq).where(
+            Entry.user_id == user_id, Entry.deleted_at.is_(None))).all())
+        with _shard(user_id, embedder).locked() as shard:
+            records = shard.read()
+            indexed: Dict[int, Tuple[int, int]] = {}
+            if records is not None:
+                for row, (entry_id, seq) in enumerate(zip(records['id'].tolist(), records['seq'].tolist())):
+                    if entry_id >= 0:
+                        indexed[entry_id] = (row, seq)
+            stale_rows = [row for entry_id, (row, seq) in indexed.items() if live.get(entry_id) != seq]
+            todo = [entry_id for entry_id, seq in live.items() if indexed.get(entry_id, (None, None))[1] != seq]
+            for i in range(0, len(todo), SEMANTIC_BATCH_SIZE):
+                batch = db.execute(select(Entry.id, Entry.change_seq, Entry.text).where(
+                    Entry.id.in_(todo[i:i + SEMANTIC_BATCH_SIZE]))).all()
+                vecs = embedder.embed([text or '' for _, _, text in batch])
+                shard.append([r[0] for r in batch], [r[1] or 0 for r in batch], vecs)
+            # Старые версии помечаются после дозаписи новых: поиск не теряет запись ни на миг
+            shard.kill(stale_rows)
+            total = (0 if records is None else len(records)) + len(todo)
+            dead = (0 if records is None else int(np.count_nonzero(records['id'] < 0))) + len(stale_rows)
+            if total and dead / total > SEMANTIC_COMPACT_RATIO:
+                shard.compact()
+        if todo or stale_rows:
+            log.debug('shard synced', user_id=user_id, embedded=len(todo), dropped=len(stale_rows))
+        return len(todo)
+    finally:
+        db.close()
+
+
+def backfill(user_id: Optional[int] = None) -> dict:
+    """Sync shards of one user or of everyone with live entries (manage.py semantic-backfill)."""
+    if providers.get_embedder() is None:
+        raise SemanticUnavailable('semantic search model is not available')
+    if user_id is None:
+        db = SessionLocal()
+        try:
+            user_ids = db.scalars(select(Entry.user_id).where(
+                Entry.user_id.is_not(None), Entry.deleted_at.is_(None)).distinct()).all()
+        finally:
+            db.close()
+    else:
+        user_ids = [user_id]
+    embedded = sum(sync_user(uid) for uid in user_ids)
+    return {'users': len(user_ids), 'embedded': embedded}
+
+
+# --- Background indexer ---
+
+# Очередь заданий в services/shared_state.py: с SHARED_STATE_URL её разбирают индексаторы всех узлов
+# (тогда SEMANTIC_INDEX_DIR должен быть общим томом)
+_QUEUE = 'semantic:queue'
+_worker: Optional[threading.Thread] = None
+_worker_lock = threading.Lock()
+
+
+def _ensure_worker():
+    global _worker
+    if _worker is None:
+        with _worker_lock:
+            if _worker is None:
+                _worker = threading.Thread(target=_run_worker, name='semantic-indexer', daemon=True)
+                _worker.start()
+
+
+def touch(user_id: Optional[int]):
+    """Queue the user's shard for a sync (after an entry write or on the first semantic query)."""
+    if not SEMANTIC_SEARCH or not user_id:
+        return
+    state = shared_state.get_state()
+    # Пользователь уже в очереди — повторная запись войдёт в тот же проход
+    if state.add(f'semantic:queued:{user_id}', ttl=3600):
+        state.push(_QUEUE, str(user_id))
+    _ensure_worker()
+
+
+def pending(user_id: int) -> bool:
+    state = shared_state.get_state()
+    return state.get(f'semantic:queued:{user_id}') is not None or state.get(f'semantic:syncing:{user_id}') is not None
+
+
+def _run_worker():
+    state = shared_state.get_state()
+    while True:
+        try:
+            item = state.pop(_QUEUE, timeout=5)
+        except Exception as e:
+            log.warning('semantic queue error', error=str(e))
+            time.sleep(5)
+            continue
+        if item is None:
+            continue
+        user_id = int(item)
+        time.sleep(SEMANTIC_DEBOUNCE_SECONDS)
+        state.set(f'semantic:syncing:{user_id}', b'1', ttl=3600)
+        # Снимаем из очереди до синхронизации: запись, пришедшая во время прохода, поставит пользователя снова
+        state.delete(f'semantic:queued:{user_id}')
+        try:
+            sync_user(user_id)
+        except Exception as e:
+            log.warning('shard sync error', user_id=user_id, error=str(e))
+        finally:
+            state.delete(f'semantic:syncing:{user_id}')
+
+
+# --- Queries ---
+
+class _Reader:
+    """Memmap of one shard (reopened when the file changes) and its optional HNSW index."""
+
+    def __init__(self, shard: Shard):
+        self.shard = shard
+        self.stat_key = None
+        self.records = None
+        self.hnsw = None
+        self.hnsw_rows = 0
+        self.lock = threading.Lock()
+
+    def refresh(self):
+        try:
+            st = os.stat(self.shard.path)
+            key = (st.st_ino, st.st_size)
+        except OSError:
+            key = None
+        if key != self.stat_key:
+            if key is None or (self.stat_key and key[0] != self.stat_key[0]):
+                self.hnsw, self.hnsw_rows = None, 0  # шард переписан (compact): номера строк другие
+            self.stat_key = key
+            self.records = self.shard.read() if key else None
+        if self.records is not None and len(self.records) >= SEMANTIC_HNSW_MIN_ROWS:
+            if self.hnsw is None or len(self.records) - self.hnsw_rows > 0.2 * self.hnsw_rows:
+                self._build_hnsw()
+        return self.records
+
+    def _build_hnsw(self):
+        try:
+            import hnswlib
+        except Exception:
+            return
+        import numpy as np
+        rows = len(self.records)
+        index = hnswlib.Index(space='cosine', dim=self.shard.dim)
+        index.init_index(max_elements=rows, ef_construction=100, M=16)
+        index.add_items(np.asarray(self.records['vec'], dtype=np.float32), np.arange(rows))
+        index.set_ef(64)
+        self.hnsw, self.hnsw_rows = index, rows
+
+
+_readers: "OrderedDict[int, _Reader]" = OrderedDict()
+_readers_lock = threading.Lock()
+
+
+def _reader(user_id: int, embedder) -> _Reader:
+    with _readers_lock:
+        reader = _readers.get(user_id)
+        if reader is None or reader.shard.model != embedder.name:
+            reader = _readers[user_id] = _Reader(_shard(user_id, embedder))
+        _readers.move_to_end(user_id)
+        while len(_readers) > SEMANTIC_CACHE_USERS:
+            _readers.popitem(last=False)
+        return reader
+
+
+def search(user_id: int, query: str, k: int = 20) -> List[Tuple[int, float]]:
+    """[(entry_id, cosine score)] best first; raises SemanticUnavailable without a model.
+    A missing or empty shard queues the backfill and returns no hits."""
+    import numpy as np
+    embedder = providers.get_embedder()
+    if embedder is None:
+        raise SemanticUnavailable('semantic search model is not available')
+    q = gateway.call('embeddings', embedder.embed, [query])[0].astype(np.float32)
+    reader = _reader(user_id, embedder)
+    with reader.lock:
+        records = reader.refresh()
+        if records is None or len(records) == 0:
+            # Шарда ещё нет: первый запрос ставит бэкфилл, дальше шард догоняют touch() после записей
+            touch(user_id)
+            return []
+        ids = np.asarray(records['id'])
+        candidates, scores = [], []
+        start = 0
+        if reader.hnsw is not None:
+            # Индекс покрывает первые hnsw_rows строк; мёртвые строки отсеиваются ниже, поэтому берём с запасом
+            labels, distances = reader.hnsw.knn_query(q, k=min(reader.hnsw_rows, k * 2 + 16))
+            candidates.append(labels[0].astype(np.int64))
+            scores.append(1.0 - distances[0])
+            start = reader.hnsw_rows
+        if start < len(records):
+            tail = np.asarray(records['vec'][start:], dtype=np.float32) @ q
+            candidates.append(np.arange(start, len(records)))
+            scores.append(tail)
+    rows = np.concatenate(candidates)
+    scores = np.concatenate(scores)
+    alive = ids[rows] >= 0
+    rows, scores = rows[alive], scores[alive]
+    if len(rows) > k * 2:
+        top = np.argpartition(-scores, k * 2)[:k * 2]
+        rows, scores = rows[top], scores[top]
+    result, seen = [], set()
+    for i in np.argsort(-scores):
+        entry_id = int(ids[rows[i]])
+        if entry_id not in seen:
+            seen.add(entry_id)
+            result.append((entry_id, float(scores[i])))
+            if len(result) == k:
+                break
+    return result
@@ -0,0 +1,218 @@
+"""
+Shared state for data that every app node must see the same way: sessions,
+caches, dedup keys and job queues.
+
+``SHARED_STATE_URL`` selects the backend:
+
+- empty (default): ``MemoryState``, the state of this process only. This is
+  enough for a single worker, and for data that is per-process anyway.
+- ``redis://host:6379/0``: ``RedisState``, a network key-value store (Redis,
+  Valkey, KeyDB; needs the ``redis`` package). Several gunicorn workers and
+  several hosts behind a load balancer then share the state.
+  ``services/fake_kv.py`` is a small local stand-in server for tests:
+  ``python services/fake_kv.py --port 6390`` and
+  ``SHARED_STATE_URL=redis://127.0.0.1:6390/0``.
+
+Keys are strings, prefixed with ``SHARED_STATE_PREFIX``; values are bytes (helpers
+``get_json``/``set_json``). Operations:
+
+- ``get``, ``set`` (optional TTL in seconds) and ``delete``;
+- ``add``: set only if absent, for dedup keys and locks;
+- ``incr``: an atomic counter;
+- ``update(keys, fn)``: an atomic read-modify-write of several keys. fn gets
+  ``{key: bytes}`` of the existing keys and returns ``{key: (bytes, ttl)}`` to
+  write, or None to leave them unchanged. Redis runs it as WATCH/MULTI/EXEC
+  and retries on conflict, so fn may be called more than once;
+- ``push`` / ``pop(timeout)``: a FIFO job queue.
+"""
+import json
+import os
+import threading
+import time
+from collections import deque
+from typing import Callable, Dict, Iterable, Optional, Tuple
+
+SHARED_STATE_URL = os.getenv('SHARED_STATE_URL', '').strip()
+SHARED_STATE_PREFIX = os.getenv('SHARED_STATE_PREFIX', 'diary:')
+
+Writes = Dict[str, Tuple[bytes, Optional[float]]]
+
+
+def _bytes(value) -> bytes:
+    return value if isinstance(value, bytes) else str(value).encode('utf-8')
+
+
+class MemoryState:
+    """In-process implementation: dict with lazy TTL expiry, one lock."""
+
+    networked = False
+
+    def __init__(self):
+        self._data: Dict[str, Tuple[bytes, Optional[float]]] = {}
+        self._queues: Dict[str, deque] = {}
+        self._cond = threading.Condition()
+
+    def _live(self, key: str) -> Optional[bytes]:
+        item = self._data.get(key)
+        if item is None:
+            return None
+        value, expires = item
+        if expires is not None and expires <= time.monotonic():
+            del self._data[key]
+            return None
+        return value
+
+    def _put(self, key: str, value, ttl: Optional[float]):
+        self._data[key] = (_bytes(value), time.monotonic() + ttl if ttl else None)
+
+    def get(self, key: str) -> Optional[bytes]:
+        with self._cond:
+            return self._live(key)
+
+    def set(self, key: str, value, ttl: Optional[float] = None):
+        with self._cond:
+            self._put(key, value, ttl)
+
+    def add(self, key: str, value=b'1', ttl: Optional[float] = None) -> bool:
+        with self._cond:
+            if self._live(key) is not None:
+                return False
+            self._put(key, value, ttl)
+            return True
+
+    def delete(self, *keys: str):
+        with self._cond:
+            for key in keys:
+                self._data.pop(key, None)
+
+    def incr(self, key: str, amount: int = 1, ttl: Optional[float] = None) -> int:
+        with self._cond:
+            current = self._live(key)
+            value = int(current or 0) + amount
+            if current is None:
+                self._put(key, value, ttl)
+            else:
+                self._data[key] = (_bytes(value), self._data[key][1])
+            return value
+
+    def update(self, keys: Iterable[str], fn: Callable[[Dict[str, bytes]], Optional[Writes]]):
+        with self._cond:
+            current = {}
+            for key in keys:
+                value = self._live(key)
+                if value is not None:
+                    current[key] = value
+            for key, (value, ttl) in (fn(current) or {}).items():
+                self._put(key, value, ttl)
+
+    def push(self, queue: str, value):
+        with self._cond:
+            self._queues.setdefault(queue, deque()).append(_bytes(value))
+            self._cond.notify_all()
+
+    def pop(self, queue: str, timeout: float = 0) -> Optional[bytes]:
+        deadline = time.monotonic() + timeout
+        with self._cond:
+            while True:
+                items = self._queues.get(queue)
+                if items:
+                    return items.popleft()
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return None
+                self._cond.wait(remaining)
+
+
+class RedisState:
+    """Network implementation over the Redis protocol (redis-py, connection pool shared by threads)."""
+
+    networked = True
+
+    def __init__(self, url: str, prefix: str = SHARED_STATE_PREFIX):
+        import redis
+        self._redis = redis
+        self._client = redis.Redis.from_url(url, socket_timeout=5, socket_connect_timeout=2,
+                                            health_check_interval=30)
+        self.prefix = prefix
+
+    def _k(self, key: str) -> str:
+        return self.prefix + key
+
+    @staticmethod
+    def _px(ttl: Optional[float]) -> Optional[int]:
+        return max(1, int(ttl * 1000)) if ttl else None
+
+    def get(self, key: str) -> Optional[bytes]:
+        return self._client.get(self._k(key))
+
+    def set(self, key: str, value, ttl: Optional[float] = None):
+        self._client.set(self._k(key), _bytes(value), px=self._px(ttl))
+
+    def add(self, key: str, value=b'1', ttl: Optional[float] = None) -> bool:
+        return bool(self._client.set(self._k(key), _bytes(value), px=self._px(ttl), nx=True))
+
+    def delete(self, *keys: str):
+        if keys:
+            self._client.delete(*[self._k(k) for k in keys])
+
+    def incr(self, key: str, amount: int = 1, ttl: Optional[float] = None) -> int:
+        value = self._client.incrby(self._k(key), amount)
+        if ttl and value == amount:
+            # Новый счётчик: срок жизни задаётся один раз, как у MemoryState
+            self._client.pexpire(self._k(key), self._px(ttl))
+        return int(value)
+
+    def update(self, keys: Iterable[str], fn: Callable[[Dict[str, bytes]], Optional[Writes]]):
+        keys = list(keys)
+        full = [self._k(k) for k in keys]
+        with self._client.pipeline() as pipe:
+            while True:
+                try:
+                    pipe.watch(*full)
+                    values = pipe.mget(full)
+                    writes = fn({k: v for k, v in zip(keys, values) if v is not None})
+                    pipe.multi()
+                    for key, (value, ttl) in (writes or {}).items():
+                        pipe.set(self._k(key), _bytes(value), px=self._px(ttl))
+                    pipe.execute()
+                    return
+                except self._redis.WatchError:
+                    # Ключ изменил другой узел между чтением и записью: пересчитываем
+                    continue
+
+    def push(self, queue: str, value):
+        self._client.rpush(self._k(queue), _bytes(value))
+
+    def pop(self, queue: str, timeout: float = 0) -> Optional[bytes]:
+        if timeout <= 0:
+            return self._client.lpop(self._k(queue))
+        item = self._client.blpop([self._k(queue)], timeout=max(1, int(round(timeout))))
+        return item[1] if item else None
+
+
+_state = None
+_state_lock = threading.Lock()
+
+
+def get_state():
+    """Backend chosen by SHARED_STATE_URL, one per process."""
+    global _state
+    if _state is None:
+        with _state_lock:
+            if _state is None:
+                _state = RedisState(SHARED_STATE_URL) if SHARED_STATE_URL else MemoryState()
+    return _state
+
+
+def networked() -> bool:
+    """State is shared beyond this process (another worker or node sees the same keys)."""
+    return bool(SHARED_STATE_URL)
+
+
+def get_json(key: str):
+    raw = get_state().get(key)
+    return json.loads(raw) if raw is not None else None
+
+
+def set_json(key: str, value, ttl: Optional[float] = None):
+    get_state().set(key, json.dumps(value, ensure_ascii=False, separators=(',', ':')), ttl)
@@ -0,0 +1,182 @@
+"""
+Per-user learning statistics kept as per-day rollups.
+
+``user_stats_daily`` holds one row per (user, language, day) with entry count,
+speaking time (sum of ``audio_duration``), review count and corrected-review
+count. Entry and review handlers apply deltas in their own transaction, so
+``/api/stats`` only reads rollup rows and never scans ``entry``.
+``rebuild()`` recomputes the entry-derived columns from ``entry`` for backfills
+(``python manage.py rebuild-stats``); review counters cannot be derived from
+entries and are preserved.
+"""
+from collections import defaultdict
+from datetime import date, datetime, timedelta
+from typing import Dict, Iterable, Optional, Tuple
+
+from sqlalchemy import func, select, update
+
+from db import Entry, UserStatsDaily
+from services.rollups import upsert_counters
+
+_table = UserStatsDaily.__table__
+_KEY = ['user_id', 'language', 'day']
+
+
+def _upsert(db, key: dict, values: dict, add: bool = True):
+    upsert_counters(db, _table, _KEY, key, values, add=add)
+
+
+def _day(ts: Optional[datetime]) -> date:
+    return (ts or datetime.utcnow()).date()
+
+
+def _lang(language: Optional[str]) -> str:
+    return (language or 'unknown')[:10]
+
+
+# --- Incremental updates (caller commits) ---
+
+def entries_added(db, user_id: int, rows: Iterable[dict], sign: int = 1):
+    """Учесть пачку записей (dict с language/timestamp/audio_duration); sign=-1 — вычесть."""
+    deltas: Dict[Tuple[str, date], list] = defaultdict(lambda: [0, 0.0])
+    for row in rows:
+        d = deltas[(_lang(row.get('language')), _day(row.get('timestamp')))]
+        d[0] += sign
+        d[1] += sign * float(row.get('audio_duration') or 0.0)
+    for (language, day), (count, seconds) in deltas.items():
+        _upsert(db, {'user_id': user_id, 'language': language, 'day': day},
+                {'entries_count': count, 'speaking_seconds': seconds})
+
+
+def _entry_row(entry) -> dict:
+    return {'language': entry.language, 'timestamp': entry.timestamp, 'audio_duration': entry.audio_duration}
+
+
+def entry_added(db, entry):
+    entries_added(db, entry.user_id, [_entry_row(entry)])
+
+
+def entry_removed(db, entry):
+    entries_added(db, entry.user_id, [_entry_row(entry)], sign=-1)
+
+
+def entry_changed(db, user_id: int, before: dict, entry):
+    """before — снимок language/timestamp/audio_duration до изменения."""
+    after = _entry_row(entry)
+    if before == after:
+        return
+    entries_added(db, user_id, [before], sign=-1)
+    entries_added(db, user_id, [after])
+
+
+def review_recorded(db, user_id: int, language: str, changed: bool):
+    _upsert(db, {'user_id': user_id, 'language': _lang(language), 'day': _day(None)},
+            {'reviews_count': 1, 'corrected_count': 1 if changed else 0})
+
+
+# --- Reads (rollups only) ---
+
+def _streaks(days, today: date):
+    """Текущая серия (заканчивается сегодня или вчера) и самая длинная серия активных дней."""
+    longest = current = run = 0
+    prev = None
+    for d in days:
+        run = run + 1 if prev is not None and d - prev == timedelta(days=1) else 1
+        longest = max(longest, run)
+        prev = d
+    if prev is not None and today - prev <= timedelta(days=1):
+        current = run
+    return current, longest
+
+
+def _ratio(part: int, whole: int) -> float:
+    return round(part / whole, 4) if whole else 0.0
+
+
+def get_user_stats(db, user_id: int, days: int = 30, today: Optional[date] = None) -> dict:
+    today = today or datetime.utcnow().date()
+    per_lang = db.execute(
+        select(
+            UserStatsDaily.language,
+            func.sum(UserStatsDaily.entries_count),
+            func.sum(UserStatsDaily.speaking_seconds),
+            func.sum(UserStatsDaily.reviews_count),
+            func.sum(UserStatsDaily.corrected_count),
+        ).where(UserStatsDaily.user_id == user_id).group_by(UserStatsDaily.language)
+    ).all()
+    active_days = [
+        d if isinstance(d, date) else date.fromisoformat(str(d)[:10])
+        for d in db.execute(
+            select(UserStatsDaily.day).where(
+                UserStatsDaily.user_id == user_id, UserStatsDaily.entries_count > 0
+            ).group_by(UserStatsDaily.day).order_by(UserStatsDaily.day)
+        ).scalars()
+    ]
+    recent = db.execute(
+        select(UserStatsDaily).where(
+            UserStatsDaily.user_id == user_id, UserStatsDaily.day > today - timedelta(days=days)
+        ).order_by(UserStatsDaily.day, UserStatsDaily.language)
+    ).scalars().all()
+
+    by_language = {}
+    totals = {'entries': 0, 'speaking_seconds': 0.0, 'reviews': 0, 'corrected': 0}
+    for language, entries, seconds, reviews, corrected in per_lang:
+        item = {
+            'entries': int(entries or 0),
+            'speaking_seconds': round(float(seconds or 0.0), 2),
+            'reviews': int(reviews or 0),
+            'corrected': int(corrected or 0),
+        }
+        item['correction_rate'] = _ratio(item['corrected'], item['reviews'])
+        by_language[language] = item
+        for k in totals:
+            totals[k] += item[k]
+    totals['speaking_seconds'] = round(totals['speaking_seconds'], 2)
+    totals['correction_rate'] = _ratio(totals['corrected'], totals['reviews'])
+    totals['active_days'] = len(active_days)
+    current, longest = _streaks(active_days, today)
+
+    return {
+        'totals': totals,
+        'by_language': by_language,
+        'streak': {
+            'current': current,
+            'longest': longest,
+            'last_active_day': active_days[-1].isoformat() if active_days else None,
+        },
+        'daily': [
+            {
+                'day': r.day.isoformat(),
+                'language': r.language,
+                'entries': r.entries_count,
+                'speaking_seconds': round(r.speaking_seconds or 0.0, 2),
+                'reviews': r.reviews_count,
+                'corrected': r.corrected_count,
+            }
+            for r in recent
+        ],
+    }
+
+
+# --- Backfill ---
+
+def rebuild(db, user_id: Optional[int] = None) -> int:
+    """Пересчитать entries_count/speaking_seconds из entry. Возвращает число затронутых строк rollup."""
+    scope = [UserStatsDaily.user_id == user_id] if user_id is not None else []
+    db.execute(update(UserStatsDaily).where(*scope).values(entries_count=0, speaking_seconds=0.0))
+    day_col = func.date(Entry.timestamp)
+    query = select(
+        Entry.user_id, Entry.language, day_col,
+        func.count(Entry.id), func.coalesce(func.sum(Entry.audio_duration), 0.0),
+    ).where(Entry.user_id.is_not(None), Entry.deleted_at.is_(None))
+    if user_id is not None:
+        query = query.where(Entry.user_id == user_id)
+    n = 0
+    for uid, language, day, count, seconds in db.execute(query.group_by(Entry.user_id, Entry.language, day_col)):
+        if day is None:
+            continue
+        day = day if isinstance(day, date) else date.fromisoformat(str(day)[:10])
+        _upsert(db, {'user_id': uid, 'language': _lang(language), 'day': day},
+                {'entries_count': int(count), 'speaking_seconds': float(seconds or 0.0)}, add=False)
+        n += 1
+    return n
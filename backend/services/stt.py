@@ -0,0 +1,138 @@
+"""
+Speech-to-text backends for /api/transcribe: the Groq API and a local CPU Whisper.
+
+- ``groq``: ``whisper-large-v3`` through the Groq API (the default, unchanged).
+- ``local``: faster-whisper (CTranslate2, int8 by default) on the worker's CPU.
+  The model is loaded once per worker (``preload()`` at app start, in a
+  background thread), and all request threads share it. Concurrency is bounded
+  by the gateway limit ``local_whisper``. Requires ``faster-whisper`` and the
+  model (``LOCAL_WHISPER_MODEL``: a size name or a path to a converted model).
+
+``TRANSCRIBE_BACKEND`` selects the routing:
+
+- ``groq`` — Groq only.
+- ``local`` — the local engine first, Groq as the fallback.
+- ``auto`` — clips up to ``TRANSCRIBE_LOCAL_MAX_SECONDS`` go to the local
+  engine (no upload, no provider queue), longer clips and clips of unknown
+  length go to Groq. Each falls back to the other.
+
+The clip length is read from the WAV header after the ffmpeg conversion.
+With ``FAKE_PROVIDERS`` including ``local_whisper``, the engine is replaced by
+the offline stand-in, so the pipeline runs without network or model files.
+"""
+import asyncio
+import io
+import os
+import threading
+import wave
+from types import SimpleNamespace
+from typing import List, Optional
+
+from services import gateway, logs, metrics, providers
+
+TRANSCRIBE_BACKEND = os.getenv('TRANSCRIBE_BACKEND', 'groq').strip().lower()
+TRANSCRIBE_LOCAL_MAX_SECONDS = float(os.getenv('TRANSCRIBE_LOCAL_MAX_SECONDS', '20'))
+LOCAL_WHISPER_BEAM_SIZE = int(os.getenv('LOCAL_WHISPER_BEAM_SIZE', '1'))
+LOCAL_WHISPER_MODEL = os.getenv('LOCAL_WHISPER_MODEL', 'small')
+GROQ_MODEL = 'whisper-large-v3'
+
+log = logs.get_logger('transcribe')
+
+_local_missing = False  # faster-whisper или модель недоступны: дальше только Groq
+
+
+def local_enabled() -> bool:
+    return TRANSCRIBE_BACKEND in ('local', 'auto')
+
+
+def preload():
+    """Load the local model in the background so the first short clip does not wait for it."""
+    if local_enabled():
+        threading.Thread(target=providers.get_local_whisper, name='whisper-preload', daemon=True).start()
+
+
+def clip_seconds(audio) -> Optional[float]:
+    """Duration of a WAV file (path or bytes), None for other formats."""
+    try:
+        with wave.open(io.BytesIO(audio) if isinstance(audio, (bytes, bytearray)) else audio, 'rb') as w:
+            return w.getnframes() / float(w.getframerate())
+    except Exception:
+        return None
+
+
+def plan(seconds: Optional[float]) -> List[str]:
+    """Backends to try, in order."""
+    if not local_enabled() or _local_missing:
+        return ['groq']
+    if TRANSCRIBE_BACKEND == 'local':
+        return ['local', 'groq']
+    if seconds is not None and seconds <= TRANSCRIBE_LOCAL_MAX_SECONDS:
+        return ['local', 'groq']
+    return ['groq', 'local']
+
+
+def _whisper_language(language: Optional[str]) -> Optional[str]:
+    # Клиент присылает 'en-US' / 'auto'; faster-whisper принимает код ISO 639-1
+    code = (language or '').split('-')[0].strip().lower()
+    return None if code in ('', 'auto') else code
+
+
+def _local_transcribe(audio, language: Optional[str]):
+    global _local_missing
+    model = providers.get_local_whisper()
+    if model is None:
+        _local_missing = True
+        raise RuntimeError('local Whisper model is not available')
+    segments, info = model.transcribe(audio, language=_whisper_language(language),
+                                      beam_size=LOCAL_WHISPER_BEAM_SIZE, vad_filter=True)
+    return SimpleNamespace(text=''.join(s.text for s in segments).strip(), language=info.language)
+
+
+def _groq_transcribe(path: str, language: Optional[str]):
+    with open(path, 'rb') as f:
+        return gateway.call('groq', providers.get_groq_client().audio.transcriptions.create,
+                            file=f, model=GROQ_MODEL, language=language)
+
+
+def _log_fallback(backends: List[str], i: int, error: Exception):
+    log.warning('transcription backend failed, falling back', backend=backends[i],
+                fallback=backends[i + 1], error=str(error) or type(error).__name__)
+
+
+def transcribe(path: str, language: Optional[str]):
+    """Transcribe the file at path; returns an object with ``text`` and ``backend``."""
+    backends = plan(clip_seconds(path))
+    for i, backend in enumerate(backends):
+        try:
+            if backend == 'local':
+                with metrics.stage('local_whisper', LOCAL_WHISPER_MODEL):
+                    result = gateway.call('local_whisper', _local_transcribe, path, language)
+            else:
+                with metrics.stage('groq', GROQ_MODEL):
+                    result = _groq_transcribe(path, language)
+            return SimpleNamespace(text=result.text, backend=backend)
+        except Exception as e:
+            if i + 1 == len(backends):
+                raise
+            _log_fallback(backends, i, e)
+
+
+async def atranscribe(upload: tuple, language: Optional[str]):
+    """Same for the async mode (asgi.py): upload is (filename, bytes) as AsyncGroq accepts it."""
+    backends = plan(clip_seconds(upload[1]))
+    for i, backend in enumerate(backends):
+        try:
+            if backend == 'local':
+                with metrics.stage('local_whisper', LOCAL_WHISPER_MODEL):
+                    # CPU-работа в потоке; слот local_whisper занят, пока расшифровка действительно идёт
+                    result = await asyncio.to_thread(gateway.call, 'local_whisper', _local_transcribe,
+                                                     io.BytesIO(upload[1]), language)
+            else:
+                with metrics.stage('groq', GROQ_MODEL):
+                    result = await gateway.acall('groq', providers.get_async_groq_client().audio.transcriptions.create,
+                                                 file=upload, model=GROQ_MODEL, language=language)
+            return SimpleNamespace(text=result.text, backend=backend)
+        except Exception as e:
+            if i + 1 == len(backends):
+                raise
+            _log_fallback(backends, i, e)
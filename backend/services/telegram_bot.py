@@ -7,7 +7,7 @@ import threading
 from dataclasses import dataclass, asdict
 from typing import Optional, Dict, Any
 
-import requests
+from services import shared_state
 
 
 SESSIONS_PATH = os.path.join(os.path.dirname(__file__), '..', 'data', 'telegram_sessions.json')
@@ -100,6 +100,89 @@ class SessionStore:
         raise ValueError('Invalid session token')
 
 
+class SharedSessionStore(SessionStore):
+    """Session store in services/shared_state.py, so every app node sees the same sessions.
+
+    Keys: ``tg:session:<user_id>`` (JSON of the session) and ``tg:token:<session_token>`` -> user_id.
+    """
+
+    def __init__(self, state=None):
+        self.state = state or shared_state.get_state()
+
+    @staticmethod
+    def _key(user_id) -> str:
+        return f'tg:session:{user_id}'
+
+    def _load_session(self, user_id) -> Optional[Dict[str, Any]]:
+        raw = self.state.get(self._key(user_id))
+        return json.loads(raw) if raw is not None else None
+
+    def _user_for(self, session_token: str):
+        raw = self.state.get(f'tg:token:{session_token}')
+        if raw is None:
+            raise ValueError('Invalid session token')
+        return raw.decode('utf-8')
+
+    def _touch(self, user_id, change=None) -> Dict[str, Any]:
+        """Atomically update last_seen (and apply change) of an existing session."""
+        result = {}
+
+        def _apply(current):
+            sess = json.loads(current[self._key(user_id)]) if current else None
+            if sess is None:
+                return None
+            sess['last_seen'] = int(time.time())
+            result['value'] = change(sess) if change else None
+            result['session'] = sess
+            return {self._key(user_id): (json.dumps(sess, ensure_ascii=False), None)}
+
+        self.state.update([self._key(user_id)], _apply)
+        return result
+
+    def get_or_create(self, user_id: int) -> Dict[str, Any]:
+        now = int(time.time())
+        sess = {
+            'user_id': user_id,
+            'session_token': self._gen_token(user_id),
+            'created_at': now,
+            'last_seen': now,
+            'notes': []
+        }
+        # Индекс токена пишется первым: сессия, видимая другим узлам, всегда находится по токену
+        self.state.set(f"tg:token:{sess['session_token']}", str(user_id))
+        if self.state.add(self._key(user_id), json.dumps(sess, ensure_ascii=False)):
+            return sess
+        self.state.delete(f"tg:token:{sess['session_token']}")
+        result = self._touch(user_id)
+        return result.get('session') or self._load_session(user_id)
+
+    def add_note(self, session_token: str, text: str) -> Dict[str, Any]:
+        note = {
+            'id': int(time.time() * 1000),
+            'text': text,
+            'timestamp': int(time.time())
+        }
+        result = self._touch(self._user_for(session_token),
+                             lambda sess: sess.setdefault('notes', []).append(note))
+        if 'session' not in result:
+            raise ValueError('Invalid session token')
+        return note
+
+    def list_notes(self, session_token: str) -> Dict[str, Any]:
+        sess = self._load_session(self._user_for(session_token))
+        if not sess:
+            raise ValueError('Invalid session token')
+        return {
+            'user_id': sess.get('user_id'),
+            'notes': list(sess.get('notes') or [])
+        }
+
+
+def session_store() -> SessionStore:
+    """SharedSessionStore when SHARED_STATE_URL is set (several nodes), otherwise the JSON file of this host."""
+    return SharedSessionStore() if shared_state.networked() else SessionStore()
+
+
 class TelegramBotService:
     """
     Minimal Telegram bot webhook handler using direct HTTP calls to Telegram API.
@@ -120,9 +203,11 @@ class TelegramBotService:
         # Можно задать через переменную окружения WEBAPP_VERSION/FRONTEND_VERSION
         # Если не задано, используем номер дня (обновляется раз в сутки)
         self.version = (os.getenv('WEBAPP_VERSION') or os.getenv('FRONTEND_VERSION') or str(int(time.time() // 86400)))
-        self.sessions = SessionStore()
+        self.sessions = session_store()
 
     def _post(self, method: str, payload: Dict[str, Any]) -> Dict[str, Any]:
+        import requests  # imported on first webhook call to keep worker startup fast
+
         url = f"{self.base_url}/{method}"
         resp = requests.post(url, json=payload, timeout=10)
         resp.raise_for_status()
@@ -0,0 +1,162 @@
+"""
+Speculative TTS for reviews.
+
+Most reviewed phrases come back from Gemini unchanged, yet TTS used to start
+only after the review. ``start()`` submits synthesis of the *original* text to
+a small shared pool at the same time as the Gemini call; ``Speculation.take()``
+hands the audio over if the corrected text and the resolved voice match, and
+otherwise cancels the task (if it has not started yet) and reports a miss so
+the caller synthesizes the corrected text as before. Voices are compared with
+the caller's ``voice(language)`` resolver (``app._tts_voice``), not by language
+code. Gemini answers ``en`` for a client's ``en-GB``, and a hit must sound the
+same as a miss. When the review fails, the caller calls ``Speculation.cancel()``.
+
+In the async serving mode ``start_async()`` runs the synthesis coroutine as
+an asyncio task instead and ``Speculation.take_async()`` awaits it.
+
+Per-process counters (hits / misses / cancelled / skipped) are available via
+``snapshot()``.
+
+    SPECULATIVE_TTS=true                 on/off
+    SPECULATIVE_TTS_MAX_CHARS=500        longer texts are rarely unchanged — no speculation
+    SPECULATIVE_TTS_WORKERS=4            threads for speculative synthesis
+"""
+import asyncio
+import contextvars
+import os
+import re
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Awaitable, Callable, Hashable, Optional, Tuple
+
+from services import logs, metrics
+
+log = logs.get_logger('tts')
+
+SPECULATIVE_TTS = os.getenv('SPECULATIVE_TTS', 'true').lower() in ('1', 'true', 'yes')
+SPECULATIVE_TTS_MAX_CHARS = int(os.getenv('SPECULATIVE_TTS_MAX_CHARS', '500'))
+SPECULATIVE_TTS_WORKERS = int(os.getenv('SPECULATIVE_TTS_WORKERS', '4'))
+
+_UNKNOWN_LANGUAGES = frozenset(['', 'unknown', 'auto'])
+_WHITESPACE_RE = re.compile(r"\s+")
+
+_pool: Optional[ThreadPoolExecutor] = None
+_pool_lock = threading.Lock()
+_counters = {'started': 0, 'hits': 0, 'misses': 0, 'cancelled': 0, 'skipped': 0}
+_counters_lock = threading.Lock()
+
+
+def _count(name: str):
+    with _counters_lock:
+        _counters[name] += 1
+
+
+def _get_pool() -> ThreadPoolExecutor:
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                _pool = ThreadPoolExecutor(max_workers=max(1, SPECULATIVE_TTS_WORKERS), thread_name_prefix='tts-spec')
+    return _pool
+
+
+def _norm_text(text: str) -> str:
+    return _WHITESPACE_RE.sub(' ', (text or '').strip())
+
+
+def _norm_lang(language: str) -> str:
+    return (language or '').strip().lower().replace('_', '-')
+
+
+VoiceResolver = Callable[[str], Hashable]
+
+
+class Speculation:
+    def __init__(self, future, text: str, language: str, voice: Optional[VoiceResolver] = None):
+        self.future = future
+        self.text = text
+        self.language = language
+        self._voice = voice or _norm_lang
+        self.decided = False
+
+    def _matches(self, corrected: str, language: str) -> bool:
+        # Голос сравниваем после разрешения: 'en' и 'en-GB' могут звучать по-разному
+        return _norm_text(corrected) == _norm_text(self.text) and self._voice(self.language) == self._voice(language)
+
+    def cancel(self):
+        """Проверка не удалась: синтез не нужен. После take() ничего не делает."""
+        if self.decided:
+            return
+        self.decided = True
+        if self.future.cancel():
+            _count('cancelled')
+
+    def _hit(self, audio) -> Tuple[bool, Optional[str]]:
+        _count('hits')
+        metrics.cache_event('tts_speculation', True)
+        return True, audio
+
+    def _miss(self, error: Optional[Exception] = None) -> Tuple[bool, Optional[str]]:
+        if error is not None:
+            log.warning('speculative synthesis error', error=str(error))
+        elif self.future.cancel():
+            _count('cancelled')
+        _count('misses')
+        metrics.cache_event('tts_speculation', False)
+        return False, None
+
+    def take(self, corrected: str, language: str) -> Tuple[bool, Optional[str]]:
+        """(True, audio) при попадании; (False, None) — промах, задача отменена или результат отброшен."""
+        self.decided = True
+        if not self._matches(corrected, language):
+            return self._miss()
+        try:
+            return self._hit(self.future.result())
+        except Exception as e:
+            return self._miss(e)
+
+    async def take_async(self, corrected: str, language: str) -> Tuple[bool, Optional[str]]:
+        """take() для спекуляции из start_async(): ждёт задачу, не блокируя цикл событий."""
+        self.decided = True
+        if not self._matches(corrected, language):
+            return self._miss()
+        try:
+            return self._hit(await self.future)
+        except Exception as e:
+            return self._miss(e)
+
+
+def _should_start(text: str, language: str) -> bool:
+    if not SPECULATIVE_TTS:
+        return False
+    if not text or not text.strip() or len(text) > SPECULATIVE_TTS_MAX_CHARS or _norm_lang(language) in _UNKNOWN_LANGUAGES:
+        _count('skipped')
+        return False
+    _count('started')
+    return True
+
+
+def start(synthesize: Callable[[str, str], Optional[str]], text: str, language: str,
+          voice: Optional[VoiceResolver] = None) -> Optional[Speculation]:
+    """Запустить синтез исходного текста параллельно с проверкой. None — спекуляция не имеет смысла.
+    voice(language) — голос, которым synthesize озвучит язык; по умолчанию сравниваются коды языков."""
+    if not _should_start(text, language):
+        return None
+    future = _get_pool().submit(contextvars.copy_context().run, synthesize, text, language)
+    return Speculation(future, text, language, voice)
+
+
+def start_async(synthesize: Callable[[str, str], Awaitable[Optional[str]]], text: str,
+                language: str, voice: Optional[VoiceResolver] = None) -> Optional[Speculation]:
+    """start() для async-режима: synthesize — корутинная функция, запускается задачей в текущем цикле."""
+    if not _should_start(text, language):
+        return None
+    return Speculation(asyncio.ensure_future(synthesize(text, language)), text, language, voice)
+
+
+def snapshot() -> dict:
+    with _counters_lock:
+        data = dict(_counters)
+    decided = data['hits'] + data['misses']
+    data['hit_rate'] = round(data['hits'] / decided, 4) if decided else 0.0
+    return data
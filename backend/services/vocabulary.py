@@ -0,0 +1,223 @@
+"""
+Per-user vocabulary index: words used in entries and words corrected in reviews.
+
+``user_vocab`` holds one row per (user, language, word). Each row records how
+many times the word occurs in the user's live entries (``uses``), how many
+times a review changed it (``corrected``), and when it was first used
+(``first_seen``). Words come from the review tokenizer (``diff.tokenize``),
+casefolded, without punctuation or numbers. Languages are reduced to the base
+code (``en-US`` -> ``en``).
+
+- Entry handlers apply the word-count difference between the old and new text
+  in their own transaction, the same way as ``services/stats.py``, so
+  ``/api/vocabulary`` never re-tokenizes ``entry``. A row with no uses and no
+  corrections left is deleted. ``first_seen`` is the earliest entry date and
+  is not moved forward when that entry is deleted.
+- Reviews: words of the original text that the token diff behind
+  ``highlight_diff`` replaces or deletes count as corrected.
+- Reads: top-k by uses, corrections or first use, and prefix lookups, served
+  by the primary key ``(user_id, language, word)`` and ``ix_user_vocab_top``.
+- ``rebuild()`` recomputes uses and first_seen from ``entry``
+  (``python manage.py rebuild-vocabulary``); corrections come from reviews,
+  cannot be derived from entries, and are preserved.
+"""
+from collections import Counter, defaultdict
+from datetime import date, datetime
+from typing import Dict, Iterable, Optional, Tuple
+
+from sqlalchemy import delete, func, select, update
+
+from db import Entry, UserVocab
+from services import diff
+from services.rollups import upsert_counters_many
+
+_table = UserVocab.__table__
+_KEY = ['user_id', 'language', 'word']
+
+MAX_WORD_CHARS = 64
+MAX_LIMIT = 500
+SORTS = ('uses', 'corrected', 'recent', 'alpha')
+
+
+def _lang(language: Optional[str]) -> str:
+    return (language or 'unknown').split('-')[0].strip().lower()[:10] or 'unknown'
+
+
+def _day(ts) -> date:
+    if isinstance(ts, datetime):
+        return ts.date()
+    return ts if isinstance(ts, date) else datetime.utcnow().date()
+
+
+def _is_word(token: str) -> bool:
+    return not token.isdigit() and len(token) <= MAX_WORD_CHARS
+
+
+def words(text: str) -> Counter:
+    """Частоты слов текста (casefold), токенизатор — тот же, что у диффа проверки."""
+    tokens = diff.tokenize(text)
+    return Counter(t.casefold() for t, is_word in zip(tokens, diff.word_flags(tokens)) if is_word and _is_word(t))
+
+
+Deltas = Dict[Tuple[str, str], list]
+
+
+def _new_deltas() -> Deltas:
+    # (language, word) -> [uses, corrected, first_seen]
+    return defaultdict(lambda: [0, 0, None])
+
+
+def _add_words(deltas: Deltas, language: str, counts: Counter, sign: int, day: date):
+    for word, n in counts.items():
+        d = deltas[(language, word)]
+        d[0] += sign * n
+        if sign > 0 and (d[2] is None or day < d[2]):
+            d[2] = day
+
+
+def _apply(db, user_id: int, deltas: Deltas):
+    today = datetime.utcnow().date()
+    rows = [
+        {'user_id': user_id, 'language': language, 'word': word, 'uses': uses, 'corrected': corrected,
+         'first_seen': first_seen or today}
+        for (language, word), (uses, corrected, first_seen) in deltas.items()
+        if uses or corrected
+    ]
+    upsert_counters_many(db, _table, _KEY, rows, ['uses', 'corrected'], earliest=['first_seen'])
+    shrunk = defaultdict(list)
+    for row in rows:
+        if row['uses'] < 0:
+            shrunk[row['language']].append(row['word'])
+    for language, doomed in shrunk.items():
+        db.execute(delete(UserVocab).where(
+            UserVocab.user_id == user_id, UserVocab.language == language, UserVocab.word.in_(doomed),
+            UserVocab.uses <= 0, UserVocab.corrected <= 0,
+        ))
+
+
+# --- Incremental updates (caller commits) ---
+
+def entries_added(db, user_id: int, rows: Iterable[dict], sign: int = 1):
+    """Учесть пачку записей (dict с text/language/timestamp); sign=-1 — вычесть."""
+    deltas = _new_deltas()
+    for row in rows:
+        _add_words(deltas, _lang(row.get('language')), words(row.get('text')), sign, _day(row.get('timestamp')))
+    _apply(db, user_id, deltas)
+
+
+def _entry_row(entry) -> dict:
+    return {'text': entry.text, 'language': entry.language, 'timestamp': entry.timestamp}
+
+
+def entry_added(db, entry):
+    entries_added(db, entry.user_id, [_entry_row(entry)])
+
+
+def entry_removed(db, entry):
+    entries_added(db, entry.user_id, [_entry_row(entry)], sign=-1)
+
+
+def entry_changed(db, user_id: int, before_language: Optional[str], before_text: Optional[str], entry):
+    """Применить только разницу частот между старым и новым текстом."""
+    if before_language == entry.language and before_text == entry.text:
+        return
+    deltas = _new_deltas()
+    day = _day(entry.timestamp)
+    _add_words(deltas, _lang(before_language), words(before_text), -1, day)
+    _add_words(deltas, _lang(entry.language), words(entry.text), 1, day)
+    _apply(db, user_id, deltas)
+
+
+def review_recorded(db, user_id: int, language: str, original: str, corrected: str):
+    """Слова исходного текста, которые проверка заменила или удалила, — в счётчик corrected."""
+    a, b = diff.tokenize(original), diff.tokenize(corrected)
+    flags = diff.word_flags(a)
+    changed = Counter()
+    for tag, i1, i2, _, _ in diff.diff_tokens(a, b):
+        if tag in ('replace', 'delete'):
+            changed.update(a[i].casefold() for i in range(i1, i2) if flags[i] and _is_word(a[i]))
+    if not changed:
+        return
+    deltas = _new_deltas()
+    for word, n in changed.items():
+        deltas[(_lang(language), word)][1] += n
+    _apply(db, user_id, deltas)
+
+
+# --- Reads ---
+
+def _prefix_upper(prefix: str) -> str:
+    return prefix[:-1] + chr(ord(prefix[-1]) + 1)
+
+
+def query(db, user_id: int, language: Optional[str] = None, prefix: str = '', sort: str = 'uses',
+          limit: int = 50) -> dict:
+    """Top-k слов пользователя (sort: uses | corrected | recent | alpha), опционально по префиксу."""
+    limit = max(1, min(limit, MAX_LIMIT))
+    scope = [UserVocab.user_id == user_id]
+    if language:
+        scope.append(UserVocab.language == _lang(language))
+    prefix = (prefix or '').strip().casefold()
+    if prefix:
+        # Диапазон по первичному ключу; LIKE страхует от отличий сортировки (collation) в Postgres
+        escaped = prefix.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+        scope += [UserVocab.word >= prefix, UserVocab.word < _prefix_upper(prefix),
+                  UserVocab.word.like(escaped + '%', escape='\\')]
+    if sort == 'corrected':
+        scope.append(UserVocab.corrected > 0)
+    order = {
+        'uses': (UserVocab.uses.desc(), UserVocab.word),
+        'corrected': (UserVocab.corrected.desc(), UserVocab.uses.desc(), UserVocab.word),
+        'recent': (UserVocab.first_seen.desc(), UserVocab.word),
+        'alpha': (UserVocab.word,),
+    }[sort]
+    rows = db.execute(select(UserVocab).where(*scope).order_by(*order).limit(limit)).scalars().all()
+    total = db.scalar(select(func.count()).select_from(UserVocab).where(*scope)) or 0
+    return {
+        'words': [
+            {
+                'word': r.word,
+                'language': r.language,
+                'uses': r.uses,
+                'corrected': r.corrected,
+                'first_seen': r.first_seen.isoformat(),
+            }
+            for r in rows
+        ],
+        'total': int(total),
+    }
+
+
+# --- Backfill ---
+
+def rebuild(db, user_id: Optional[int] = None) -> int:
+    """Пересчитать uses/first_seen из entry. Возвращает число затронутых строк словаря."""
+    scope = [UserVocab.user_id == user_id] if user_id is not None else []
+    db.execute(update(UserVocab).where(*scope).values(uses=0))
+    query = select(Entry.user_id, Entry.language, Entry.text, Entry.timestamp).where(
+        Entry.user_id.is_not(None), Entry.deleted_at.is_(None))
+    if user_id is not None:
+        query = query.where(Entry.user_id == user_id)
+    n = 0
+    current, deltas = None, _new_deltas()
+
+    def _flush():
+        nonlocal n
+        rows = [
+            {'user_id': current, 'language': language, 'word': word, 'uses': uses, 'corrected': 0,
+             'first_seen': first_seen}
+            for (language, word), (uses, _, first_seen) in deltas.items()
+        ]
+        upsert_counters_many(db, _table, _KEY, rows, ['uses'], earliest=['first_seen'], add=False)
+        n += len(rows)
+        deltas.clear()
+
+    # Записи упорядочены по пользователю: в памяти — словарь только одного пользователя
+    for uid, language, text, ts in db.execute(query.order_by(Entry.user_id).execution_options(yield_per=1000)):
+        if uid != current:
+            _flush()
+            current = uid
+        _add_words(deltas, _lang(language), words(text), 1, _day(ts))
+    _flush()
+    db.execute(delete(UserVocab).where(*scope, UserVocab.uses <= 0, UserVocab.corrected <= 0))
+    return n